@@ -5,6 +5,9 @@ It defines the building bricks at the basis of the package.
 Overview:
 
 * :class:`~ethoscope.core.monitor.Monitor` is the most important class. It glues together all the other elements of the package in order to perform (video tracking, interacting , data writing and drawing).
+* :class:`~ethoscope.core.parallel_monitor.ParallelMonitor` is a monitor that tracks ROIs over a pool of worker processes.
+* :class:`~ethoscope.core.pipelined_monitor.PipelinedMonitor` is a monitor that runs acquisition, tracking, writing and drawing in separate stages.
+* :class:`~ethoscope.core.frame_rate_controller.FrameRateController` adapts the rate at which a monitor samples frames to the time taken to process them.
 * :class:`~ethoscope.core.tracking_unit.TrackingUnit` are internally used by monitor. They forces to conceptually treat each ROI independently.
 * :class:`~ethoscope.core.roi.ROI` formalise and facilitates the use of Region Of Interests.
 * :mod:`~ethoscope.core.variables` are custom types of variables that result from tracking and interacting.
@@ -14,5 +17,5 @@ Overview:
 
 __author__ = 'quentin'
 
-__all__ = ["monitor", "tracking_unit", "variables", "roi"]
+__all__ = ["monitor", "parallel_monitor", "pipelined_monitor", "frame_rate_controller", "tracking_unit", "variables", "roi"]
 
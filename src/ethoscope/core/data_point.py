@@ -1,14 +1,72 @@
-import collections
-import copy
-
 __author__ = 'quentin'
 
+from ethoscope.core.variables import BaseRelativeVariable
+
+
+class DataPointSchema(object):
+    __slots__ = ("variables", "header_names", "index", "relative_fields", "_extended")
+    _schemas = {}
+
+    def __init__(self, variables):
+        """
+        The layout of a :class:`~ethoscope.core.data_point.DataPoint`: an ordered tuple of variable types
+        (see :class:`~ethoscope.core.variables.BaseIntVariable`).
+        Schemas are shared by all the data points that have the same variables, so use :meth:`get` rather than
+        the constructor.
+
+        :param variables: the variable types, in order
+        :type variables: tuple(class)
+        """
+        self.variables = tuple(variables)
+        self.header_names = tuple(v.header_name for v in self.variables)
+        self.index = dict((h, i) for i, h in enumerate(self.header_names))
+        self.relative_fields = tuple((i, v) for i, v in enumerate(self.variables) if issubclass(v, BaseRelativeVariable))
+        self._extended = {}
+
+    @classmethod
+    def get(cls, variables):
+        """
+        :param variables: the variable types, in order
+        :type variables: tuple(class)
+        :return: the unique schema for these variables
+        :rtype: :class:`~ethoscope.core.data_point.DataPointSchema`
+        """
+        variables = tuple(variables)
+        try:
+            return cls._schemas[variables]
+        except KeyError:
+            out = cls(variables)
+            cls._schemas[variables] = out
+            return out
+
+    def extended(self, variable):
+        """
+        :param variable: a variable type to append
+        :type variable: class
+        :return: the schema of data points made of the variables of this one, followed by ``variable``.
+        :rtype: :class:`~ethoscope.core.data_point.DataPointSchema`
+        """
+        try:
+            return self._extended[variable]
+        except KeyError:
+            out = DataPointSchema.get(self.variables + (variable,))
+            self._extended[variable] = out
+            return out
+
+    def __len__(self):
+        return len(self.variables)
+
+    def __reduce__(self):
+        return DataPointSchema.get, (self.variables,)
 
-class DataPoint(collections.OrderedDict):
+
+class DataPoint(object):
+    __slots__ = ("_schema", "_values")
 
     def __init__(self, data):
         """
-        A container to store variables. It derived from :class:`~collections.OrderedDict`.
+        A container to store variables. It is a flat list of integer values, laid out according to a
+        :class:`~ethoscope.core.data_point.DataPointSchema`, which is shared with all data points with the same variables.
         Variables are accessible by header name, which is an individual identifier
         of a variable type (see :class:`~ethoscope.core.variables.BaseIntVariable`):
 
@@ -21,30 +79,138 @@ class DataPoint(collections.OrderedDict):
         >>> data.append(h)
         >>> print data
 
+        In the tracking loop, :meth:`from_schema` avoids creating a variable object for each value.
 
         :param data: a list of data points
         :type data: list(:class:`~ethoscope.core.variables.BaseIntVariable`)
         """
-        collections.OrderedDict.__init__(self)
-        for i in data:
-            self.__setitem__(i.header_name, i)
+        self._schema = DataPointSchema.get(type(d) for d in data)
+        self._values = [int(d) for d in data]
+
+    @classmethod
+    def from_schema(cls, schema, values):
+        """
+        Build a data point from a schema and raw values.
+
+        :param schema: the layout of the data point
+        :type schema: :class:`~ethoscope.core.data_point.DataPointSchema`
+        :param values: one integer value per variable of the schema. The list is used, not copied.
+        :type values: list(int)
+        :return: a new data point
+        :rtype: :class:`~ethoscope.core.data_point.DataPoint`
+        """
+        out = cls.__new__(cls)
+        out._schema = schema
+        out._values = values
+        return out
+
+    @property
+    def schema(self):
+        """
+        :return: the layout of this data point
+        :rtype: :class:`~ethoscope.core.data_point.DataPointSchema`
+        """
+        return self._schema
+
+    def as_tuple(self):
+        """
+        :return: the raw values, in the order of the schema
+        :rtype: tuple(int)
+        """
+        return tuple(self._values)
+
+    def __getitem__(self, key):
+        return self._values[self._schema.index[key]]
+
+    def __setitem__(self, key, value):
+        self._values[self._schema.index[key]] = int(value)
+
+    def __contains__(self, key):
+        return key in self._schema.index
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._schema.header_names)
+
+    def __eq__(self, other):
+        if not isinstance(other, DataPoint):
+            return NotImplemented
+        return self._schema is other._schema and self._values == other._values
+
+    def __ne__(self, other):
+        out = self.__eq__(other)
+        if out is NotImplemented:
+            return out
+        return not out
+
+    __hash__ = None
+
+    def get(self, key, default=None):
+        i = self._schema.index.get(key)
+        if i is None:
+            return default
+        return self._values[i]
+
+    def keys(self):
+        return list(self._schema.header_names)
+
+    def values(self):
+        """
+        :return: the values as variable objects. This is slower than :meth:`as_tuple`.
+        :rtype: list(:class:`~ethoscope.core.variables.BaseIntVariable`)
+        """
+        return [v(i) for v, i in zip(self._schema.variables, self._values)]
+
+    def items(self):
+        return list(zip(self._schema.header_names, self.values()))
 
     def copy(self):
         """
-        Deep copy a data point. Copying using the `=` operator will simply create an alias to a `DataPoint`
+        Copy a data point. Copying using the `=` operator will simply create an alias to a `DataPoint`
         object (i.e. allow modification of the original object).
 
         :return: a copy of this object
         :rtype: :class:`~ethoscope.core.data_point.DataPoint`
         """
-        return DataPoint(copy.deepcopy(self.values()))
+        return DataPoint.from_schema(self._schema, list(self._values))
+
+    def to_absolute(self, roi):
+        """
+        Converts the relative variables (e.g. positions), from the top left of a ROI to the top left of the parent image.
+
+        :param roi: a region of interest
+        :type roi: :class:`~ethoscope.core.roi.ROI`
+        :return: a new data point
+        :rtype: :class:`~ethoscope.core.data_point.DataPoint`
+        """
+        values = list(self._values)
+        for i, var in self._schema.relative_fields:
+            if var.offset_axis is None:
+                values[i] = int(var(values[i]).to_absolute(roi))
+            else:
+                values[i] += roi.offset[var.offset_axis]
+        return DataPoint.from_schema(self._schema, values)
+
+    def __reduce__(self):
+        return DataPoint.from_schema, (self._schema, self._values)
+
+    def __repr__(self):
+        return "DataPoint(%s)" % ", ".join("%s=%i" % kv for kv in zip(self._schema.header_names, self._values))
 
     def append(self, item):
         """
         Add a new variable in the `DataPoint` The order is preserved.
+        If a variable with the same header name exists, its value is replaced.
 
         :param item: A variable to be added.
         :param item: :class:`~ethoscope.core.variables.BaseIntVariable`
         :return:
         """
-        self.__setitem__(item.header_name, item)
\ No newline at end of file
+        i = self._schema.index.get(item.header_name)
+        if i is None:
+            self._schema = self._schema.extended(type(item))
+            self._values.append(int(item))
+        else:
+            self._values[i] = int(item)
@@ -0,0 +1,86 @@
+__author__ = 'quentin'
+
+
+class FrameRateController(object):
+
+    def __init__(self, min_fps=1.0, max_fps=20.0, target_load=.8, smoothing=.1, min_change=.05):
+        """
+        Adapts the rate at which a :class:`~ethoscope.core.monitor.Monitor` samples frames to the time it needs to
+        process them. The processing time is smoothed with an exponential moving average, and the rate is set so that
+        processing takes ``target_load`` of the time between two frames, within ``[min_fps, max_fps]``.
+        The monitor sets the frame rate of the camera to this rate (see
+        :meth:`~ethoscope.hardware.input.cameras.BaseCamera.set_frame_rate`), so ``max_fps`` can be above the initial
+        rate of the camera. Cameras that cannot change their rate have their frames dropped instead.
+
+        :param min_fps: the lowest sampling rate
+        :type min_fps: float
+        :param max_fps: the highest sampling rate. It is also the initial rate.
+        :type max_fps: float
+        :param target_load: the fraction of the time spent processing frames, between 0 and 1
+        :type target_load: float
+        :param smoothing: the weight of the last processing time in the moving average, between 0 and 1
+        :type smoothing: float
+        :param min_change: the relative change of rate, since the last recorded one, for a new rate to be recorded
+        :type min_change: float
+        """
+        if not 0 < min_fps <= max_fps:
+            raise ValueError("Frame rate bounds must satisfy 0 < min_fps <= max_fps")
+        if not 0 < target_load <= 1:
+            raise ValueError("The target load must be between 0 and 1")
+        self._min_fps = float(min_fps)
+        self._max_fps = float(max_fps)
+        self._target_load = target_load
+        self._smoothing = smoothing
+        self._min_change = min_change
+
+        self._fps = self._max_fps
+        self._mean_time = None
+        self._recorded_fps = None
+
+    @property
+    def fps(self):
+        """
+        :return: The current sampling rate, in frames per second.
+        :rtype: float
+        """
+        return self._fps
+
+    @property
+    def interval(self):
+        """
+        :return: The current time between two frames, in s.
+        :rtype: float
+        """
+        return 1.0 / self._fps
+
+    @property
+    def mean_processing_time(self):
+        """
+        :return: The smoothed processing time of a frame, in s. `None` before the first update.
+        :rtype: float
+        """
+        return self._mean_time
+
+    def update(self, processing_time):
+        """
+        Adjust the sampling rate to the time needed to process the last frame.
+
+        :param processing_time: the time spent processing the last frame, in s
+        :type processing_time: float
+        :return: whether the rate changed enough to be recorded (always true the first time)
+        :rtype: bool
+        """
+        if self._mean_time is None:
+            self._mean_time = processing_time
+        else:
+            self._mean_time += self._smoothing * (processing_time - self._mean_time)
+
+        if self._mean_time > 0:
+            self._fps = min(self._max_fps, max(self._min_fps, self._target_load / self._mean_time))
+        else:
+            self._fps = self._max_fps
+
+        if self._recorded_fps is None or abs(self._fps - self._recorded_fps) > self._min_change * self._recorded_fps:
+            self._recorded_fps = self._fps
+            return True
+        return False
@@ -3,16 +3,30 @@ __author__ = 'quentin'
 from ethoscope.core.variables import \
   XPosVariable, YPosVariable, XYDistance, WidthVariable, HeightVariable, PhiVariable, Label, IsInferredVariable
 from ethoscope.stimulators.stimulators import HasInteractedVariable
-from ethoscope.core.data_point import DataPoint
+from ethoscope.core.data_point import DataPoint, DataPointSchema
 from .tracking_unit import TrackingUnit
+from ethoscope.trackers.trackers import ScratchPool
 import logging
+import time
 import traceback
 
 
 class Monitor(object):
+    _description = {"overview": "The default monitor. Tracks all ROIs one after the other, and can be used with any stimulator.",
+                    "arguments": []}
+
+    # the layout of the zero filled data row of ROIs without detection. Schemas are immutable, so it can be shared
+    _null_schema = DataPointSchema.get([XPosVariable,
+                                        YPosVariable,
+                                        WidthVariable,
+                                        HeightVariable,
+                                        PhiVariable,
+                                        XYDistance,
+                                        IsInferredVariable,
+                                        HasInteractedVariable])
 
     def __init__(self, camera, tracker_class,
-                 rois = None, stimulators=None,
+                 rois = None, stimulators=None, crop_to_rois=False, frame_rate_controller=None,
                  *args, **kwargs  # extra arguments for the tracker objects
                  ):
         r"""
@@ -34,8 +48,20 @@ class Monitor(object):
         :type rois: list(:class:`~ethoscope.core.roi.ROI`)
         :param stimulators: The class that will be used to analyse the position of the object and interact with the system/hardware.
         :type stimulators: list(:class:`~ethoscope.stimulators.stimulators.BaseInteractor`
+        :param crop_to_rois: Whether the camera crops frames to the bounding rectangle of all ROIs, when acquiring them.
+            Positions are unchanged, but frames given to the result writer and the drawer are cropped.
+            The camera and the ROIs only crop frames while the monitor runs.
+        :type crop_to_rois: bool
+        :param frame_rate_controller: Adapts the rate at which frames are sampled to the time taken to process them.
+            Each new rate is given to the camera (see :meth:`~ethoscope.hardware.input.cameras.BaseCamera.set_frame_rate`),
+            or, if the camera cannot change its rate, frames are dropped to match it. Each new rate is saved by the result writer.
+            `None` processes frames as fast as the camera provides them.
+        :type frame_rate_controller: :class:`~ethoscope.core.frame_rate_controller.FrameRateController`
         :param args: additional arguments passed to the tracking algorithm
-        :param kwargs: additional keyword arguments passed to the tracking algorithm
+        :param kwargs: additional keyword arguments passed to the tracking algorithm.
+            Trackers that use a :class:`~ethoscope.trackers.trackers.ScratchPool` share one, created by the monitor unless given as ``scratch_pool``.
+            A :class:`~ethoscope.trackers.adaptive_bg_tracker.BatchedBackgroundModel` given as ``batched_bg_model`` is flushed
+            once all ROIs of a frame are tracked.
         """
 
         self._camera = camera
@@ -44,11 +70,22 @@ class Monitor(object):
         self._last_positions = {}
         self._last_time_stamp = 0
         self._is_running = False
+        self._frame_rate_controller = frame_rate_controller
+        # the rate given to the camera, whether the camera acquires frames at this rate, and the last sampled time
+        self._sampling_fps = None
+        self._camera_sets_rate = False
+        self._last_sample_t = None
 
 
         if rois is None:
             raise NotImplementedError("rois must exist (cannot be None)")
 
+        # trackers run one after the other, so they can share scratch buffers
+        if tracker_class._uses_scratch_pool and kwargs.get("scratch_pool") is None:
+            kwargs["scratch_pool"] = ScratchPool()
+        self._scratch_pool = kwargs.get("scratch_pool")
+        self._batched_bg_model = kwargs.get("batched_bg_model")
+
         if stimulators is None:
             self._unit_trackers = [TrackingUnit(tracker_class, r, None, *args, **kwargs) for r in rois]
 
@@ -57,6 +94,32 @@ class Monitor(object):
         else:
             raise ValueError("You should have one interactor per ROI")
 
+        # the rectangle frames are cropped to while the monitor runs, or `None`
+        self._crop_rectangle = self._rois_rectangle(rois) if crop_to_rois else None
+
+    def _rois_rectangle(self, rois):
+        rects = [r.rectangle for r in rois]
+        x0 = max(0, min(r[0] for r in rects))
+        y0 = max(0, min(r[1] for r in rects))
+        x1 = max(r[0] + r[2] for r in rects)
+        y1 = max(r[1] + r[3] for r in rects)
+        if self._camera.resolution is not None:
+            x1 = min(x1, self._camera.resolution[0])
+            y1 = min(y1, self._camera.resolution[1])
+        return x0, y0, x1 - x0, y1 - y0
+
+    def _crop_to_rois(self):
+        logging.info("Cropping frames to the ROIs: %s" % str(self._crop_rectangle))
+        self._camera.set_crop(self._crop_rectangle)
+        for track_u in self._unit_trackers:
+            track_u.roi.set_frame_offset(self._crop_rectangle[0:2])
+
+    def _uncrop(self):
+        # ROIs may be used again on full frames, e.g. by another monitor
+        self._camera.set_crop(None)
+        for track_u in self._unit_trackers:
+            track_u.roi.set_frame_offset((0, 0))
+
     @property
     def last_positions(self):
         """
@@ -101,61 +164,122 @@ class Monitor(object):
         try:
             logging.info("Monitor starting a run")
             self._is_running = True
-
-            for i, (t, frame) in enumerate(self._camera):
-
-                #logging.info("Monitor: frame: %d, time: %d" % (i, t))
-                if self._force_stop:
-                    logging.info("Monitor object stopped from external request")
-                    break
-
-                self._last_frame_idx = i
-                self._last_time_stamp = t
-                self._frame_buffer = frame
-                #logStr = "Monitor: frame: %d, time: %d" % (i, t)
-                empty_cnt = 0
-                for j, track_u in enumerate(self._unit_trackers):
-                    data_rows = track_u.track(t, frame)
-                    if len(data_rows) == 0:
-                        self._last_positions[track_u.roi.idx] = []
-                        empty_cnt += 1
-                        # L. Zi do not skip trackers not returning a detection
-                        # but fill in a data row with zero values
-                        #continue
-                        data_rows = [DataPoint([XPosVariable(0),
-                                                YPosVariable(0),
-                                                WidthVariable(0),
-                                                HeightVariable(0),
-                                                PhiVariable(0),
-                                                XYDistance(0),
-                                                IsInferredVariable(0),
-                                                HasInteractedVariable(0)]) ]
-
-                    abs_pos = track_u.get_last_positions(absolute=True)
-
-                    # if abs_pos is not None:
-                    self._last_positions[track_u.roi.idx] = abs_pos
-
-                    if not result_writer is None:
-                        #logging.info(logStr + ", Roi: %d, %s" % (track_u.roi.idx, data_rows))
-                        result_writer.write(t, track_u.roi, data_rows)
-
-                #logging.info(logStr + " empty data cnt: %d" % (empty_cnt))
-                if result_writer is not None:
-                    result_writer.flush(t, frame)
-
-                if drawer is not None:
-                    drawer.draw(frame, t, self._last_positions, self._unit_trackers)
-                self._last_t = t
+            if self._crop_rectangle is not None:
+                self._crop_to_rois()
+            self._run_loop(result_writer, drawer)
 
         except Exception as e:
-            logging.error("Monitor closing with an exception: '%s'" % traceback.format_exc(e))
+            logging.error("Monitor closing with an exception: '%s'" % traceback.format_exc())
             raise e
 
         finally:
             self._is_running = False
+            if self._crop_rectangle is not None:
+                self._uncrop()
             logging.info("Monitor closing")
 
+    def _set_sampling_rate(self, fps):
+        self._sampling_fps = fps
+        self._camera_sets_rate = self._camera.set_frame_rate(fps)
 
+    def _is_sampled(self, t):
+        """
+        :param t: the time stamp of a frame, in ms
+        :return: Whether a frame is processed at the current sampling rate. When the camera cannot acquire frames at
+            this rate, the frames acquired too early after the last sampled one are dropped.
+        :rtype: bool
+        """
+        if self._frame_rate_controller is None or self._camera_sets_rate:
+            return True
+        if self._last_sample_t is not None and t - self._last_sample_t < 1000.0 / self._sampling_fps:
+            return False
+        self._last_sample_t = t
+        return True
+
+    def _run_loop(self, result_writer, drawer):
+        if self._frame_rate_controller is not None:
+            self._last_sample_t = None
+            self._set_sampling_rate(self._frame_rate_controller.fps)
+
+        for i, (t, frame) in enumerate(self._camera):
+
+            #logging.info("Monitor: frame: %d, time: %d" % (i, t))
+            if self._force_stop:
+                logging.info("Monitor object stopped from external request")
+                break
+
+            if not self._is_sampled(t):
+                continue
+
+            frame_start = time.time()
+            self._last_frame_idx = i
+            self._last_time_stamp = t
+            self._frame_buffer = frame
+            #logStr = "Monitor: frame: %d, time: %d" % (i, t)
+            rows = self._tracked_rows(t, frame)
+
+            if result_writer is not None:
+                self._write_rows(result_writer, t, frame, rows)
+
+            if drawer is not None:
+                drawer.draw(frame, t, self._last_positions, self._unit_trackers)
+            self._last_t = t
+
+            if self._frame_rate_controller is not None:
+                processing_time = time.time() - frame_start
+                if self._frame_rate_controller.update(processing_time):
+                    self._set_sampling_rate(self._frame_rate_controller.fps)
+                    if result_writer is not None:
+                        result_writer.write_frame_rate(t, self._frame_rate_controller.fps, processing_time)
+
+    def _tracked_rows(self, t, frame):
+        """
+        Tracks all ROIs on a frame, updates the last positions and fills a data row with zero values for
+        ROIs that did not return any detection.
 
-
+        :return: For each tracking unit, in ROI order, its ROI and the data rows to save.
+        :rtype: list((:class:`~ethoscope.core.roi.ROI`, list(:class:`~ethoscope.core.data_point.DataPoint`)))
+        """
+        out = []
+        empty_cnt = 0
+        for track_u, data_rows, abs_pos in self._track_frame(t, frame):
+            if len(data_rows) == 0:
+                empty_cnt += 1
+                # L. Zi do not skip trackers not returning a detection
+                # but fill in a data row with zero values
+                #continue
+                # a new row each time, as result writers may keep or modify the rows they are given
+                data_rows = [DataPoint.from_schema(self._null_schema, [0] * len(self._null_schema))]
+
+            # if abs_pos is not None:
+            self._last_positions[track_u.roi.idx] = abs_pos
+            out.append((track_u.roi, data_rows))
+
+        #logging.info(logStr + " empty data cnt: %d" % (empty_cnt))
+        return out
+
+    def _write_rows(self, result_writer, t, frame, rows):
+        for roi, data_rows in rows:
+            #logging.info(logStr + ", Roi: %d, %s" % (roi.idx, data_rows))
+            result_writer.write(t, roi, data_rows)
+        result_writer.flush(t, frame)
+
+    def _track_frame(self, t, frame):
+        """
+        Runs every tracking unit on a frame.
+
+        :param t: the time stamp associated to the provided frame (in ms).
+        :type t: int
+        :param frame: the entire frame to analyse
+        :type frame: :class:`~numpy.ndarray`
+        :return: For each tracking unit, in ROI order, a tuple of the unit, the data rows it returned and its last absolute positions.
+        :rtype: list((:class:`~ethoscope.core.tracking_unit.TrackingUnit`, list, list))
+        """
+        out = []
+        for track_u in self._unit_trackers:
+            data_rows = track_u.track(t, frame)
+            abs_pos = track_u.get_last_positions(absolute=True)
+            out.append((track_u, data_rows, abs_pos))
+        if self._batched_bg_model is not None:
+            self._batched_bg_model.flush()
+        return out
@@ -0,0 +1,212 @@
+"""
+A monitor that tracks ROIs over a pool of worker processes, so tracking uses all CPU cores.
+
+Stimulators are run within the workers, where they cannot drive a hardware interface.
+So :class:`~ethoscope.core.parallel_monitor.ParallelMonitor` cannot be used with the stimulators that interact with
+the animals through hardware (e.g. sleep deprivation, odour or optomotor stimulators).
+Such experiments must use the sequential :class:`~ethoscope.core.monitor.Monitor`.
+"""
+
+__author__ = 'quentin'
+
+import ctypes
+import logging
+import multiprocessing
+import traceback
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy as np
+
+from ethoscope.core.monitor import Monitor
+from ethoscope.utils.debug import EthoscopeException
+
+
+class TrackingWorker(multiprocessing.Process):
+
+    def __init__(self, worker_idx, unit_trackers, frame_array, job_queue, result_queue, batched_bg_model=None):
+        """
+        A process that owns a subset of the tracking units of a :class:`~ethoscope.core.parallel_monitor.ParallelMonitor`.
+        For each job, it reads the current frame from shared memory, runs its tracking units in order,
+        and sends back their data rows and absolute positions.
+        Designed to be used within :class:`~ethoscope.core.parallel_monitor.ParallelMonitor`.
+
+        :param worker_idx: the index of this worker
+        :type worker_idx: int
+        :param unit_trackers: the tracking units this worker is responsible for
+        :type unit_trackers: list(:class:`~ethoscope.core.tracking_unit.TrackingUnit`)
+        :param frame_array: the shared memory where the parent process copies each frame
+        :type frame_array: :class:`~multiprocessing.sharedctypes.RawArray`
+        :param job_queue: a queue of ``(t, shape)`` jobs. ``None`` stops the worker
+        :type job_queue: :class:`~multiprocessing.Queue`
+        :param result_queue: a queue, shared by all workers, where results are sent
+        :type result_queue: :class:`~multiprocessing.Queue`
+        :param batched_bg_model: the background model shared by the trackers, flushed after each job. `None` if there is none
+        :type batched_bg_model: :class:`~ethoscope.trackers.adaptive_bg_tracker.BatchedBackgroundModel`
+        """
+        self._worker_idx = worker_idx
+        self._unit_trackers = unit_trackers
+        self._frame_array = frame_array
+        self._job_queue = job_queue
+        self._result_queue = result_queue
+        self._batched_bg_model = batched_bg_model
+        super(TrackingWorker, self).__init__()
+
+    def run(self):
+        try:
+            buff = np.frombuffer(self._frame_array, dtype=np.uint8)
+            while True:
+                job = self._job_queue.get()
+                if job is None:
+                    break
+                t, shape = job
+                frame = buff[0:int(np.prod(shape))].reshape(shape)
+
+                out = []
+                for track_u in self._unit_trackers:
+                    data_rows = track_u.track(t, frame)
+                    out.append((data_rows, track_u.get_last_positions(absolute=True)))
+                if self._batched_bg_model is not None:
+                    self._batched_bg_model.flush()
+                self._result_queue.put((self._worker_idx, out))
+
+        except KeyboardInterrupt:
+            pass
+        except Exception:
+            self._result_queue.put((self._worker_idx, traceback.format_exc()))
+        finally:
+            self._result_queue.close()
+
+
+class ParallelMonitor(Monitor):
+    _description = {"overview": "Tracks ROIs over several processes, to use all CPU cores. "
+                                "It cannot be used with stimulators that drive hardware, e.g. sleep deprivation.",
+                    "arguments": [
+                    {"type": "number", "min": 1, "max": 16, "step": 1, "name": "n_workers", "description": "The number of worker processes", "default": 4},
+                    ]}
+
+    _result_timeout = 1.0 # s
+
+    def __init__(self, camera, tracker_class, rois=None, stimulators=None, n_workers=None, *args, **kwargs):
+        r"""
+        A :class:`~ethoscope.core.monitor.Monitor` that spreads its tracking units over a fixed pool of worker processes.
+        The tracking units are handed to the workers when the first frame arrives. From then on, each worker owns the state of
+        its trackers, and reads every frame from shared memory rather than receiving a copy of it.
+        Results are put back in ROI order, so result writers and drawers work as with the sequential monitor.
+
+        Stimulators are run within the workers, so they cannot drive a hardware interface: stimulators with a hardware
+        connection (e.g. for sleep deprivation) raise a `NotImplementedError`, and need a :class:`~ethoscope.core.monitor.Monitor`.
+
+        :param camera: a camera object responsible of acquiring frames and associated time stamps
+        :type camera: :class:`~ethoscope.hardware.input.cameras.BaseCamera`
+        :param tracker_class: The algorithm that will be used for tracking. It must inherit from :class:`~ethoscope.trackers.trackers.BaseTracker`
+        :type tracker_class: class
+        :param rois: A list of region of interest.
+        :type rois: list(:class:`~ethoscope.core.roi.ROI`)
+        :param stimulators: The class that will be used to analyse the position of the object and interact with the system/hardware.
+        :type stimulators: list(:class:`~ethoscope.stimulators.stimulators.BaseInteractor`
+        :param n_workers: the number of worker processes. `None` means one per CPU core.
+        :type n_workers: int
+        :param args: additional arguments passed to the tracking algorithm
+        :param kwargs: additional keyword arguments passed to the tracking algorithm
+        """
+        super(ParallelMonitor, self).__init__(camera, tracker_class, rois, stimulators, *args, **kwargs)
+
+        for track_u in self._unit_trackers:
+            if track_u.stimulator._hardware_connection is not None:
+                raise NotImplementedError("Stimulators using a hardware interface cannot be run in parallel")
+
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+        self._n_workers = max(1, min(n_workers, len(self._unit_trackers)))
+
+        self._workers = []
+        self._job_queues = []
+        self._result_queue = None
+        self._frame_array = None
+        self._frame_shape = None
+
+    @property
+    def n_workers(self):
+        """
+        :return: The number of worker processes used for tracking.
+        :rtype: int
+        """
+        return self._n_workers
+
+    def run(self, result_writer = None, drawer = None):
+        try:
+            super(ParallelMonitor, self).run(result_writer, drawer)
+        finally:
+            self._stop_workers()
+
+    def _start_workers(self, frame):
+        logging.info("Starting %i tracking workers" % self._n_workers)
+        self._frame_shape = frame.shape
+        self._frame_array = multiprocessing.RawArray(ctypes.c_uint8, frame.size)
+        self._result_queue = multiprocessing.Queue()
+
+        for i in range(self._n_workers):
+            job_queue = multiprocessing.Queue()
+            worker = TrackingWorker(i, self._unit_trackers[i::self._n_workers],
+                                    self._frame_array, job_queue, self._result_queue, self._batched_bg_model)
+            worker.daemon = True
+            worker.start()
+            self._job_queues.append(job_queue)
+            self._workers.append(worker)
+
+    def _stop_workers(self):
+        if len(self._workers) == 0:
+            return
+        logging.info("Stopping tracking workers")
+        for q in self._job_queues:
+            q.put(None)
+        for w in self._workers:
+            w.join(10)
+            if w.is_alive():
+                logging.warning("Tracking worker %s did not stop. Terminating it" % w.name)
+                w.terminate()
+        for q in self._job_queues:
+            q.close()
+        self._result_queue.close()
+
+        self._workers = []
+        self._job_queues = []
+        self._result_queue = None
+        self._frame_array = None
+
+    def _get_result(self):
+        while True:
+            try:
+                return self._result_queue.get(timeout=self._result_timeout)
+            except queue.Empty:
+                for w in self._workers:
+                    if not w.is_alive():
+                        raise EthoscopeException("Tracking worker %s stopped unexpectedly" % w.name)
+
+    def _track_frame(self, t, frame):
+        if len(self._workers) == 0:
+            self._start_workers(frame)
+
+        if frame.shape != self._frame_shape or frame.dtype != np.uint8:
+            raise EthoscopeException("All frames must be uint8 images of shape %s. Got %s %s" %
+                                     (str(self._frame_shape), frame.dtype, str(frame.shape)), frame)
+
+        buff = np.frombuffer(self._frame_array, dtype=np.uint8).reshape(self._frame_shape)
+        np.copyto(buff, frame)
+
+        for q in self._job_queues:
+            q.put((t, self._frame_shape))
+
+        out = [None] * len(self._unit_trackers)
+        for _ in range(self._n_workers):
+            worker_idx, results = self._get_result()
+            if not isinstance(results, list):
+                raise EthoscopeException("Tracking worker %i failed:\n%s" % (worker_idx, results))
+            for j, (data_rows, abs_pos) in enumerate(results):
+                unit_idx = worker_idx + j * self._n_workers
+                out[unit_idx] = (self._unit_trackers[unit_idx], data_rows, abs_pos)
+        return out
@@ -0,0 +1,284 @@
+__author__ = 'quentin'
+
+import logging
+import sys
+import threading
+import time
+import traceback
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from ethoscope.core.monitor import Monitor
+
+
+class StageQueue(queue.Queue):
+
+    block, drop_newest, drop_oldest = "block", "drop_newest", "drop_oldest"
+    _policies = {block, drop_newest, drop_oldest}
+
+    def __init__(self, maxsize, drop_policy="block"):
+        """
+        A bounded queue between two stages of a :class:`~ethoscope.core.pipelined_monitor.PipelinedMonitor`.
+        It keeps track of its maximal depth, of the number of items it dropped, and of the number of times the previous
+        stage had to wait for space in the queue (i.e. back-pressure).
+
+        :param maxsize: the maximal number of items in the queue
+        :type maxsize: int
+        :param drop_policy: what to do when the queue is full. ``"block"`` waits for the next stage to catch up,
+            ``"drop_newest"`` discards the incoming item and ``"drop_oldest"`` discards the oldest queued item.
+        :type drop_policy: str
+        """
+        if drop_policy not in self._policies:
+            raise ValueError("Unknown drop policy '%s'. Use one of %s" % (drop_policy, sorted(self._policies)))
+        queue.Queue.__init__(self, maxsize)
+        self._drop_policy = drop_policy
+        self.max_depth = 0
+        self.n_dropped = 0
+        self.n_blocked = 0
+        self.n_put = 0
+
+    def push(self, item, stop_event=None, timeout=.1):
+        """
+        Add an item to the queue according to the drop policy.
+
+        :param item: the item to add
+        :param stop_event: when set, stop waiting for space in the queue (blocking policy only)
+        :type stop_event: :class:`~threading.Event`
+        :return: whether the item was queued
+        :rtype: bool
+        """
+        if self._drop_policy == self.block:
+            try:
+                self.put_nowait(item)
+            except queue.Full:
+                self.n_blocked += 1
+                while True:
+                    try:
+                        self.put(item, timeout=timeout)
+                        break
+                    except queue.Full:
+                        if stop_event is not None and stop_event.is_set():
+                            return False
+        else:
+            try:
+                self.put_nowait(item)
+            except queue.Full:
+                self.n_dropped += 1
+                if self._drop_policy == self.drop_newest:
+                    return False
+                try:
+                    self.get_nowait()
+                except queue.Empty:
+                    pass
+                self.put_nowait(item)
+
+        self.n_put += 1
+        self.max_depth = max(self.max_depth, self.qsize())
+        return True
+
+    def stats(self):
+        """
+        :return: the current depth, the maximal depth reached, the number of dropped items and the number of
+            times an item had to wait for space in the queue.
+        :rtype: dict
+        """
+        return {"depth": self.qsize(),
+                "max_depth": self.max_depth,
+                "dropped": self.n_dropped,
+                "blocked": self.n_blocked,
+                "queued": self.n_put}
+
+
+class PipelinedMonitor(Monitor):
+
+    _stop_item = None
+
+    def __init__(self, camera, tracker_class, rois=None, stimulators=None,
+                 frame_queue_size=4, writer_queue_size=16, drawer_queue_size=2, drawer_drop_policy="drop_oldest",
+                 frame_drop_policy="block", writer_drop_policy="block", *args, **kwargs):
+        r"""
+        A :class:`~ethoscope.core.monitor.Monitor` that runs acquisition, tracking, result writing and drawing as
+        separate stages, connected by bounded queues:
+
+         * Acquisition (a thread) reads the camera and copies frames, so cameras can reuse their buffers.
+         * Tracking (the thread calling :meth:`~ethoscope.core.monitor.Monitor.run`) tracks all ROIs, then hands results to the next stages.
+         * Writing (a thread) saves the results.
+         * Drawing (a thread) annotates frames. This stage is not critical, so frames can be dropped.
+
+        This way, a slow snapshot or video write does not stall acquisition and tracking, as long as the queues absorb it.
+        When a queue is full, its drop policy decides what happens. With ``"block"``, the default for frames and results,
+        the previous stage waits: a writer that stays late slows tracking down, which slows acquisition down
+        (asynchronous cameras then drop frames, and video files are read more slowly). No result is lost, but live
+        cameras that do not drop frames themselves should use ``frame_drop_policy="drop_oldest"``. With
+        ``writer_drop_policy="drop_oldest"``, tracking never waits for the writer, and late results are dropped instead.
+        The queue depth, drop and wait counters of each stage are available through :attr:`stage_stats`.
+
+        :param camera: a camera object responsible of acquiring frames and associated time stamps
+        :type camera: :class:`~ethoscope.hardware.input.cameras.BaseCamera`
+        :param tracker_class: The algorithm that will be used for tracking. It must inherit from :class:`~ethoscope.trackers.trackers.BaseTracker`
+        :type tracker_class: class
+        :param rois: A list of region of interest.
+        :type rois: list(:class:`~ethoscope.core.roi.ROI`)
+        :param stimulators: The class that will be used to analyse the position of the object and interact with the system/hardware.
+        :type stimulators: list(:class:`~ethoscope.stimulators.stimulators.BaseInteractor`
+        :param frame_queue_size: the number of acquired frames waiting to be tracked
+        :type frame_queue_size: int
+        :param writer_queue_size: the number of tracked frames waiting to be saved
+        :type writer_queue_size: int
+        :param drawer_queue_size: the number of tracked frames waiting to be drawn
+        :type drawer_queue_size: int
+        :param drawer_drop_policy: What to do when the drawer is late: ``"drop_oldest"``, ``"drop_newest"`` or ``"block"``
+        :type drawer_drop_policy: str
+        :param frame_drop_policy: What to do when tracking is late: ``"block"``, ``"drop_oldest"`` or ``"drop_newest"``
+        :type frame_drop_policy: str
+        :param writer_drop_policy: What to do when the writer is late: ``"block"``, ``"drop_oldest"`` or ``"drop_newest"``
+        :type writer_drop_policy: str
+        :param args: additional arguments passed to the tracking algorithm
+        :param kwargs: additional keyword arguments passed to the tracking algorithm
+        """
+        super(PipelinedMonitor, self).__init__(camera, tracker_class, rois, stimulators, *args, **kwargs)
+        self._frame_queue = StageQueue(frame_queue_size, frame_drop_policy)
+        self._writer_queue = StageQueue(writer_queue_size, writer_drop_policy)
+        self._drawer_queue = StageQueue(drawer_queue_size, drawer_drop_policy)
+        self._stop_event = threading.Event()
+        self._stage_errors = []
+
+    @property
+    def stage_stats(self):
+        """
+        :return: The queue depth counters of the acquisition, writer and drawer stages.
+        :rtype: dict
+        """
+        return {"acquisition": self._frame_queue.stats(),
+                "writer": self._writer_queue.stats(),
+                "drawer": self._drawer_queue.stats()}
+
+    def _run_stage(self, target, *args):
+        try:
+            target(*args)
+        except Exception:
+            # the traceback of the stage is logged here, since python 2 loses it when the exception is raised again
+            logging.error("Pipeline stage '%s' stopped with an exception:\n%s" % (target.__name__, traceback.format_exc()))
+            self._stage_errors.append(sys.exc_info())
+            self._stop_event.set()
+
+    def _stop_stage(self, stage_queue, thread):
+        while thread.is_alive():
+            try:
+                stage_queue.put(self._stop_item, timeout=.1)
+                return
+            except queue.Full:
+                pass
+
+    def _acquire(self):
+        try:
+            applied_fps = self._sampling_fps
+            for i, (t, frame) in enumerate(self._camera):
+                if self._stop_event.is_set():
+                    break
+                # the sampling rate is set by the tracking stage, and given to the camera by this one
+                if self._sampling_fps != applied_fps:
+                    applied_fps = self._sampling_fps
+                    self._set_sampling_rate(applied_fps)
+                if not self._is_sampled(t):
+                    continue
+                # depending on the drop policy, the frame may be dropped, but acquisition goes on
+                self._frame_queue.push((i, t, frame.copy()), self._stop_event)
+        finally:
+            # the stop item is never dropped
+            while not self._stop_event.is_set():
+                try:
+                    self._frame_queue.put(self._stop_item, timeout=.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def _write(self, result_writer):
+        while True:
+            item = self._writer_queue.get()
+            if item is self._stop_item:
+                break
+            t, frame, rows, new_rate = item
+            self._write_rows(result_writer, t, frame, rows)
+            if new_rate is not None:
+                result_writer.write_frame_rate(t, *new_rate)
+
+    def _draw(self, drawer):
+        while True:
+            item = self._drawer_queue.get()
+            if item is self._stop_item:
+                break
+            t, frame, positions = item
+            drawer.draw(frame, t, positions, self._unit_trackers)
+
+    def _run_loop(self, result_writer, drawer):
+        self._stop_event.clear()
+        self._stage_errors = []
+        if self._frame_rate_controller is not None:
+            self._last_sample_t = None
+            self._set_sampling_rate(self._frame_rate_controller.fps)
+        threads = [threading.Thread(target=self._run_stage, args=(self._acquire,), name="acquisition")]
+        if result_writer is not None:
+            threads.append(threading.Thread(target=self._run_stage, args=(self._write, result_writer), name="writer"))
+        if drawer is not None:
+            threads.append(threading.Thread(target=self._run_stage, args=(self._draw, drawer), name="drawer"))
+        for th in threads:
+            th.daemon = True
+            th.start()
+
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    item = self._frame_queue.get(timeout=.1)
+                except queue.Empty:
+                    continue
+
+                if item is self._stop_item:
+                    break
+
+                if self._force_stop:
+                    logging.info("Monitor object stopped from external request")
+                    break
+
+                i, t, frame = item
+                self._last_frame_idx = i
+                self._last_time_stamp = t
+                self._frame_buffer = frame
+                tracking_start = time.time()
+                rows = self._tracked_rows(t, frame)
+                new_rate = None
+                if self._frame_rate_controller is not None:
+                    tracking_time = time.time() - tracking_start
+                    if self._frame_rate_controller.update(tracking_time):
+                        new_rate = (self._frame_rate_controller.fps, tracking_time)
+                        self._sampling_fps = new_rate[0]
+
+                if result_writer is not None:
+                    self._writer_queue.push((t, frame, rows, new_rate), self._stop_event)
+
+                if drawer is not None:
+                    self._drawer_queue.push((t, frame, dict(self._last_positions)), self._stop_event)
+                self._last_t = t
+
+        finally:
+            # the writer gets all results tracked so far before stopping
+            self._stop_event.set()
+            while not self._frame_queue.empty():
+                self._frame_queue.get()
+            for th in threads:
+                if th.name == "writer":
+                    self._stop_stage(self._writer_queue, th)
+                elif th.name == "drawer":
+                    self._stop_stage(self._drawer_queue, th)
+                th.join()
+            logging.info("Pipeline stages stopped: %s" % str(self.stage_stats))
+            if self._writer_queue.n_dropped > 0:
+                logging.warning("%i tracked frames were not saved, because the writer was late" % self._writer_queue.n_dropped)
+
+        if len(self._stage_errors) > 0:
+            # on python 3, the exception keeps the traceback of the stage
+            exc_type, exc_value, exc_tb = self._stage_errors[0]
+            raise exc_value
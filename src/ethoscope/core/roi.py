@@ -6,6 +6,8 @@ __author__ = 'quentin'
 
 
 class ROI(object):
+    # the position of the frames given to `apply`, in the full frame
+    _frame_offset = (0, 0)
 
     def __init__(self, polygon, idx, value=None, orientation = None, regions=None):
         """
@@ -72,6 +74,23 @@ class ROI(object):
         x,y,w,h = self._rectangle
         return x,y
 
+    @property
+    def frame_offset(self):
+        """
+        :return: the x,y position, in the frame the ROI was build on, of the top left corner of the frames
+            given to :meth:`apply`. It is not null when frames are cropped at acquisition.
+        :rtype: (int,int)
+        """
+        return self._frame_offset
+
+    def set_frame_offset(self, offset):
+        """
+        :param offset: the x,y position, in the frame the ROI was build on, of the top left corner of the frames
+            given to :meth:`apply`
+        :type offset: (int,int)
+        """
+        self._frame_offset = (int(offset[0]), int(offset[1]))
+
     @property
     def polygon(self):
         """
@@ -147,8 +166,8 @@ class ROI(object):
         :rtype: (:class:`~numpy.ndarray`, :class:`~numpy.ndarray`)
         """
         x,y,w,h = self._rectangle
-
-
+        x -= self._frame_offset[0]
+        y -= self._frame_offset[1]
 
         try:
             out = img[y : y + h, x : x +w]
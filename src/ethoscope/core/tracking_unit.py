@@ -1,6 +1,4 @@
 __author__ = 'quentin'
-from ethoscope.core.variables import BaseRelativeVariable
-from ethoscope.core.data_point import DataPoint
 from ethoscope.stimulators.stimulators import DefaultStimulator
 
 
@@ -63,19 +61,7 @@ class TrackingUnit(object):
         last_positions = self._tracker.positions[-1]
         if not absolute:
             return last_positions
-        out =[]
-        for last_pos in last_positions:
-            tmp_out = []
-            for k,i in last_pos.items():
-                if isinstance(i, BaseRelativeVariable):
-                    tmp_out.append(i.to_absolute(self.roi))
-                else:
-                    tmp_out.append(i)
-            tmp_out = DataPoint(tmp_out)
-            out.append(tmp_out)
-
-
-        return out
+        return [last_pos.to_absolute(self.roi) for last_pos in last_positions]
 
 
 
@@ -92,7 +92,11 @@ class BaseRelativeVariable(BaseDistanceIntVar):
     """
     Abstract type encoding distance variables that can be expressed relatively to an origin.
     They converted to absolute using information form the ROI.
+    Subclasses that are simply offset by the ROI position along an axis set ``offset_axis`` (0 for x, 1 for y),
+    which lets data points convert them without creating variable objects.
     """
+    offset_axis = None
+
     def to_absolute(self, roi):
         """
         Converts a positional variable from a relative (to the top left of a ROI) to an absolute (e.i. top left of the parent image).
@@ -112,6 +116,8 @@ class XPosVariable(BaseRelativeVariable):
     Type storing the X position of a detected object.
     """
     header_name = "x"
+    offset_axis = 0
+
     def _get_absolute_value(self, roi):
         out = int(self)
 
@@ -124,6 +130,8 @@ class YPosVariable(BaseRelativeVariable):
     Type storing the Y position of a detected object.
     """
     header_name = "y"
+    offset_axis = 1
+
     def _get_absolute_value(self, roi):
         out = int(self)
         _, oy = roi.offset
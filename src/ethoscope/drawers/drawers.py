@@ -78,7 +78,11 @@ class BaseDrawer(object):
         :return:
         """
         self._t = t
-        self._last_drawn_frame = img.copy()
+        # annotations are in colour, so greyscale frames are converted (which also copies them)
+        if img.ndim == 2:
+            self._last_drawn_frame = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        else:
+            self._last_drawn_frame = img.copy()
 
         self._annotate_frame(self._last_drawn_frame, positions, tracking_units)
 
@@ -138,8 +142,11 @@ class DefaultDrawer(BaseDrawer):
             return
 
         for track_u in tracking_units:
+            # positions are in the full frame, whereas the frame may be cropped
+            fx, fy = track_u.roi.frame_offset
             x, y = track_u.roi.offset
-            y += track_u.roi.rectangle[3]
+            x -= fx
+            y += track_u.roi.rectangle[3] - fy
 
             #cv2.putText(img, str(track_u.roi.idx), (round(x) + 5,round(y) - 20),
             #             cv2.FONT_HERSHEY_COMPLEX_SMALL, 1, (255,255,0))
@@ -151,8 +158,8 @@ class DefaultDrawer(BaseDrawer):
 
             black_colour = (0, 0, 0)
             roi_colour = (0, 255, 0)
-            cv2.drawContours(img,[track_u.roi.polygon],-1, black_colour, 3, LINE_AA)
-            cv2.drawContours(img,[track_u.roi.polygon],-1, roi_colour, 1, LINE_AA)
+            cv2.drawContours(img,[track_u.roi.polygon],-1, black_colour, 3, LINE_AA, offset=(-fx, -fy))
+            cv2.drawContours(img,[track_u.roi.polygon],-1, roi_colour, 1, LINE_AA, offset=(-fx, -fy))
 
             try:
                 pos_list = positions[track_u.roi.idx]
@@ -167,9 +174,9 @@ class DefaultDrawer(BaseDrawer):
                 except KeyError:
                     pass
 
-                cv2.ellipse(img, ((pos["x"], pos["y"]), (pos["w"], pos["h"]),
+                cv2.ellipse(img, ((pos["x"] - fx, pos["y"] - fy), (pos["w"], pos["h"]),
                                    pos["phi"]), black_colour, 3, LINE_AA)
-                cv2.ellipse(img, ((pos["x"], pos["y"]), (pos["w"], pos["h"]),
+                cv2.ellipse(img, ((pos["x"] - fx, pos["y"] - fy), (pos["w"], pos["h"]),
                                    pos["phi"]), colour, 1, LINE_AA)
 
 
@@ -9,35 +9,62 @@ try:
     from cv2.cv import CV_CAP_PROP_FPS as CAP_PROP_FPS
     from cv2.cv import CV_CAP_PROP_FOURCC as CAP_PROP_FOURCC
     from cv2.cv import CV_CAP_PROP_POS_AVI_RATIO as CAP_PROP_POS_AVI_RATIO
+    from cv2.cv import CV_CAP_PROP_POS_FRAMES as CAP_PROP_POS_FRAMES
 except ImportError:
     from cv2 import CAP_PROP_FRAME_WIDTH, CAP_PROP_FRAME_HEIGHT, \
                     CAP_PROP_FRAME_COUNT, CAP_PROP_POS_MSEC, CAP_PROP_FPS, \
-                    CAP_PROP_FOURCC, CAP_PROP_POS_AVI_RATIO
+                    CAP_PROP_FOURCC, CAP_PROP_POS_AVI_RATIO, CAP_PROP_POS_FRAMES
 
 import time
+import math
 import logging
 import os
+import re
+import glob
+import collections
+import socket
+import struct
+import numpy as np
 from ethoscope.utils.debug import EthoscopeException
 import multiprocessing
+import threading
+import ctypes
 import traceback
+from multiprocessing.pool import ThreadPool
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 
 class BaseCamera(object):
     capture = None
     _resolution = None
     _frame_idx = 0
+    _crop = None
+
+    _greyscale = False
 
-    def __init__(self,drop_each=1, max_duration=None, *args, **kwargs):
+    def __init__(self,drop_each=1, max_duration=None, greyscale=None, *args, **kwargs):
         """
         The template class to generate and use video streams.
 
         :param drop_each: keep only ``1/drop_each``'th frame
         :param max_duration: stop the video stream if ``t > max_duration`` (in seconds).
+        :param greyscale: whether frames are single channel greyscale images, rather than BGR.
+            Greyscale frames need less memory bandwidth all the way to the trackers, and all built-in trackers, ROI
+            builders and drawers accept them. `None` uses the default of the camera class.
+        :type greyscale: bool
         :param args: additional arguments
         :param kwargs: additional keyword arguments
         """
 
         self._drop_each = drop_each
         self._max_duration = max_duration
+        if greyscale is not None:
+            self._greyscale = greyscale
+        self._buff_grey = None
 
     def __exit__(self):
         logging.info("Closing camera")
@@ -58,18 +85,67 @@ class BaseCamera(object):
                 if not at_least_one_frame:
                     raise EthoscopeException("Camera could not read the first frame")
                 break
-            t,out = self._next_time_image()
-            if out is None:
-                break
+            if (self._frame_idx + 1) % self._drop_each == 0:
+                t,out = self._next_time_image()
+                if out is None:
+                    break
+            else:
+                t, out = self._skip_frame(), None
+                if t is None:
+                    break
             t_ms = int(1000*t)
             at_least_one_frame = True
 
-            if (self._frame_idx % self._drop_each) == 0:
+            if out is not None:
                 yield t_ms,out
 
             if self._max_duration is not None and t > self._max_duration:
                 break
 
+    @property
+    def greyscale(self):
+        """
+        :return: Whether frames are single channel greyscale images.
+        :rtype: bool
+        """
+        return self._greyscale
+
+    @property
+    def crop(self):
+        """
+        :return: The rectangle (x, y, w, h) frames are cropped to, or `None`.
+        :rtype: (int,int,int,int)
+        """
+        return self._crop
+
+    def set_crop(self, rectangle):
+        """
+        Crop frames as soon as they are acquired, so that later processing (e.g. greyscale conversion, copies)
+        is done on smaller images.
+
+        :param rectangle: the rectangle (x, y, w, h) to keep, in pixels of the full frame. `None` to keep full frames.
+        :type rectangle: (int,int,int,int)
+        """
+        self._crop = None if rectangle is None else tuple(int(v) for v in rectangle)
+
+    def set_frame_rate(self, fps):
+        """
+        Change the rate at which frames are acquired, while the camera is running.
+        Cameras that cannot do so (e.g. video files) keep their rate, and return `False`.
+
+        :param fps: the new frame rate, in frames per second
+        :type fps: float
+        :return: whether the camera now acquires frames at this rate
+        :rtype: bool
+        """
+        return False
+
+    def _apply_crop(self, im):
+        if self._crop is None or im is None:
+            return im
+        x, y, w, h = self._crop
+        return im[y: y + h, x: x + w]
+
     @property
     def resolution(self):
         """
@@ -97,9 +173,31 @@ class BaseCamera(object):
 
     def _next_time_image(self):
         time = self._time_stamp()
-        im = self._next_image()
+        im = self._apply_crop(self._next_image())
         self._frame_idx += 1
-        return time, im
+        return time, self._as_greyscale(im)
+
+    def _skip_frame(self):
+        """
+        Move past the next frame, which is dropped (see ``drop_each``).
+        By default, the frame is read as any other. Cameras that can skip a frame more cheaply should override this.
+
+        :return: the time stamp of the skipped frame (in s), or `None` if there is no more frame.
+        :rtype: float
+        """
+        t, im = self._next_time_image()
+        if im is None:
+            return None
+        return t
+
+    def _as_greyscale(self, im, dst=None):
+        if self._greyscale and im is not None and im.ndim == 3:
+            if dst is None:
+                if self._buff_grey is None or self._buff_grey.shape != im.shape[0:2]:
+                    self._buff_grey = np.empty(im.shape[0:2], np.uint8)
+                dst = self._buff_grey
+            im = cv2.cvtColor(im, cv2.COLOR_BGR2GRAY, dst)
+        return im
 
     def is_last_frame(self):
         raise NotImplementedError
@@ -129,7 +227,14 @@ class MovieVirtualCamera(BaseCamera):
                                      "default": "/home/gg/Desktop/demo_monitor_x5.avi.mp4"},
                                  ]}
 
-    def __init__(self, path, use_wall_clock = False, *args, **kwargs ):
+    # how long the decoding thread waits before checking whether it should stop, in s
+    _read_ahead_poll = .1
+    # what the decoding thread sends in place of a dropped frame
+    _skipped_frame = False
+    # the time stamps of the frames of a video are cached in a file with this suffix, next to the video
+    _frame_times_suffix = ".frame_times.npy"
+
+    def __init__(self, path, use_wall_clock = False, read_ahead = 0, start_time = None, end_time = None, *args, **kwargs ):
         """
         Class to acquire frames from a video file.
 
@@ -138,6 +243,14 @@ class MovieVirtualCamera(BaseCamera):
         :param use_wall_clock: whether to use the real time from the machine (True) or from the video file (False).\
             The former can be useful for prototyping.
         :type use_wall_clock: bool
+        :param read_ahead: the number of frames decoded in advance, by a background thread.
+            This way, decoding the next frames overlaps with processing the current one. `0` decodes synchronously.
+            Frames are decoded in preallocated buffers, and each frame remains valid until the next one is read.
+        :type read_ahead: int
+        :param start_time: the time, in the video, from which frames are read (in s). `None` starts from the first frame.
+        :type start_time: float
+        :param end_time: the time, in the video, after which no frame is read (in s). `None` reads to the end.
+        :type end_time: float
         :param args: additional arguments.
         :param kwargs: additional keyword arguments.
         """
@@ -146,6 +259,10 @@ class MovieVirtualCamera(BaseCamera):
         self._frame_idx = 0
         self._path = path
         self._use_wall_clock = use_wall_clock
+        self._read_ahead = read_ahead
+        self._decoding_thread = None
+        self._time_window = (start_time, end_time)
+        self._frame_times = None
 
 
         if not (isinstance(path, str) or isinstance(path, unicode)):
@@ -167,6 +284,16 @@ class MovieVirtualCamera(BaseCamera):
 
         self._resolution = (int(w), int(h))
 
+        # the frames to read, from first (included) to last (excluded)
+        self._first_frame = 0
+        self._last_frame = None
+        if start_time is not None:
+            self._first_frame = int(np.searchsorted(self.frame_times, start_time * 1e3, "left"))
+            if self._first_frame > 0:
+                self.capture.set(CAP_PROP_POS_FRAMES, self._first_frame)
+        if end_time is not None:
+            self._last_frame = int(np.searchsorted(self.frame_times, end_time * 1e3, "right"))
+
         super(MovieVirtualCamera, self).__init__(*args, **kwargs)
 
         # emulates v4l2 (real time camera) from video file
@@ -183,11 +310,56 @@ class MovieVirtualCamera(BaseCamera):
     def path(self):
         return self._path
 
+    @property
+    def frame_times(self):
+        """
+        The time stamps of all the frames of the video, as given by the camera, so any time can be sought directly.
+        This index is built the first time it is needed, which means grabbing all frames,
+        and is then cached in a file next to the video.
+
+        :return: the time stamp of each frame, in ms
+        :rtype: :class:`~numpy.ndarray`
+        """
+        if self._frame_times is None:
+            self._frame_times = self._load_frame_times()
+        return self._frame_times
+
+    def _load_frame_times(self):
+        cache = self._path + self._frame_times_suffix
+        if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(self._path):
+            try:
+                return np.load(cache)
+            except (IOError, ValueError):
+                logging.warning("Could not read the frame index '%s'. Building it again" % cache)
+
+        logging.info("Indexing the frames of '%s'" % self._path)
+        capture = cv2.VideoCapture(self._path)
+        times = []
+        try:
+            while True:
+                t = capture.get(CAP_PROP_POS_MSEC)
+                if not capture.grab():
+                    break
+                times.append(t)
+        finally:
+            capture.release()
+        out = np.array(times, dtype=np.float64)
+
+        try:
+            np.save(cache, out)
+        except (IOError, OSError):
+            logging.warning("Could not save the frame index of the video in '%s'" % cache)
+        return out
+
     def is_opened(self):
         return True
 
     def restart(self):
-        self.__init__(self._path, use_wall_clock=self._use_wall_clock, drop_each=self._drop_each, max_duration = self._max_duration)
+        self._close()
+        start_time, end_time = self._time_window
+        self.__init__(self._path, use_wall_clock=self._use_wall_clock, read_ahead=self._read_ahead,
+                      start_time=start_time, end_time=end_time,
+                      drop_each=self._drop_each, max_duration = self._max_duration, greyscale=self._greyscale)
 
 
     def _next_image(self):
@@ -195,6 +367,106 @@ class MovieVirtualCamera(BaseCamera):
         self._pos_avi_ratio = self.capture.get(CAP_PROP_POS_AVI_RATIO)
         return frame
 
+    def _skip_frame(self):
+        # dropped frames are grabbed, but never retrieved (i.e. converted and copied)
+        if self._read_ahead > 0:
+            time_stamp, _ = self._next_decoded()
+            return time_stamp
+
+        time_stamp = self._time_stamp()
+        if not self.capture.grab():
+            return None
+        self._frame_idx += 1
+        return time_stamp
+
+    def _next_time_image(self):
+        if self._read_ahead <= 0:
+            return super(MovieVirtualCamera, self)._next_time_image()
+        while True:
+            time_stamp, frame = self._next_decoded()
+            # frames skipped by the decoding thread cannot be returned
+            if frame is not self._skipped_frame:
+                return time_stamp, frame
+
+    def _next_decoded(self):
+        if self._decoding_thread is None:
+            self._start_decoding()
+        # the buffer of the previous frame can be reused
+        if self._current_buffer is not None:
+            self._free_buffers.put(self._current_buffer)
+            self._current_buffer = None
+
+        item = self._decoded_frames.get()
+        if isinstance(item, Exception) or item[1] is None:
+            # the end of the video, or an error, is returned to any later call
+            self._decoded_frames.put(item)
+            if isinstance(item, Exception):
+                raise item
+            return None, None
+        time_stamp, frame = item
+        if frame is not self._skipped_frame:
+            self._current_buffer = frame
+        self._frame_idx += 1
+        return time_stamp, frame
+
+    def _start_decoding(self):
+        w, h = self._resolution if self._crop is None else self._crop[2:4]
+        shape = (h, w) if self._greyscale else (h, w, 3)
+        self._free_buffers = queue.Queue()
+        for _ in range(self._read_ahead + 1):
+            self._free_buffers.put(np.empty(shape, np.uint8))
+        self._decoded_frames = queue.Queue()
+        self._current_buffer = None
+        self._stop_decoding = threading.Event()
+        self._decoding_thread = threading.Thread(target=self._decode, name="decoding")
+        self._decoding_thread.daemon = True
+        self._decoding_thread.start()
+
+    def _decode(self):
+        try:
+            bgr = np.empty((self._resolution[1], self._resolution[0], 3), np.uint8)
+            frame_idx = self._frame_idx
+            while not self._stop_decoding.is_set():
+                # the same frames as in BaseCamera.__iter__ are dropped
+                if (frame_idx + 1) % self._drop_each != 0:
+                    time_stamp = self._time_stamp()
+                    if not self.capture.grab():
+                        self._decoded_frames.put((time_stamp, None))
+                        break
+                    frame_idx += 1
+                    self._decoded_frames.put((time_stamp, self._skipped_frame))
+                    continue
+
+                try:
+                    buff = self._free_buffers.get(timeout=self._read_ahead_poll)
+                except queue.Empty:
+                    continue
+                time_stamp = self._time_stamp()
+                # full colour frames are decoded directly in their buffer
+                direct = not self._greyscale and self._crop is None and buff.shape == bgr.shape
+                grabbed, frame = self.capture.read(buff if direct else bgr)
+                if not grabbed or frame is None:
+                    self._decoded_frames.put((time_stamp, None))
+                    break
+                if frame.shape != bgr.shape:
+                    raise EthoscopeException("A frame of the video has an unexpected shape: %s" % str(frame.shape))
+                if direct:
+                    if frame.ctypes.data != buff.ctypes.data:
+                        np.copyto(buff, frame)
+                else:
+                    frame = self._apply_crop(frame)
+                    shape = frame.shape[0:2] if self._greyscale else frame.shape
+                    if buff.shape != shape:
+                        buff = np.empty(shape, np.uint8)
+                    if self._greyscale:
+                        self._as_greyscale(frame, buff)
+                    else:
+                        np.copyto(buff, frame)
+                frame_idx += 1
+                self._decoded_frames.put((time_stamp, buff))
+        except Exception as e:
+            self._decoded_frames.put(e)
+
     def _time_stamp(self):
         if self._use_wall_clock:
             now = time.time()
@@ -211,20 +483,204 @@ class MovieVirtualCamera(BaseCamera):
         return self._fourcc
 
     def is_last_frame(self):
-        if self._has_end_of_file and self._frame_idx >= self._total_n_frames:
+        frame_idx = self._first_frame + self._frame_idx
+        if self._last_frame is not None and frame_idx >= self._last_frame:
+            return True
+        if self._has_end_of_file and frame_idx >= self._total_n_frames:
             return True
         return False
 
     def _close(self):
+        if self._decoding_thread is not None:
+            self._stop_decoding.set()
+            self._decoding_thread.join()
+            self._decoding_thread = None
         self.capture.release()
 
 
+class ImageSequenceCamera(BaseCamera):
+    _description = {"overview":  "Class to acquire frames from a directory of images (e.g. one JPEG per time point).",
+                    "arguments": [
+                                    {"type": "filepath", "name": "path",
+                                     "description": "The directory of images to use as virtual camera",
+                                     "default": "/ethoscope_data/images"},
+                                 ]}
+
+    # the last number of this pattern in a file name (without extension) is its time stamp
+    _time_pattern = re.compile(r"\d+(?:\.\d+)?")
+
+    def __init__(self, path, pattern="*.jpg", time_stamps="filename", time_unit=1.0, n_decoders=None, read_ahead=None,
+                 *args, **kwargs):
+        """
+        Class to acquire frames from a directory of images, sorted by time.
+        Images are decoded ahead, in parallel, by a pool of threads.
+
+        :param path: the directory of the images
+        :type path: str
+        :param pattern: the glob pattern of the images in the directory
+        :type pattern: str
+        :param time_stamps: where the time of an image is taken from: ``"filename"``, the last number in its name,
+            or ``"mtime"``, its modification time. Times are relative to the first image.
+        :type time_stamps: str
+        :param time_unit: the duration of one unit of the numbers in file names, in s (e.g. ``0.001`` for ms)
+        :type time_unit: float
+        :param n_decoders: the number of threads decoding images. `None` uses one per core.
+        :type n_decoders: int
+        :param read_ahead: the number of images decoded in advance. `None` uses twice the number of decoders.
+            Images are decoded in preallocated buffers, and each frame remains valid until the next one is read.
+        :type read_ahead: int
+        :param args: additional arguments.
+        :param kwargs: additional keyword arguments.
+        """
+        self._frame_idx = 0
+        self._path = path
+        self._pattern = pattern
+        self._time_stamps_from = time_stamps
+        self._time_unit = time_unit
+        self._n_decoders = n_decoders if n_decoders is not None else multiprocessing.cpu_count()
+        self._read_ahead = read_ahead if read_ahead is not None else 2 * self._n_decoders
+        self._pool = None
+
+        if not os.path.isdir(path):
+            raise EthoscopeException("'%s' does not exist. No such directory" % path)
+        files = glob.glob(os.path.join(path, pattern))
+        if len(files) == 0:
+            raise EthoscopeException("No image matching '%s' in '%s'" % (pattern, path))
+
+        if time_stamps == "filename":
+            times = [self._time_from_filename(f) * time_unit for f in files]
+        elif time_stamps == "mtime":
+            times = [os.path.getmtime(f) for f in files]
+        else:
+            raise EthoscopeException("Unknown source of time stamps: '%s'" % time_stamps)
+
+        order = sorted(range(len(files)), key=lambda i: (times[i], files[i]))
+        self._files = [files[i] for i in order]
+        self._times = [times[i] - times[order[0]] for i in order]
+
+        first = cv2.imread(self._files[0])
+        if first is None:
+            raise EthoscopeException("Could not read image '%s'" % self._files[0])
+        self._resolution = (first.shape[1], first.shape[0])
+
+        super(ImageSequenceCamera, self).__init__(*args, **kwargs)
+
+    def _time_from_filename(self, file):
+        stem = os.path.splitext(os.path.basename(file))[0]
+        numbers = self._time_pattern.findall(stem)
+        if len(numbers) == 0:
+            raise EthoscopeException("No time stamp in the name of '%s'" % file)
+        return float(numbers[-1])
+
+    @property
+    def start_time(self):
+        return 0
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def files(self):
+        """
+        :return: the paths of all images, in the order they are read
+        :rtype: list(str)
+        """
+        return self._files
+
+    def is_opened(self):
+        return True
+
+    def is_last_frame(self):
+        return self._frame_idx >= len(self._files)
+
+    def restart(self):
+        self._close()
+        self.__init__(self._path, pattern=self._pattern, time_stamps=self._time_stamps_from,
+                      time_unit=self._time_unit, n_decoders=self._n_decoders, read_ahead=self._read_ahead,
+                      drop_each=self._drop_each, max_duration=self._max_duration, greyscale=self._greyscale)
+
+    def _time_stamp(self):
+        return self._times[self._frame_idx]
+
+    def _skip_frame(self):
+        # dropped images are never decoded
+        time_stamp = self._time_stamp()
+        self._frame_idx += 1
+        return time_stamp
+
+    def _next_time_image(self):
+        if self._pool is None:
+            self._start_decoding()
+        # the buffer of the previous frame can be reused
+        if self._current_buffer is not None:
+            self._free_buffers.append(self._current_buffer)
+            self._current_buffer = None
+
+        self._decode_ahead()
+        idx, result = self._decoding.popleft()
+        if idx != self._frame_idx:
+            raise EthoscopeException("Image %i was decoded instead of image %i" % (idx, self._frame_idx))
+        frame = result.get()
+        self._current_buffer = frame
+        time_stamp = self._time_stamp()
+        self._frame_idx += 1
+        return time_stamp, frame
+
+    def _start_decoding(self):
+        w, h = self._resolution if self._crop is None else self._crop[2:4]
+        shape = (h, w) if self._greyscale else (h, w, 3)
+        self._free_buffers = [np.empty(shape, np.uint8) for _ in range(self._read_ahead + 1)]
+        self._current_buffer = None
+        self._decoding = collections.deque()
+        self._next_to_decode = self._frame_idx
+        self._pool = ThreadPool(self._n_decoders)
+
+    def _decode_ahead(self):
+        # only the frames kept by BaseCamera.__iter__ are decoded
+        while len(self._decoding) < max(self._read_ahead, 1) and len(self._free_buffers) > 0:
+            while (self._next_to_decode + 1) % self._drop_each != 0:
+                self._next_to_decode += 1
+            if self._next_to_decode >= len(self._files):
+                break
+            buff = self._free_buffers.pop()
+            result = self._pool.apply_async(self._decode, (self._files[self._next_to_decode], buff))
+            self._decoding.append((self._next_to_decode, result))
+            self._next_to_decode += 1
+
+    def _decode(self, file, buff):
+        # cv2 releases the GIL while decoding, so images are decoded in parallel
+        im = cv2.imread(file)
+        if im is None:
+            raise EthoscopeException("Could not read image '%s'" % file)
+        if (im.shape[1], im.shape[0]) != self._resolution:
+            raise EthoscopeException("Image '%s' does not have the resolution of the first image" % file)
+        im = self._apply_crop(im)
+        shape = im.shape[0:2] if self._greyscale else im.shape
+        if buff.shape != shape:
+            buff = np.empty(shape, np.uint8)
+        if self._greyscale:
+            self._as_greyscale(im, buff)
+        else:
+            np.copyto(buff, im)
+        return buff
+
+    def _close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+
 class V4L2Camera(BaseCamera):
     _description = {"overview": "Class to acquire frames from the V4L2 default interface (e.g. a webcam).",
                     "arguments": [
                     {"type": "number", "min": 0, "max": 4, "step": 1, "name": "device", "description": "The device to be open", "default":0},
                     ]}
-    
+
+    # the clock frames are time stamped and paced with
+    _clock = staticmethod(time.time)
+
     def __init__(self, device=0, target_fps=5, target_resolution=(960,720), *args, **kwargs):
         """
         class to acquire stream from a video for linux compatible device (v4l2).
@@ -240,7 +696,7 @@ class V4L2Camera(BaseCamera):
         """
         
         self.canbepickled = False
-        self.capture = cv2.VideoCapture(device)
+        self.capture = self._open_capture(device)
         self._warm_up()
 
         w, h = target_resolution
@@ -278,7 +734,12 @@ class V4L2Camera(BaseCamera):
 
 
         super(V4L2Camera, self).__init__(*args, **kwargs)
-        self._start_time = time.time()
+        self._start_time = self._clock()
+        # the time and index of the frame from which frames are paced at the target FPS
+        self._pacing_origin = (self._start_time, 0)
+
+    def _open_capture(self, device):
+        return cv2.VideoCapture(device)
 
     def _warm_up(self):
         logging.info("%s is warming up" % (str(self)))
@@ -286,7 +747,44 @@ class V4L2Camera(BaseCamera):
 
     def restart(self):
         self._frame_idx = 0
-        self._start_time = time.time()
+        self._start_time = self._clock()
+        self._pacing_origin = (self._start_time, 0)
+
+    def set_frame_rate(self, fps):
+        """
+        Change the target FPS. The device is asked for this rate, and frames it acquires in excess are grabbed and
+        dropped, so the returned frames are always recent.
+
+        :param fps: the new target FPS
+        :type fps: float
+        :return: `True`
+        :rtype: bool
+        """
+        self._set_device_frame_rate(fps)
+        self._set_pacing_rate(fps)
+        return True
+
+    def _set_device_frame_rate(self, fps):
+        if not self.capture.set(CAP_PROP_FPS, max(2, int(math.ceil(fps)))):
+            logging.info("The device did not accept a frame rate of %f. Frames are dropped to reach it" % fps)
+
+    def _set_pacing_rate(self, fps):
+        origin_time, origin_idx = self._pacing_origin
+        if self._frame_idx > origin_idx:
+            # the next frames are paced from the last one, at the new rate
+            last_idx = self._frame_idx - 1
+            self._pacing_origin = (origin_time + (last_idx - origin_idx) / self._target_fps, last_idx)
+        self._target_fps = float(fps)
+
+    def _expected_time(self):
+        """
+        :return: the time at which the next frame is due at the target FPS, or `None` for the first frame.
+        :rtype: float
+        """
+        origin_time, origin_idx = self._pacing_origin
+        if self._frame_idx > origin_idx:
+            return origin_time + (self._frame_idx - origin_idx) / self._target_fps
+        return None
 
     def is_opened(self):
         return self.capture.isOpened()
@@ -295,7 +793,7 @@ class V4L2Camera(BaseCamera):
         return False
 
     def _time_stamp(self):
-        now = time.time()
+        now = self._clock()
         # relative time stamp
         return now - self._start_time
     @property
@@ -305,45 +803,177 @@ class V4L2Camera(BaseCamera):
     def _close(self):
         self.capture.release()
     def _next_image(self):
-        if self._frame_idx >0 :
-            expected_time =  self._start_time + self._frame_idx / self._target_fps
-            now = time.time()
+        expected_time = self._expected_time()
+        if expected_time is not None:
+            now = self._clock()
             to_sleep = expected_time - now
             # Warnings if the fps is so high that we cannot grab fast enough
             if to_sleep < 0:
                 if self._frame_idx % 5000 == 0:
-                    logging.warning("The target FPS (%f) could not be reached. Effective FPS is about %f" % (self._target_fps, self._frame_idx/(now - self._start_time)))
+                    origin_time, origin_idx = self._pacing_origin
+                    logging.warning("The target FPS (%f) could not be reached. Effective FPS is about %f" % (self._target_fps, (self._frame_idx - origin_idx)/(now - origin_time)))
                 self.capture.grab()
 
             # we simply drop frames until we go above expected time
             while now < expected_time:
                 self.capture.grab()
-                now = time.time()
+                now = self._clock()
         else:
             self.capture.grab()
         self.capture.retrieve(self._frame)
         return self._frame
 
+class SharedFrameRing(object):
+
+    def __init__(self, slot_size, n_slots=3):
+        """
+        A fixed-size ring of frame slots in shared memory, to send frames from one producer process to one consumer process
+        without serialising them. Each slot holds a frame, its shape, its sequence number and its time stamp.
+
+        The producer never waits: it writes each frame in a free slot (neither the latest frame, nor the one held
+        by the consumer) and publishes it. The consumer always gets the latest frame, as a numpy view of its slot
+        (i.e. without copy). This view is valid until the next call to :meth:`read`.
+        Frames published but never read are counted as dropped, from the gaps in sequence numbers.
+        A producer that runs out of frames (e.g. at the end of a video) calls :meth:`close`, so the consumer stops
+        waiting once it has read the last frame.
+
+        :param slot_size: the maximal size of a frame, in bytes
+        :type slot_size: int
+        :param n_slots: the number of slots, at least 3
+        :type n_slots: int
+        """
+        if n_slots < 3:
+            raise ValueError("A frame ring needs at least three slots")
+        self._slot_size = int(slot_size)
+        self._n_slots = n_slots
+        self._data = multiprocessing.RawArray(ctypes.c_uint8, self._slot_size * n_slots)
+        # for each slot: sequence number, height, width and number of channels (0 for single channel images)
+        self._slot_info = multiprocessing.RawArray(ctypes.c_int64, 4 * n_slots)
+        self._slot_time = multiprocessing.RawArray(ctypes.c_double, n_slots)
+        # latest published slot, slot held by the consumer, last sequence number, last written slot and whether it is closed
+        self._state = multiprocessing.RawArray(ctypes.c_int64, [-1, -1, 0, -1, 0])
+        self._cond = multiprocessing.Condition()
+        self._buff = None
+
+        # consumer side
+        self._last_seq = 0
+        self.n_read = 0
+        self.n_dropped = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_buff"] = None
+        return state
+
+    def _buffer(self):
+        if self._buff is None:
+            self._buff = np.frombuffer(self._data, dtype=np.uint8)
+        return self._buff
+
+    def _slot_view(self, i, shape):
+        start = i * self._slot_size
+        return self._buffer()[start: start + int(np.prod(shape))].reshape(shape)
+
+    def write_slot(self, shape):
+        """
+        Reserve a slot for the next frame. Called by the producer, which then writes the frame in the returned array
+        and calls :meth:`publish`.
+
+        :param shape: the shape of the frame (``(h, w)`` or ``(h, w, c)``)
+        :type shape: tuple(int)
+        :return: the index of the slot and an array, in shared memory, where the frame is to be written.
+        :rtype: (int, :class:`~numpy.ndarray`)
+        """
+        if int(np.prod(shape)) > self._slot_size:
+            raise EthoscopeException("Frame of shape %s does not fit in slots of %i bytes" % (str(shape), self._slot_size))
+        with self._cond:
+            latest, held, _, i = self._state[0:4]
+            while True:
+                i = (i + 1) % self._n_slots
+                if i != latest and i != held:
+                    break
+            self._state[3] = i
+        self._slot_info[4 * i + 1: 4 * i + 4] = [shape[0], shape[1], shape[2] if len(shape) > 2 else 0]
+        return i, self._slot_view(i, shape)
+
+    def publish(self, i, time_stamp):
+        """
+        Make the frame written in a slot available to the consumer, as the latest frame.
+
+        :param i: the index of the slot, as returned by :meth:`write_slot`
+        :type i: int
+        :param time_stamp: the time when the frame was acquired, in s
+        :type time_stamp: float
+        """
+        with self._cond:
+            seq = self._state[2] + 1
+            self._slot_info[4 * i] = seq
+            self._slot_time[i] = time_stamp
+            self._state[2] = seq
+            self._state[0] = i
+            self._cond.notify_all()
+
+    def close(self):
+        """
+        Signal that no more frames will be published. Called by the producer.
+        """
+        with self._cond:
+            self._state[4] = 1
+            self._cond.notify_all()
+
+    def read(self, timeout=None):
+        """
+        Get the latest frame, waiting for one that was not read yet. Called by the consumer.
+
+        :param timeout: the maximal time to wait for a new frame, in s. `None` waits forever
+        :type timeout: float
+        :return: the sequence number, the time stamp (in s) and a view of the frame, which is only valid until the next read.
+            `None` when the ring is closed and its last frame was read.
+        :rtype: (int, float, :class:`~numpy.ndarray`)
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._state[2] <= self._last_seq:
+                if self._state[4]:
+                    return None
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise EthoscopeException("No new frame within %.1fs" % timeout)
+                self._cond.wait(remaining)
+            i = self._state[0]
+            self._state[1] = i
+            seq, h, w, c = self._slot_info[4 * i: 4 * i + 4]
+            time_stamp = self._slot_time[i]
+
+        if self._last_seq > 0:
+            self.n_dropped += seq - self._last_seq - 1
+        self._last_seq = seq
+        self.n_read += 1
+        return seq, time_stamp, self._slot_view(i, (h, w) if c == 0 else (h, w, c))
+
+
 class PiFrameGrabber(multiprocessing.Process):
 
-    def __init__(self, target_fps, target_resolution, queue,stop_queue, *args, **kwargs):
+    def __init__(self, target_fps, target_resolution, frame_ring, stop_queue, *args, **kwargs):
         """
         Class to grab frames from pi camera. Designed to be used within :class:`~ethoscope.hardware.camreras.camreras.OurPiCameraAsync`
         This allows to get frames asynchronously as acquisition is a bottleneck.
 
-        :param target_fps: desired fps
-        :type target_fps: int
+        :param target_fps: desired fps. It is read while frames are grabbed, so the parent process can change it.
+        :type target_fps: :class:`~multiprocessing.Value`
         :param target_resolution: the desired resolution (w, h)
         :type target_resolution: (int, int)
-        :param queue: a queue that stores frame and makes them available to the parent process
-        :type queue: :class:`~multiprocessing.JoinableQueue`
+        :param frame_ring: the shared memory where frames are made available to the parent process
+        :type frame_ring: :class:`~ethoscope.hardware.input.cameras.SharedFrameRing`
         :param stop_queue: a queue that can stop the async acquisition
         :type stop_queue: :class:`~multiprocessing.JoinableQueue`
         :param args: additional arguments
         :param kwargs: additional keyword arguments
         """
 
-        self._queue = queue
+        self._frame_ring = frame_ring
         self._stop_queue = stop_queue
         self._target_fps = target_fps
         self._target_resolution = target_resolution
@@ -352,7 +982,7 @@ class PiFrameGrabber(multiprocessing.Process):
 
     def run(self):
         """
-        Initialise pi camera, get frames, convert them fo greyscale, and make them available in a queue.
+        Initialise pi camera, get frames, convert them fo greyscale, and write them in the shared frame ring.
         Run stops if the _stop_queue is not empty.
         """
 
@@ -368,28 +998,33 @@ class PiFrameGrabber(multiprocessing.Process):
             with  PiCamera() as capture:
                 logging.warning(capture)
                 capture.resolution = self._target_resolution
-
-                capture.framerate = self._target_fps
                 raw_capture = PiRGBArray(capture, size=self._target_resolution)
 
-                for frame in capture.capture_continuous(raw_capture, format="bgr", use_video_port=True):
-                    if not self._stop_queue.empty():
-                        logging.warning("The stop queue is not empty. Stop acquiring frames")
-
-                        self._stop_queue.get()
-                        self._stop_queue.task_done()
-                        logging.warning("Stop Task Done")
-                        break
-                    raw_capture.truncate(0)
-                    # out = np.copy(frame.array)
-                    out = cv2.cvtColor(frame.array,cv2.COLOR_BGR2GRAY)
-                    #fixme here we could actually pass a JPG compressed file object (http://docs.scipy.org/doc/scipy-0.16.0/reference/generated/scipy.misc.imsave.html)
-                    # This way, we would manage to get faster FPS
-                    self._queue.put(out)
+                stopped = False
+                while not stopped:
+                    target_fps = self._target_fps.value
+                    capture.framerate = target_fps
+
+                    for frame in capture.capture_continuous(raw_capture, format="bgr", use_video_port=True):
+                        if not self._stop_queue.empty():
+                            logging.warning("The stop queue is not empty. Stop acquiring frames")
+
+                            self._stop_queue.get()
+                            self._stop_queue.task_done()
+                            logging.warning("Stop Task Done")
+                            stopped = True
+                            break
+                        now = time.time()
+                        raw_capture.truncate(0)
+                        i, slot = self._frame_ring.write_slot(frame.array.shape[0:2])
+                        cv2.cvtColor(frame.array, cv2.COLOR_BGR2GRAY, slot)
+                        self._frame_ring.publish(i, now)
+                        # the frame rate cannot be changed during a capture, so the capture restarts
+                        if self._target_fps.value != target_fps:
+                            break
         finally:
             logging.warning("Closing frame grabber process")
             self._stop_queue.close()
-            self._queue.close()
             logging.warning("Camera Frame grabber stopped acquisition cleanly")
 
 
@@ -399,10 +1034,20 @@ class OurPiCameraAsync(BaseCamera):
                                    
 
     _frame_grabber_class = PiFrameGrabber
+    # the frame grabber sends greyscale images, so they are not converted to BGR unless requested
+    _greyscale = True
+    # the number of frames that can be held in shared memory
+    _frame_ring_size = 3
+    # the resolution used to allocate the shared memory, when the target resolution is not given
+    _max_resolution = (3280, 2464)
+
     def __init__(self, target_fps=20, target_resolution=(1280, 960), *args, **kwargs):
         """
         Class to acquire frames from the raspberry pi camera asynchronously.
-        At the moment, frames are only greyscale images.
+        At the moment, frames are only greyscale images. They are returned as such, unless ``greyscale=False``.
+        Frames are received through shared memory (see :class:`~ethoscope.hardware.input.cameras.SharedFrameRing`),
+        and time stamped when they are acquired. When tracking is slower than acquisition, only the latest frame is used
+        and the others are counted in :attr:`dropped_frames`. The frame rate can be changed with :meth:`set_frame_rate`.
 
         :param target_fps: the desired number of frames par second (FPS)
         :type target_fps: int
@@ -418,21 +1063,22 @@ class OurPiCameraAsync(BaseCamera):
             raise EthoscopeException("FPS must be an integer number")
         self._args = args
         self._kwargs = kwargs
-        self._queue = multiprocessing.Queue(maxsize=1)
+        self._frame_ring = SharedFrameRing(self._frame_slot_size(target_resolution, *args, **kwargs), self._frame_ring_size)
         self._stop_queue = multiprocessing.JoinableQueue(maxsize=1)
-        self._p = self._frame_grabber_class(target_fps,target_resolution,self._queue,self._stop_queue, *args, **kwargs)
+        self._target_fps = multiprocessing.Value("d", target_fps)
+        self._p = self._frame_grabber_class(self._target_fps,target_resolution,self._frame_ring,self._stop_queue, *args, **kwargs)
         self._p.daemon = True
         self._p.start()
         try:
-            im = self._queue.get(timeout=10)
+            frame = self._frame_ring.read(timeout=10)
+            if frame is None:
+                raise EthoscopeException("The frame grabber stopped before sending any frame")
+            _, t, im = frame
         except Exception as e:
             logging.error("Could not get any frame from the camera")
             self._stop_queue.cancel_join_thread()
-            self._queue.cancel_join_thread()
             logging.warning("Stopping stop queue")
             self._stop_queue.close()
-            logging.warning("Stopping queue")
-            self._queue.close()
             logging.warning("Joining process")
             # we kill the frame grabber if it does not reply within 10s
             self._p.join(10)
@@ -448,13 +1094,33 @@ class OurPiCameraAsync(BaseCamera):
             else:
                 logging.info('Maximal effective resolution is "%s"' % str(self._resolution))
         super(OurPiCameraAsync, self).__init__(*args, **kwargs)
-        self._start_time = time.time()
+        self._start_time = t
+        self._last_frame_time = t
         logging.info("Camera initialised")
 
+    def _frame_slot_size(self, target_resolution, *args, **kwargs):
+        w, h = target_resolution
+        if w <= 0 or h <= 0:
+            w, h = self._max_resolution
+        # the camera works on blocks of 32 x 16 pixels
+        return (w + 31) // 32 * 32 * ((h + 15) // 16 * 16)
+
     def restart(self):
         self._frame_idx = 0
         self._start_time = time.time()
 
+    def set_frame_rate(self, fps):
+        """
+        Change the frame rate of the camera. The frame grabber restarts its capture at this rate.
+
+        :param fps: the new frame rate
+        :type fps: float
+        :return: `True`
+        :rtype: bool
+        """
+        self._target_fps.value = fps
+        return True
+
     def __getstate__(self):
         return {"args": self._args,
                 "kwargs": self._kwargs,
@@ -474,54 +1140,72 @@ class OurPiCameraAsync(BaseCamera):
         return False
 
     def _time_stamp(self):
-        now = time.time()
-        # relative time stamp
-        return now - self._start_time
+        # relative time stamp of the last frame, when it was acquired
+        return self._last_frame_time - self._start_time
+
+    def _next_time_image(self):
+        im = self._next_image()
+        self._frame_idx += 1
+        return self._time_stamp(), im
 
     @property
     def start_time(self):
         return self._start_time
 
+    @property
+    def dropped_frames(self):
+        """
+        :return: The number of frames acquired, but never returned because a newer frame was available.
+        :rtype: int
+        """
+        return self._frame_ring.n_dropped
+
     def _close(self):
         logging.info("Requesting grabbing process to stop!")
         self._stop_queue.put(None)
-        while not self._queue.empty():
-             self._queue.get()
         logging.info("Joining stop queue")
         self._stop_queue.cancel_join_thread()
-        self._queue.cancel_join_thread()
         logging.info("Stopping stop queue")
         self._stop_queue.close()
-        logging.info("Stopping queue")
-        self._queue.close()
         logging.info("Joining process")
         self._p.join()
         logging.info("All joined ok")
+        logging.info("Dropped %i frames (read %i)" % (self._frame_ring.n_dropped, self._frame_ring.n_read))
 
     def _next_image(self):
         try:
-            g = self._queue.get(timeout=30)
+            frame = self._frame_ring.read(timeout=30)
+            # the frame grabber has no more frames
+            if frame is None:
+                return None
+            _, self._last_frame_time, g = frame
+            # the frame grabber works on full frames, so they are cropped when read
+            g = self._apply_crop(g)
+            if self._greyscale:
+                return g
+            if self._frame.shape[0:2] != g.shape:
+                self._frame = np.empty(g.shape + (3,), np.uint8)
             cv2.cvtColor(g,cv2.COLOR_GRAY2BGR,self._frame)
             return self._frame
         except Exception as e:
-            raise EthoscopeException("Could not get frame from camera\n%s", traceback.format_exc(e))
+            raise EthoscopeException("Could not get frame from camera\n%s" % traceback.format_exc())
 
 
 class DummyFrameGrabber(multiprocessing.Process):
-    def __init__(self, target_fps, target_resolution, queue, stop_queue, path, *args, **kwargs):
+    def __init__(self, target_fps, target_resolution, frame_ring, stop_queue, path, *args, **kwargs):
         """
         Class to mimic the behaviour of :class:`~ethoscope.hardware.input.cameras.PiFrameGrabber`.
         This is intended for testing purposes.
         This way, we can emulate the async functionality of the hardware camera by a video file.
 
-        :param target_fps: the desired number of frames par second (FPS)
-        :type target_fps: int
+        :param target_fps: the desired number of frames par second (FPS). It is read while frames are grabbed, so the parent process can change it.
+        :type target_fps: :class:`~multiprocessing.Value`
         :param target_fps: the desired resolution (W x H)
         :param target_resolution: (int,int)
         :param args: additional arguments
         :param kwargs: additional keyword arguments
         """
-        self._queue = queue
+        self._frame_ring = frame_ring
         self._stop_queue = stop_queue
         self._target_fps = target_fps
         self._target_resolution = target_resolution
@@ -531,6 +1215,7 @@ class DummyFrameGrabber(multiprocessing.Process):
         try:
 
             cap = cv2.VideoCapture(self._video_file)
+            next_time = time.time()
             while True:
                 if not self._stop_queue.empty():
 
@@ -539,15 +1224,25 @@ class DummyFrameGrabber(multiprocessing.Process):
                     self._stop_queue.task_done()
                     logging.warning("Stop Task Done")
                     break
+                # frames come at the target fps, as with a real camera
+                now = time.time()
+                if now < next_time:
+                    time.sleep(next_time - now)
+                    now = next_time
+                next_time = max(next_time + 1.0 / self._target_fps.value, now)
+
                 _, out = cap.read()
-                #todo sleep here
-                out = cv2.cvtColor(out, cv2.COLOR_BGR2GRAY)
-                self._queue.put(out)
+                if out is None:
+                    # the camera stops once it has read the last frame
+                    self._frame_ring.close()
+                    break
+                i, slot = self._frame_ring.write_slot(out.shape[0:2])
+                cv2.cvtColor(out, cv2.COLOR_BGR2GRAY, slot)
+                self._frame_ring.publish(i, now)
 
         finally:
             logging.warning("Closing frame grabber process")
             self._stop_queue.close()
-            self._queue.close()
             logging.warning("Camera Frame grabber stopped acquisition cleanly")
 
 class DummyPiCameraAsync(OurPiCameraAsync):
@@ -556,3 +1251,416 @@ class DummyPiCameraAsync(OurPiCameraAsync):
     This is intended for testing purposes. This way, we can emulate the async functionality of the hardware camera by a video file.
     """
     _frame_grabber_class = DummyFrameGrabber
+
+    def _frame_slot_size(self, target_resolution, path, *args, **kwargs):
+        cap = cv2.VideoCapture(path)
+        try:
+            return int(cap.get(CAP_PROP_FRAME_WIDTH)) * int(cap.get(CAP_PROP_FRAME_HEIGHT))
+        finally:
+            cap.release()
+
+
+class V4L2CameraAsync(V4L2Camera):
+    _description = {"overview": "Class to acquire frames from the V4L2 default interface (e.g. a webcam) asynchronously.",
+                    "arguments": V4L2Camera._description["arguments"]}
+
+    # the number of frames that can be held at once, at least 3
+    _n_buffers = 3
+    # the maximal time to wait for a frame, in s
+    _frame_timeout = 30
+
+    def __init__(self, *args, **kwargs):
+        """
+        Class to acquire frames from a V4L2 device, with a thread that grabs frames continuously.
+        Frames are time stamped when they are grabbed. The newest frame is returned, as soon as it is due at the target
+        FPS, and the frames grabbed in the meantime are counted in :attr:`dropped_frames`. So frames are paced at the
+        target FPS (see :meth:`set_frame_rate`) even if the device ignores the requested rate.
+
+        The grabbing thread writes each frame in one of a few preallocated buffers (neither the newest frame, nor
+        the one being used), so frames are never copied once grabbed. Each frame remains valid until the next one is read.
+
+        :param args: additional arguments (see :class:`~ethoscope.hardware.input.cameras.V4L2Camera`)
+        :param kwargs: additional keyword arguments (see :class:`~ethoscope.hardware.input.cameras.V4L2Camera`)
+        """
+        super(V4L2CameraAsync, self).__init__(*args, **kwargs)
+        self._buffers = [None] * self._n_buffers
+        self._buffer_times = [0.0] * self._n_buffers
+        self._frame_available = threading.Condition()
+        # the newest buffer, the buffer of the last frame read, and the number of frames grabbed and read
+        self._newest = -1
+        self._held = -1
+        self._n_grabbed = 0
+        self._last_read = 0
+        self._n_read = 0
+        self._n_dropped = 0
+        # a frame rate to request from the device, applied by the grabbing thread as it owns the capture
+        self._pending_fps = None
+
+        self._grabbing_error = None
+        self._stop_grabbing = threading.Event()
+        self._grabbing_thread = threading.Thread(target=self._grab, name="v4l2_grabber")
+        self._grabbing_thread.daemon = True
+        self._grabbing_thread.start()
+
+    @property
+    def dropped_frames(self):
+        """
+        :return: The number of frames grabbed, but never returned because a newer frame was returned instead.
+        :rtype: int
+        """
+        return self._n_dropped
+
+    def _free_buffer(self, shape):
+        with self._frame_available:
+            i = next(i for i in range(self._n_buffers) if i != self._newest and i != self._held)
+        if self._buffers[i] is None or self._buffers[i].shape != shape:
+            self._buffers[i] = np.empty(shape, np.uint8)
+        return i, self._buffers[i]
+
+    def _set_device_frame_rate(self, fps):
+        with self._frame_available:
+            self._pending_fps = fps
+
+    def _grab(self):
+        try:
+            bgr = np.empty_like(self._frame)
+            while not self._stop_grabbing.is_set():
+                with self._frame_available:
+                    fps, self._pending_fps = self._pending_fps, None
+                if fps is not None:
+                    super(V4L2CameraAsync, self)._set_device_frame_rate(fps)
+                if not self.capture.grab():
+                    raise EthoscopeException("Could not grab a frame from the camera")
+                now = self._clock()
+                convert = self._greyscale or self._crop is not None
+                if convert:
+                    out = self.capture.retrieve(bgr)[1]
+                else:
+                    i, buff = self._free_buffer(bgr.shape)
+                    out = self.capture.retrieve(buff)[1]
+                if out is None or out.shape != bgr.shape:
+                    raise EthoscopeException("Unexpected frame from the camera: %s" % str(None if out is None else out.shape))
+
+                if convert:
+                    out = self._apply_crop(out)
+                    i, buff = self._free_buffer(out.shape[0:2] if self._greyscale else out.shape)
+                    if self._greyscale:
+                        cv2.cvtColor(out, cv2.COLOR_BGR2GRAY, buff)
+                    else:
+                        np.copyto(buff, out)
+                elif out.ctypes.data != buff.ctypes.data:
+                    np.copyto(buff, out)
+
+                with self._frame_available:
+                    self._buffer_times[i] = now
+                    self._newest = i
+                    self._n_grabbed += 1
+                    self._frame_available.notify()
+        except Exception:
+            with self._frame_available:
+                self._grabbing_error = traceback.format_exc()
+                self._frame_available.notify()
+            logging.error("Frame grabbing stopped:\n%s" % self._grabbing_error)
+
+    def _next_time_image(self):
+        deadline = time.time() + self._frame_timeout
+        expected_time = self._expected_time()
+        # frames grabbed up to half an interval early are on time
+        earliest = None if expected_time is None else expected_time - .5 / self._target_fps
+        with self._frame_available:
+            while self._n_grabbed <= self._last_read or \
+                    (earliest is not None and self._buffer_times[self._newest] < earliest):
+                if self._grabbing_error is not None:
+                    raise EthoscopeException("Could not get frame from camera\n%s" % self._grabbing_error)
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise EthoscopeException("No new frame within %.1fs" % self._frame_timeout)
+                self._frame_available.wait(remaining)
+            i = self._newest
+            self._held = i
+            if self._last_read > 0:
+                self._n_dropped += self._n_grabbed - self._last_read - 1
+            self._last_read = self._n_grabbed
+            t = self._buffer_times[i]
+        self._n_read += 1
+        self._frame_idx += 1
+        return t - self._start_time, self._buffers[i]
+
+    def _close(self):
+        self._stop_grabbing.set()
+        self._grabbing_thread.join(self._frame_timeout)
+        logging.info("Dropped %i frames (read %i)" % (self._n_dropped, self._n_read))
+        super(V4L2CameraAsync, self)._close()
+
+
+class NetworkCamera(BaseCamera):
+    _description = {"overview": "Class to acquire frames streamed over TCP by another machine.",
+                    "arguments": [
+                    {"type": "str", "name": "host", "description": "The address of the machine streaming frames", "default": "localhost"},
+                    {"type": "number", "min": 1, "max": 65535, "step": 1, "name": "port", "description": "The port frames are streamed on", "default": 9000},
+                    ]}
+
+    # each frame is sent as a header (time stamp in s, encoding, height, width, channels, payload size) and a payload
+    _frame_header = struct.Struct("!dBHHBI")
+    _raw_encoding = 0
+    _jpeg_encoding = 1
+    # how long the receiving and decoding threads wait before checking whether they should stop, in s
+    _poll_interval = .1
+    # what the decoding thread sends in place of a dropped frame
+    _skipped_frame = False
+
+    def __init__(self, host="localhost", port=9000, timeout=30, read_ahead=2, *args, **kwargs):
+        """
+        Class to acquire frames from a TCP stream, as sent by :meth:`send_frame` (e.g. by ``scripts/stream_video.py``).
+        Frames are either raw pixels or JPEG images. One thread receives frames while another decodes them, in
+        preallocated buffers, and each frame remains valid until the next one is read.
+        Time stamps are those of the sender, relative to its first frame.
+
+        :param host: the address of the machine streaming frames
+        :type host: str
+        :param port: the port frames are streamed on
+        :type port: int
+        :param timeout: the maximal time to wait for a frame, in s
+        :type timeout: float
+        :param read_ahead: the number of frames received and decoded in advance
+        :type read_ahead: int
+        :param args: additional arguments.
+        :param kwargs: additional keyword arguments.
+        """
+        self._frame_idx = 0
+        self._host = host
+        self._port = int(port)
+        self._timeout = timeout
+        self._read_ahead = max(read_ahead, 1)
+        self._receiving_thread = None
+
+        try:
+            self._socket = socket.create_connection((host, self._port), timeout)
+        except (socket.error, socket.timeout) as e:
+            raise EthoscopeException("Could not connect to %s:%i: %s" % (host, self._port, str(e)))
+
+        # the first frame gives the resolution, and the origin of time stamps
+        try:
+            first = self._receive_frame(bytearray())
+            if first is None:
+                raise EthoscopeException("Camera could not read the first frame")
+        except (socket.error, socket.timeout) as e:
+            self._socket.close()
+            raise EthoscopeException("Could not receive the first frame from %s:%i: %s" % (host, self._port, str(e)))
+        except Exception:
+            self._socket.close()
+            raise
+        self._first_frame = first
+        self._start_time = first[0]
+        h, w = first[2][0:2]
+        self._resolution = (w, h)
+
+        super(NetworkCamera, self).__init__(*args, **kwargs)
+
+    @classmethod
+    def send_frame(cls, connection, time_stamp, frame, jpeg_quality=None):
+        """
+        Send a frame to a :class:`~ethoscope.hardware.input.cameras.NetworkCamera`.
+
+        :param connection: a connected socket
+        :type connection: :class:`~socket.socket`
+        :param time_stamp: the time the frame was acquired, in s
+        :type time_stamp: float
+        :param frame: a BGR or greyscale image
+        :type frame: :class:`~numpy.ndarray`
+        :param jpeg_quality: the quality of JPEG compression, from 0 to 100. `None` sends raw pixels.
+        :type jpeg_quality: int
+        """
+        channels = 1 if frame.ndim == 2 else frame.shape[2]
+        if jpeg_quality is None:
+            encoding, payload = cls._raw_encoding, np.ascontiguousarray(frame)
+        else:
+            ok, payload = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), int(jpeg_quality)])
+            if not ok:
+                raise EthoscopeException("Could not encode frame as JPEG")
+            encoding = cls._jpeg_encoding
+        header = cls._frame_header.pack(time_stamp, encoding, frame.shape[0], frame.shape[1], channels, payload.nbytes)
+        connection.sendall(header)
+        connection.sendall(payload.data)
+
+    @property
+    def start_time(self):
+        return self._start_time
+
+    @property
+    def address(self):
+        return self._host, self._port
+
+    def is_opened(self):
+        return True
+
+    def is_last_frame(self):
+        return False
+
+    def restart(self):
+        self._close()
+        self.__init__(self._host, self._port, timeout=self._timeout, read_ahead=self._read_ahead,
+                      drop_each=self._drop_each, max_duration=self._max_duration, greyscale=self._greyscale)
+
+    def _recv_exactly(self, view):
+        n = 0
+        while n < len(view):
+            try:
+                received = self._socket.recv_into(view[n:])
+            except socket.timeout:
+                raise EthoscopeException("No frame received from %s:%i for %is" % (self._host, self._port, self._timeout))
+            if received == 0:
+                return n
+            n += received
+        return n
+
+    def _receive_frame(self, payload):
+        header = bytearray(self._frame_header.size)
+        n = self._recv_exactly(memoryview(header))
+        if n == 0:
+            return None
+        if n < len(header):
+            raise EthoscopeException("The stream of frames was interrupted")
+        time_stamp, encoding, h, w, c, size = self._frame_header.unpack(bytes(header))
+        if len(payload) < size:
+            payload = bytearray(size)
+        if self._recv_exactly(memoryview(payload)[0:size]) < size:
+            raise EthoscopeException("The stream of frames was interrupted")
+        return time_stamp, encoding, (h, w, c), size, payload
+
+    def _start_receiving(self):
+        w, h = self._resolution if self._crop is None else self._crop[2:4]
+        shape = (h, w) if self._greyscale else (h, w, 3)
+        self._free_buffers = queue.Queue()
+        self._free_payloads = queue.Queue()
+        for _ in range(self._read_ahead + 1):
+            self._free_buffers.put(np.empty(shape, np.uint8))
+            self._free_payloads.put(bytearray())
+        self._received_frames = queue.Queue()
+        self._decoded_frames = queue.Queue()
+        self._current_buffer = None
+        self._received_frames.put(self._first_frame)
+        self._first_frame = None
+
+        self._stop_receiving = threading.Event()
+        self._receiving_thread = threading.Thread(target=self._receive, name="network_receiver")
+        self._decoding_thread = threading.Thread(target=self._decode, name="network_decoder")
+        for th in (self._receiving_thread, self._decoding_thread):
+            th.daemon = True
+            th.start()
+
+    def _get(self, q):
+        while not self._stop_receiving.is_set():
+            try:
+                return q.get(timeout=self._poll_interval)
+            except queue.Empty:
+                pass
+        return None
+
+    def _receive(self):
+        try:
+            while not self._stop_receiving.is_set():
+                payload = self._get(self._free_payloads)
+                if payload is None:
+                    break
+                item = self._receive_frame(payload)
+                self._received_frames.put(item)
+                if item is None:
+                    break
+        except Exception as e:
+            self._received_frames.put(e)
+
+    def _decode(self):
+        try:
+            frame_idx = self._frame_idx
+            while True:
+                item = self._get(self._received_frames)
+                if item is None or isinstance(item, Exception):
+                    self._decoded_frames.put(item)
+                    break
+                time_stamp, encoding, shape, size, payload = item
+                # the same frames as in BaseCamera.__iter__ are dropped
+                if (frame_idx + 1) % self._drop_each != 0:
+                    frame_idx += 1
+                    self._free_payloads.put(payload)
+                    self._decoded_frames.put((time_stamp, self._skipped_frame))
+                    continue
+
+                buff = self._get(self._free_buffers)
+                if buff is None:
+                    break
+                data = np.frombuffer(payload, np.uint8, size)
+                if encoding == self._jpeg_encoding:
+                    im = cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+                    if im is None:
+                        raise EthoscopeException("Could not decode a JPEG frame")
+                elif encoding == self._raw_encoding:
+                    im = data.reshape(shape if shape[2] > 1 else shape[0:2])
+                else:
+                    raise EthoscopeException("Unknown frame encoding: %i" % encoding)
+                if (im.shape[1], im.shape[0]) != self._resolution:
+                    raise EthoscopeException("A frame has an unexpected shape: %s" % str(im.shape))
+
+                im = self._apply_crop(im)
+                shape = im.shape[0:2] if self._greyscale else im.shape[0:2] + (3,)
+                if buff.shape != shape:
+                    buff = np.empty(shape, np.uint8)
+                if im.ndim == 3 and self._greyscale:
+                    self._as_greyscale(im, buff)
+                elif im.ndim == 2 and not self._greyscale:
+                    cv2.cvtColor(im, cv2.COLOR_GRAY2BGR, buff)
+                else:
+                    np.copyto(buff, im)
+                self._free_payloads.put(payload)
+                frame_idx += 1
+                self._decoded_frames.put((time_stamp, buff))
+        except Exception as e:
+            self._decoded_frames.put(e)
+
+    def _next_decoded(self):
+        if self._receiving_thread is None:
+            self._start_receiving()
+        # the buffer of the previous frame can be reused
+        if self._current_buffer is not None:
+            self._free_buffers.put(self._current_buffer)
+            self._current_buffer = None
+
+        try:
+            item = self._decoded_frames.get(timeout=self._timeout)
+        except queue.Empty:
+            raise EthoscopeException("No frame received from %s:%i for %is" % (self._host, self._port, self._timeout))
+        if item is None or isinstance(item, Exception):
+            # the end of the stream, or an error, is returned to any later call
+            self._decoded_frames.put(item)
+            if isinstance(item, Exception):
+                raise item
+            return None, None
+        time_stamp, frame = item
+        if frame is not self._skipped_frame:
+            self._current_buffer = frame
+        self._frame_idx += 1
+        return time_stamp - self._start_time, frame
+
+    def _skip_frame(self):
+        # dropped frames are received, but never decoded
+        time_stamp, _ = self._next_decoded()
+        return time_stamp
+
+    def _next_time_image(self):
+        while True:
+            time_stamp, frame = self._next_decoded()
+            if frame is not self._skipped_frame:
+                return time_stamp, frame
+
+    def _close(self):
+        if self._receiving_thread is not None:
+            self._stop_receiving.set()
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._socket.close()
+        if self._receiving_thread is not None:
+            self._receiving_thread.join()
+            self._decoding_thread.join()
+            self._receiving_thread = None
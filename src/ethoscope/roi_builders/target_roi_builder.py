@@ -19,6 +19,7 @@ import logging
 from ethoscope.roi_builders.roi_builders import BaseROIBuilder
 from ethoscope.core.roi import ROI
 from ethoscope.utils.debug import EthoscopeException
+from ethoscope.utils.img_proc import grey_image
 import itertools
 
 
@@ -90,7 +91,7 @@ class TargetGridROIBuilder(BaseROIBuilder):
         super(TargetGridROIBuilder,self).__init__()
 
     def _find_blobs(self, im, scoring_fun):
-        grey= cv2.cvtColor(im,cv2.COLOR_BGR2GRAY)
+        grey= grey_image(im).copy()
         rad = int(self._adaptive_med_rad * im.shape[1])
         if rad % 2 == 0:
             rad += 1
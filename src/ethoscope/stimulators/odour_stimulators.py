@@ -23,16 +23,16 @@ class HasChangedSideStimulator(BaseStimulator):
         super(HasChangedSideStimulator, self).__init__(hardware_connection)
 
     def _has_changed_side(self):
-        positions = self._tracker.positions
+        history = self._tracker.history
 
-        if len(positions ) <2 :
+        if len(history) <2 :
             return False
 
         w = float(self._tracker._roi.get_feature_dict()["w"])
-        if len(positions[-1]) != 1:
+        if len(history.frame(-1)) != 1:
             raise Exception("This stimulator can only work with a single animal per ROI")
-        x0 = positions[-1][0]["x"] / w
-        xm1 = positions[-2][0]["x"] / w
+        x0 = history.value(-1, "x") / w
+        xm1 = history.value(-2, "x") / w
 
 
         if x0 > self._middle_line:
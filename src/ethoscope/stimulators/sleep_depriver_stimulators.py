@@ -32,26 +32,24 @@ class IsMovingStimulator(BaseStimulator):
 
     def _has_moved(self):
 
-        positions = self._tracker.positions
+        history = self._tracker.history
 
-        if len(positions ) <2 :
+        if len(history) <2 :
             return False
 
 
-        if len(positions[-1]) != 1:
+        if len(history.frame(-1)) != 1:
             raise Exception("This stimulator can only work with a single animal per ROI")
-        tail_m = positions[-1][0]
 
-        times = self._tracker.times
-        last_time_for_position = times[-1]
+        last_time_for_position = history.time(-1)
         last_time = self._tracker.last_time_point
 
         # we assume no movement if the animal was not spotted
         if last_time != last_time_for_position:
             return False
 
-        dt_s = abs(times[-1] - times[-2]) / 1000.0
-        dist = 10.0 ** (tail_m["xy_dist_log10x1000"]/1000.0)
+        dt_s = abs(last_time_for_position - history.time(-2)) / 1000.0
+        dist = 10.0 ** (history.value(-1, "xy_dist_log10x1000")/1000.0)
         velocity = dist / dt_s
 
         if velocity > self._velocity_threshold:
@@ -62,9 +60,8 @@ class IsMovingStimulator(BaseStimulator):
 
         has_moved = self._has_moved()
 
-        t = self._tracker.times
         if  has_moved:# or xor_diff > self._xor_speed_threshold :
-            self._last_active = t[-1]
+            self._last_active = self._tracker.history.time(-1)
             return HasInteractedVariable(False), {}
         return HasInteractedVariable(True), {}
 
@@ -337,17 +334,17 @@ class MiddleCrossingStimulator(BaseStimulator):
         except KeyError:
             return HasInteractedVariable(False), {}
 
-        positions = self._tracker.positions
+        history = self._tracker.history
 
-        if len(positions) < 2:
+        if len(history) < 2:
             return HasInteractedVariable(False), {}
 
-        if len(positions[-1]) != 1:
+        if len(history.frame(-1)) != 1:
             raise Exception("This stimulator can only work with a single animal per ROI")
 
         roi_w = float(self._tracker._roi.longest_axis)
-        x_t_zero = positions[-1][0]["x"] / roi_w - 0.5
-        x_t_minus_one = positions[-2][0]["x"] / roi_w - 0.5
+        x_t_zero = history.value(-1, "x") / roi_w - 0.5
+        x_t_minus_one = history.value(-2, "x") / roi_w - 0.5
 
         # if roi_id == 12:
         #     print (roi_id, channel, roi_w, positions[-1][0]["x"], positions[-2][0]["x"], x_t_zero, x_t_minus_one)
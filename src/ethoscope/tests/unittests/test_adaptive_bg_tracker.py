@@ -0,0 +1,110 @@
+__author__ = 'quentin'
+
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.core.roi import ROI
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
+
+
+def _tube_frames(n):
+    # a fly walking down a tube, and back. Yields the time, the frame and the true position, in the ROI
+    rng = np.random.RandomState(0)
+    bg = rng.randint(180, 200, (420, 80, 3)).astype(np.uint8)
+    for i in range(n):
+        frame = bg.copy()
+        y = 60 + (i * 3) % 300
+        cv2.ellipse(frame, ((40, y), (10, 24), 90), (40, 40, 40), -1)
+        yield i * 100, frame, (30, y - 10)
+
+
+def _track(n_frames, **kwargs):
+    roi = ROI(np.array([[10, 10], [70, 10], [70, 410], [10, 410]]), 1)
+    tracker = AdaptiveBGModel(roi, **kwargs)
+    positions, truth = [], []
+    for t, frame, xy in _tube_frames(n_frames):
+        points = tracker.track(t, frame)
+        if len(points) > 0:
+            positions.append((int(points[0]["x"]), int(points[0]["y"]), bool(points[0]["is_inferred"])))
+        else:
+            positions.append(None)
+        truth.append(xy)
+    return tracker, positions, truth
+
+
+class TestSearchWindow(unittest.TestCase):
+
+    def test_same_positions(self):
+        full, full_positions, _ = _track(200)
+        windowed, windowed_positions, _ = _track(200, search_window=3)
+        self.assertIsNone(full.search_window_hit_rate)
+        self.assertGreater(windowed.search_window_hit_rate, .9)
+        self.assertEqual(len(full_positions), len(windowed_positions))
+        for a, b in zip(full_positions, windowed_positions):
+            if a is None or b is None:
+                self.assertEqual(a, b)
+            else:
+                self.assertLessEqual(abs(a[0] - b[0]) + abs(a[1] - b[1]), 1)
+                self.assertEqual(a[2], b[2])
+
+
+class TestFindBlobs(unittest.TestCase):
+
+    def test_blobs(self):
+        roi = ROI(np.array([[10, 10], [70, 10], [70, 410], [10, 410]]), 1)
+        tracker = AdaptiveBGModel(roi)
+        fg = np.zeros((400, 60), np.uint8)
+        cv2.ellipse(fg, ((30, 200), (24, 10), 30), 120, -1)
+        fg[300: 303, 40: 43] = 60
+        # too small to be the animal
+        fg[50, 10] = 200
+        tracker._buff_fg = fg
+
+        blobs, n_blobs = tracker._find_blobs((5, 20, 50, 350))
+        self.assertEqual(n_blobs, 3)
+        # the same outlines and bounding boxes, in the ROI, as the contours of the large blobs
+        contours = [c for c in cv2.findContours(fg, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+                    if cv2.contourArea(c) > 0]
+        self.assertEqual(len(blobs), 2)
+        self.assertEqual(sorted(b[1] for b in blobs), sorted(cv2.boundingRect(c) for c in contours))
+        self.assertEqual(sorted(b[0].tolist() for b in blobs),
+                         sorted(cv2.approxPolyDP(c, 1.2, True).tolist() for c in contours))
+
+        self.assertEqual(tracker._find_blobs((0, 0, 5, 5)), ([], 0))
+
+    def test_small_blobs(self):
+        # all the foregrounds of 3 x 4 pixels: the blobs that are dropped could not have three vertices
+        roi = ROI(np.array([[10, 10], [70, 10], [70, 410], [10, 410]]), 1)
+        tracker = AdaptiveBGModel(roi)
+        fg = np.zeros((7, 8), np.uint8)
+        for bits in range(1, 1 << 12):
+            fg[2: 5, 2: 6].flat = [255 * (bits >> k & 1) for k in range(12)]
+            tracker._buff_fg = fg
+            blobs, n_blobs = tracker._find_blobs((0, 0, 8, 7))
+            contours = cv2.findContours(fg, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+            self.assertEqual(n_blobs, len(contours))
+            outlines = [cv2.approxPolyDP(c, 1.2, True) for c in contours]
+            self.assertEqual(sorted(b[0].tolist() for b in blobs if b[0].shape[0] >= 3),
+                             sorted(o.tolist() for o in outlines if o.shape[0] >= 3))
+
+
+class TestMultiResolution(unittest.TestCase):
+
+    def test_accuracy(self):
+        _, full_positions, truth = _track(200)
+        for scale_factor in (.5, .25):
+            _, positions, _ = _track(200, scale_factor=scale_factor)
+            n_found = 0
+            for a, b, xy in zip(full_positions, positions, truth):
+                if a is None or b is None or a[2] or b[2]:
+                    continue
+                n_found += 1
+                # positions are refined at full resolution, so they are as accurate as the full resolution ones
+                self.assertLessEqual(abs(b[0] - xy[0]) + abs(b[1] - xy[1]), abs(a[0] - xy[0]) + abs(a[1] - xy[1]) + 1)
+            self.assertGreater(n_found, 150)
+
+    def test_scale_factor(self):
+        roi = ROI(np.array([[10, 10], [70, 10], [70, 410], [10, 410]]), 1)
+        self.assertRaises(ValueError, AdaptiveBGModel, roi, scale_factor=2)
@@ -0,0 +1,130 @@
+__author__ = 'quentin'
+
+import os
+import unittest
+
+import numpy as np
+
+from ethoscope.core.monitor import Monitor
+from ethoscope.core.roi import ROI
+from ethoscope.hardware.input.cameras import MovieVirtualCamera
+from ethoscope.roi_builders.img_roi_builder import ImgMaskROIBuilder
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel, BackgroundModel, BatchedBackgroundModel
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), "../../../examples/test_data")
+VIDEO = os.path.join(TEST_DATA, "img00004_1028x752.mov")
+MASK = os.path.join(TEST_DATA, "img00004_1028x752_4rectangles.jpg")
+
+
+class TestBackgroundModel(unittest.TestCase):
+
+    def _frames(self, n):
+        rng = np.random.RandomState(1)
+        base = rng.randint(50, 200, (60, 80)).astype(np.float64)
+        for i in range(n):
+            # a slowly drifting, noisy background
+            img = base + 20 * np.sin(i / 20.0) + rng.normal(0, 3, base.shape)
+            yield np.clip(img, 0, 255).astype(np.uint8)
+
+    def test_bg_img_uint8(self):
+        model = BackgroundModel()
+        self.assertIsNone(model.bg_img_uint8)
+        buff = None
+        for i, img in enumerate(self._frames(50)):
+            model.update(img, i * 100)
+            bg = model.bg_img_uint8
+            np.testing.assert_array_equal(bg, model.bg_img.astype(np.uint8))
+            # the same buffer is used for each frame
+            if buff is not None:
+                self.assertIs(bg, buff)
+            buff = bg
+
+
+class _RowCollector(object):
+    # a result writer keeping the written rows in memory
+    def __init__(self):
+        self.rows = []
+
+    def write(self, t, roi, data_rows):
+        self.rows.append((t, roi.idx, [dp.as_tuple() for dp in data_rows]))
+
+    def flush(self, t, frame):
+        pass
+
+
+def _square_roi(x, y, size, idx):
+    return ROI(np.array([[x, y], [x + size, y], [x + size, y + size], [x, y + size]]), idx)
+
+
+class TestBatchedBackgroundModel(unittest.TestCase):
+
+    def _frames(self, shape, n):
+        rng = np.random.RandomState(2)
+        base = rng.randint(50, 200, shape).astype(np.float64)
+        for i in range(n):
+            img = np.clip(base + 20 * np.sin(i / 10.0) + rng.normal(0, 3, shape), 0, 255).astype(np.uint8)
+            fg = np.zeros(shape, np.uint8)
+            fg[(i * 3) % shape[0], :] = 255
+            yield i * 100, img, fg
+
+    def _run_monitor(self, **kwargs):
+        cam = MovieVirtualCamera(VIDEO)
+        try:
+            rois = ImgMaskROIBuilder(MASK).build(cam)
+            monitor = Monitor(cam, AdaptiveBGModel, rois, **kwargs)
+            writer = _RowCollector()
+            monitor.run(writer)
+        finally:
+            cam._close()
+        return writer.rows
+
+    def test_same_rows_as_monitor(self):
+        ref = self._run_monitor()
+        batched = self._run_monitor(batched_bg_model=BatchedBackgroundModel())
+        self.assertEqual(len(ref), 94 * 4)
+        self.assertEqual(batched, ref)
+
+    def _track(self, rois, models, flush):
+        # the background of each ROI, before each update, as trackers use it
+        out = []
+        for t, img, fg in self._frames((60, 90), 30):
+            for roi, model in zip(rois, models):
+                sub = roi.apply(img)[0]
+                bg = model.bg_img
+                out.append(None if bg is None else bg.copy())
+                model.update(sub.copy(), t, roi.apply(fg)[0].copy())
+            if flush is not None:
+                flush()
+        return out
+
+    def test_lazy_flush(self):
+        # without a monitor, the staged updates of a frame are applied when a ROI is tracked again
+        rois = [_square_roi(5, 5, 20, 1), _square_roi(30, 10, 25, 2), _square_roi(60, 30, 20, 3)]
+        batched = BatchedBackgroundModel()
+        ref = self._track(rois, [BackgroundModel() for _ in rois], None)
+        lazy = self._track(rois, [batched.view(r) for r in rois], None)
+        self.assertEqual(batched.rectangle, (5, 5, 76, 46))
+        for a, b in zip(ref, lazy):
+            if a is None:
+                self.assertIsNone(b)
+            else:
+                np.testing.assert_allclose(a, b, atol=1e-3)
+
+    def test_overlapping_rois(self):
+        # the pixels shared by two ROIs follow the background model of the last of them
+        rois = [_square_roi(5, 5, 30, 1), _square_roi(20, 20, 30, 2)]
+        ref = [BackgroundModel(), BackgroundModel()]
+        batched = BatchedBackgroundModel()
+        views = [batched.view(r) for r in rois]
+        # the two ROIs learn at different rates, so their models of the shared pixels differ
+        for model in (ref[1], views[1]):
+            model._min_half_life = model._current_half_life = 100
+        self._track(rois, ref, None)
+        self._track(rois, views, batched.flush)
+
+        first, second = views[0].bg_img, views[1].bg_img
+        shared = (slice(15, 30), slice(15, 30))
+        np.testing.assert_allclose(second, ref[1].bg_img, atol=1e-3)
+        np.testing.assert_allclose(first[0:15, :], ref[0].bg_img[0:15, :], atol=1e-3)
+        np.testing.assert_allclose(first[shared], ref[1].bg_img[0:15, 0:15], atol=1e-3)
+        self.assertGreater(np.abs(first[shared] - ref[0].bg_img[shared]).max(), 1)
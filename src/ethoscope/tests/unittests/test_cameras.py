@@ -0,0 +1,367 @@
+__author__ = 'quentin'
+
+import gc
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import warnings
+
+import cv2
+import numpy as np
+
+from ethoscope.hardware.input.cameras import MovieVirtualCamera, ImageSequenceCamera, NetworkCamera, V4L2Camera, \
+    V4L2CameraAsync, DummyPiCameraAsync
+from ethoscope.utils.debug import EthoscopeException
+
+VIDEO = os.path.join(os.path.dirname(__file__), "../../../examples/test_data/img00004_1028x752.mov")
+
+
+class TestMovieVirtualCamera(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._video = os.path.join(self._tmp_dir, "video.mov")
+        shutil.copy(VIDEO, self._video)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _read(self, **kwargs):
+        cam = MovieVirtualCamera(self._video, **kwargs)
+        try:
+            return [(t, frame.copy()) for t, frame in cam]
+        finally:
+            cam._close()
+
+    def test_time_window(self):
+        full = self._read()
+        window = self._read(start_time=10, end_time=30)
+        expected = [(t, f) for t, f in full if 10000 <= t <= 30000]
+
+        self.assertTrue(os.path.exists(self._video + MovieVirtualCamera._frame_times_suffix))
+        self.assertEqual([t for t, _ in window], [t for t, _ in expected])
+        for (_, a), (_, b) in zip(window, expected):
+            self.assertTrue((a == b).all())
+
+    def test_drop_each(self):
+        full = self._read()
+        dropped = self._read(drop_each=3, read_ahead=2)
+        self.assertEqual([t for t, _ in dropped], [t for t, _ in full[2::3]])
+
+    def _assert_same_frames(self, frames, expected):
+        self.assertEqual([t for t, _ in frames], [t for t, _ in expected])
+        for (_, a), (_, b) in zip(frames, expected):
+            np.testing.assert_array_equal(a, b)
+
+    def test_read_ahead(self):
+        # decoding in a background thread gives the same frames and time stamps
+        for drop_each in (2, 3):
+            for greyscale in (False, True):
+                sync = self._read(drop_each=drop_each, greyscale=greyscale)
+                self.assertEqual(len(sync), 94 // drop_each)
+                self._assert_same_frames(self._read(drop_each=drop_each, greyscale=greyscale, read_ahead=2), sync)
+
+    def test_close(self):
+        # closing the camera before the end of the video stops the decoding thread
+        cam = MovieVirtualCamera(self._video, drop_each=2, read_ahead=2)
+        try:
+            for i, _ in enumerate(cam):
+                if i == 5:
+                    break
+            thread = cam._decoding_thread
+            self.assertTrue(thread.is_alive())
+        finally:
+            cam._close()
+        self.assertIsNone(cam._decoding_thread)
+        self.assertFalse(thread.is_alive())
+
+    def test_restart(self):
+        # restarting before the end of the video reads it again from the first frame
+        full = self._read(drop_each=2)
+        cam = MovieVirtualCamera(self._video, drop_each=2, read_ahead=2)
+        try:
+            for i, _ in enumerate(cam):
+                if i == 5:
+                    break
+            thread = cam._decoding_thread
+            cam.restart()
+            self.assertFalse(thread.is_alive())
+            frames = [(t, frame.copy()) for t, frame in cam]
+        finally:
+            cam._close()
+        self._assert_same_frames(frames, full)
+
+
+class TestImageSequenceCamera(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._images = []
+        for i in range(7):
+            im = np.random.randint(0, 256, (40, 60, 3)).astype(np.uint8)
+            # time stamps, in ms, are not in the lexical order of names
+            cv2.imwrite(os.path.join(self._tmp_dir, "img_%i.png" % (i * 500)), im)
+            self._images.append(im)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _read(self, **kwargs):
+        cam = ImageSequenceCamera(self._tmp_dir, pattern="*.png", time_unit=1e-3, n_decoders=2, read_ahead=3, **kwargs)
+        try:
+            return [(t, frame.copy()) for t, frame in cam]
+        finally:
+            cam._close()
+
+    def test_read(self):
+        frames = self._read()
+        self.assertEqual([t for t, _ in frames], [i * 500 for i in range(7)])
+        for (_, a), b in zip(frames, self._images):
+            self.assertTrue((a == b).all())
+
+    def test_drop_each_greyscale(self):
+        frames = self._read(drop_each=2, greyscale=True)
+        self.assertEqual([t for t, _ in frames], [500, 1500, 2500])
+        for (_, a), b in zip(frames, self._images[1::2]):
+            self.assertTrue((a == cv2.cvtColor(b, cv2.COLOR_BGR2GRAY)).all())
+
+
+class _FakeCapture(object):
+    # a device that ignores frame rate requests, and acquires a frame every 1/128 s of a fake clock.
+    # Each frame is filled with its index
+
+    def __init__(self, n_frames, real_interval=0):
+        self._n_frames = n_frames
+        self._real_interval = real_interval
+        self._n_grabbed = 0
+        self.now = 1000.0
+        self.set_calls = []
+
+    def clock(self):
+        return self.now
+
+    def isOpened(self):
+        return True
+
+    def set(self, prop, value):
+        self.set_calls.append((prop, value, threading.current_thread().name))
+        return False
+
+    def grab(self):
+        if self._n_grabbed >= self._n_frames:
+            return False
+        if self._real_interval > 0:
+            time.sleep(self._real_interval)
+        self._n_grabbed += 1
+        self.now += 1.0 / 128
+        return True
+
+    def retrieve(self, im=None):
+        if im is None:
+            im = np.empty((12, 16, 3), np.uint8)
+        im.fill(self._n_grabbed % 256)
+        return True, im
+
+    def read(self):
+        return self.grab(), self.retrieve()[1]
+
+    def release(self):
+        pass
+
+
+class _FakeV4L2Camera(V4L2Camera):
+
+    def __init__(self, capture, *args, **kwargs):
+        self._capture = capture
+        self._clock = capture.clock
+        super(_FakeV4L2Camera, self).__init__(*args, **kwargs)
+
+    def _open_capture(self, device):
+        return self._capture
+
+    def _warm_up(self):
+        pass
+
+
+class TestV4L2Camera(unittest.TestCase):
+
+    def test_set_frame_rate(self):
+        capture = _FakeCapture(1000)
+        cam = _FakeV4L2Camera(capture, target_fps=10, target_resolution=(16, 12))
+        times = []
+        try:
+            for t, _ in cam:
+                times.append(t)
+                if len(times) == 5:
+                    self.assertTrue(cam.set_frame_rate(25))
+                if len(times) == 15:
+                    break
+        finally:
+            cam._close()
+        self.assertEqual(capture.set_calls[-1][0:2], (cv2.CAP_PROP_FPS, 25))
+        # frames are time stamped when requested, so each gap is the time taken by the previous frame.
+        # The device ignores the requested rates, so frames are dropped to reach them, within one device frame
+        gaps = np.diff(times)
+        for gap in gaps[1:5]:
+            self.assertAlmostEqual(gap, 100, delta=1000 / 128.0 + 1)
+        for gap in gaps[5:]:
+            self.assertAlmostEqual(gap, 40, delta=1000 / 128.0 + 1)
+
+
+class _FakeV4L2CameraAsync(_FakeV4L2Camera, V4L2CameraAsync):
+    pass
+
+
+class _VideoV4L2CameraAsync(V4L2CameraAsync):
+    # a video file, read as a V4L2 device. Grabbing fails at the end of the video
+
+    def _warm_up(self):
+        pass
+
+
+class TestV4L2CameraAsync(unittest.TestCase):
+
+    def _read(self, **kwargs):
+        # frames are not paced below the rate at which the video is grabbed
+        cam = _VideoV4L2CameraAsync(VIDEO, target_fps=10000, target_resolution=(1028, 752), **kwargs)
+        frames = []
+        try:
+            start = time.time()
+            with self.assertRaises(EthoscopeException):
+                for t, frame in cam:
+                    frames.append((t, int(frame.sum())))
+                    # slower than grabbing, so frames are dropped
+                    time.sleep(.02)
+            # the error is reported as soon as grabbing stops
+            self.assertLess(time.time() - start, 10)
+        finally:
+            cam._close()
+        return frames, cam.dropped_frames
+
+    def test_newest_frame(self):
+        for greyscale in (False, True):
+            cap = cv2.VideoCapture(VIDEO)
+            sums = []
+            while True:
+                _, im = cap.read()
+                if im is None:
+                    break
+                sums.append(int((cv2.cvtColor(im, cv2.COLOR_BGR2GRAY) if greyscale else im).sum()))
+            cap.release()
+
+            frames, n_dropped = self._read(greyscale=greyscale)
+            indices = [sums.index(s) for _, s in frames]
+            # frames are returned in order, up to the last one. The first frame is read when the camera opens
+            self.assertEqual(indices, sorted(set(indices)))
+            self.assertEqual(indices[-1], len(sums) - 1)
+            self.assertGreater(n_dropped, 0)
+            self.assertEqual(len(frames) + n_dropped, len(sums) - 1)
+            self.assertEqual([t for t, _ in frames], sorted(t for t, _ in frames))
+
+    def test_set_frame_rate(self):
+        capture = _FakeCapture(640, real_interval=.001)
+        cam = _FakeV4L2CameraAsync(capture, target_fps=128, target_resolution=(16, 12))
+        frames = []
+        try:
+            with self.assertRaises(EthoscopeException):
+                for t, frame in cam:
+                    frames.append((t, int(frame[0, 0, 0])))
+                    if len(frames) == 10:
+                        self.assertTrue(cam.set_frame_rate(16))
+                        change_t = t
+        finally:
+            cam._close()
+        # the device ignores the new rate, so frames are dropped to pace them at 16 FPS
+        # the capture is only used by the grabbing thread once it runs
+        self.assertEqual(capture.set_calls[-1], (cv2.CAP_PROP_FPS, 16, "v4l2_grabber"))
+        self.assertEqual(len(capture.set_calls), 4)
+        paced = [t for t, _ in frames[10:]]
+        self.assertLessEqual(len(paced), (640 - 10) / 8 + 1)
+        self.assertGreater(len(paced), (640 - 10) / 8 / 2)
+        self.assertAlmostEqual((paced[-1] - change_t) / float(len(paced)), 1000 / 16.0, delta=10)
+        self.assertGreater(cam.dropped_frames, 500)
+
+
+class TestDummyPiCameraAsync(unittest.TestCase):
+
+    def test_end_of_video(self):
+        cam = DummyPiCameraAsync(50, (1028, 752), path=VIDEO)
+        try:
+            start = time.time()
+            frames = [t for t, _ in cam]
+            # iteration stops at the end of the video, rather than when reading a frame times out
+            self.assertLess(time.time() - start, 10)
+            # the first frame is read when the camera starts
+            self.assertEqual(len(frames) + 1 + cam.dropped_frames, 94)
+        finally:
+            cam._close()
+
+
+class TestNetworkCamera(unittest.TestCase):
+
+    def setUp(self):
+        cam = MovieVirtualCamera(VIDEO, max_duration=10)
+        self._frames = [(t, frame.copy()) for t, frame in cam]
+        cam._close()
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(("localhost", 0))
+        self._server.listen(1)
+
+    def tearDown(self):
+        self._server.close()
+
+    def _replay(self, jpeg_quality):
+        connection, _ = self._server.accept()
+        try:
+            for t, frame in self._frames:
+                NetworkCamera.send_frame(connection, 1000 + t / 1000.0, frame, jpeg_quality)
+        finally:
+            connection.close()
+
+    def _read(self, jpeg_quality=None, **kwargs):
+        server = threading.Thread(target=self._replay, args=(jpeg_quality,))
+        server.start()
+        cam = NetworkCamera("localhost", self._server.getsockname()[1], timeout=5, **kwargs)
+        try:
+            return [(t, frame.copy()) for t, frame in cam]
+        finally:
+            cam._close()
+            server.join()
+
+    def _assert_times(self, frames, expected):
+        # time stamps are sent in s, so they are rounded to the ms again
+        self.assertEqual(len(frames), len(expected))
+        for (a, _), (b, _) in zip(frames, expected):
+            self.assertAlmostEqual(a, b, delta=1)
+
+    def test_raw(self):
+        frames = self._read(drop_each=2)
+        self._assert_times(frames, self._frames[1::2])
+        for (_, a), (_, b) in zip(frames, self._frames[1::2]):
+            self.assertTrue((a == b).all())
+
+    def test_no_first_frame(self):
+        port = self._server.getsockname()[1]
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            # the connection is accepted, but no frame is sent
+            self.assertRaises(EthoscopeException, NetworkCamera, "localhost", port, timeout=.2)
+            gc.collect()
+        self.assertFalse([w for w in caught if issubclass(w.category, ResourceWarning)])
+        # the camera closed its side of the connection
+        connection, _ = self._server.accept()
+        connection.settimeout(5)
+        try:
+            self.assertEqual(connection.recv(1), b"")
+        finally:
+            connection.close()
+
+    def test_jpeg(self):
+        frames = self._read(jpeg_quality=95, greyscale=True)
+        self._assert_times(frames, self._frames)
+        for (_, a), (_, b) in zip(frames, self._frames):
+            self.assertEqual(a.shape, b.shape[0:2])
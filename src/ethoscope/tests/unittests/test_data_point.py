@@ -0,0 +1,45 @@
+__author__ = 'quentin'
+
+import pickle
+import unittest
+
+from ethoscope.core.data_point import DataPoint, DataPointSchema
+from ethoscope.core.roi import ROI
+from ethoscope.core.variables import XPosVariable, YPosVariable, PhiVariable, IsInferredVariable
+
+
+class TestDataPoint(unittest.TestCase):
+
+    def setUp(self):
+        self.dp = DataPoint([XPosVariable(32), YPosVariable(18), PhiVariable(90)])
+
+    def test_access(self):
+        self.assertEqual(self.dp["x"], 32)
+        self.assertEqual(self.dp.keys(), ["x", "y", "phi"])
+        self.assertEqual(self.dp.as_tuple(), (32, 18, 90))
+        self.assertIsInstance(self.dp.values()[0], XPosVariable)
+
+    def test_shared_schema(self):
+        other = DataPoint([XPosVariable(1), YPosVariable(2), PhiVariable(3)])
+        self.assertIs(self.dp.schema, other.schema)
+        schema = DataPointSchema.get([XPosVariable, YPosVariable, PhiVariable])
+        self.assertEqual(DataPoint.from_schema(schema, [32, 18, 90]), self.dp)
+
+    def test_append(self):
+        cp = self.dp.copy()
+        cp.append(IsInferredVariable(True))
+        cp.append(IsInferredVariable(False))
+        self.assertEqual(cp.keys(), ["x", "y", "phi", "is_inferred"])
+        self.assertEqual(cp["is_inferred"], 0)
+        self.assertEqual(len(self.dp), 3)
+
+    def test_to_absolute(self):
+        roi = ROI(((10, 20), (110, 20), (110, 70), (10, 70)), idx=1)
+        out = self.dp.to_absolute(roi)
+        self.assertEqual(out.as_tuple(), (42, 38, 90))
+        self.assertEqual(self.dp["x"], 32)
+
+    def test_pickle(self):
+        out = pickle.loads(pickle.dumps(self.dp))
+        self.assertEqual(out, self.dp)
+        self.assertIs(out.schema, self.dp.schema)
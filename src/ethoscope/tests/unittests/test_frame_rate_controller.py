@@ -0,0 +1,49 @@
+__author__ = 'quentin'
+
+import unittest
+
+from ethoscope.core.frame_rate_controller import FrameRateController
+
+
+class TestFrameRateController(unittest.TestCase):
+
+    def test_load_target(self):
+        ctrl = FrameRateController(min_fps=1, max_fps=20, target_load=.5, smoothing=.5)
+        self.assertEqual(ctrl.fps, 20)
+        self.assertIsNone(ctrl.mean_processing_time)
+        # the first time is taken as is, then times are smoothed: 0.1, 0.075, 0.0625, 0.0625
+        self.assertTrue(ctrl.update(.1))
+        self.assertAlmostEqual(ctrl.mean_processing_time, .1)
+        self.assertAlmostEqual(ctrl.fps, 5)
+        self.assertAlmostEqual(ctrl.interval, .2)
+        self.assertTrue(ctrl.update(.05))
+        self.assertAlmostEqual(ctrl.mean_processing_time, .075)
+        self.assertAlmostEqual(ctrl.fps, .5 / .075)
+        self.assertTrue(ctrl.update(.05))
+        self.assertAlmostEqual(ctrl.fps, 8)
+        # the rate did not change
+        self.assertFalse(ctrl.update(.0625))
+        self.assertAlmostEqual(ctrl.fps, 8)
+
+    def test_bounds(self):
+        ctrl = FrameRateController(min_fps=2, max_fps=10, target_load=.8, smoothing=1)
+        fps = []
+        for t in (1.0, .2, .08, .01, 0, .4, 5.0):
+            ctrl.update(t)
+            fps.append(ctrl.fps)
+        expected = [2, 4, 10, 10, 10, 2, 2]
+        self.assertEqual(len(fps), len(expected))
+        for a, b in zip(fps, expected):
+            self.assertAlmostEqual(a, b)
+
+    def test_min_change(self):
+        ctrl = FrameRateController(min_fps=1, max_fps=100, target_load=1, smoothing=1, min_change=.1)
+        # 10, 10.53, 10.99, 11.05 and 10.5 fps
+        recorded = [ctrl.update(t) for t in (.1, .095, .091, .0905, .0952)]
+        # a slow drift is recorded once it is 10% away from the last recorded rate
+        self.assertEqual(recorded, [True, False, False, True, False])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, FrameRateController, min_fps=5, max_fps=2)
+        self.assertRaises(ValueError, FrameRateController, min_fps=0)
+        self.assertRaises(ValueError, FrameRateController, target_load=1.5)
@@ -0,0 +1,95 @@
+__author__ = 'quentin'
+
+import unittest
+
+import numpy as np
+
+from ethoscope.core.data_point import DataPoint
+from ethoscope.core.roi import ROI
+from ethoscope.core.variables import XPosVariable, YPosVariable, IsInferredVariable
+from ethoscope.trackers.history import PositionHistory
+from ethoscope.trackers.trackers import BaseTracker
+
+
+def point(x, y):
+    return DataPoint([XPosVariable(x), YPosVariable(y)])
+
+
+class _SmallHistory(PositionHistory):
+    _initial_capacity = 4
+
+
+class TestPositionHistory(unittest.TestCase):
+
+    def test_sequence_views(self):
+        h = PositionHistory(max_duration=1000, max_frames=8)
+        for i in range(5):
+            h.append(i * 100, [point(i, 2 * i)])
+        self.assertEqual(len(h.positions), 5)
+        self.assertEqual(list(h.times), [0, 100, 200, 300, 400])
+        self.assertEqual(h.positions[-2][0]["x"], 3)
+        self.assertEqual(h.positions[0][0]["y"], 0)
+        self.assertEqual(h.value(-2, "y"), 6)
+
+    def test_last_frame_is_live(self):
+        h = PositionHistory()
+        last = [point(1, 1)]
+        h.append(0, last)
+        self.assertIs(h.positions[-1], last)
+        last[0].append(IsInferredVariable(True))
+        h.append(10, [point(2, 2)])
+        self.assertEqual(h.positions[-2][0]["is_inferred"], 1)
+
+    def test_bounded(self):
+        h = PositionHistory(max_duration=1000, max_frames=8)
+        for i in range(100):
+            h.append(i * 10, [point(i, i)])
+        self.assertEqual(len(h), 8)
+        self.assertEqual(h.times[0], 920)
+
+        h = PositionHistory(max_duration=50, max_frames=8)
+        for i in range(100):
+            h.append(i * 10, [point(i, i)])
+        self.assertEqual(list(h.times), [940, 950, 960, 970, 980, 990])
+
+    def test_grows(self):
+        h = _SmallHistory(max_duration=1000)
+        # 100 frames per second, with a variable number of data points per frame
+        for i in range(300):
+            h.append(i * 10, [point(i, j) for j in range(i % 3)])
+        self.assertEqual(list(h.times), list(range(1990, 3000, 10)))
+        self.assertEqual(list(h.since(2900, "x")), [i for i in range(290, 300) for _ in range(i % 3)])
+        self.assertEqual(h.capacity, (128, 128))
+        self.assertEqual(h.value(-4, "y", 1), 1)
+        self.assertEqual([p["x"] for p in h.positions[-4]], [296, 296])
+
+    def test_warns_when_full(self):
+        h = PositionHistory(max_duration=1000, max_frames=8)
+        with self.assertLogs(level="WARNING") as logs:
+            for i in range(20):
+                h.append(i * 10, [point(i, i)])
+        self.assertEqual(len(logs.output), 1)
+        self.assertEqual(len(h), 8)
+
+    def test_tracker_bound(self):
+        # 250 s at 200 fps: the history of a tracker is capped, rather than growing with the frame rate
+        tracker = BaseTracker(ROI(np.array([[0, 0], [10, 0], [10, 10], [0, 10]]), 1))
+        h = tracker.history
+        with self.assertLogs(level="WARNING") as logs:
+            for i in range(50000):
+                h.append(i * 5, [point(i, i)])
+        self.assertEqual(len(logs.output), 1)
+        self.assertEqual(h.capacity, (120 * 250, 120 * 250))
+        self.assertEqual(len(h), 120 * 250)
+        self.assertEqual(h.times[-1], 49999 * 5)
+
+    def test_since(self):
+        h = PositionHistory(max_frames=16, max_rows=64)
+        for i in range(40):
+            h.append(i * 10, [point(i, -i), point(i + 100, -i)])
+        self.assertEqual(list(h.since(375, "x")), [38, 138, 39, 139])
+        rows = h.since(380)
+        self.assertEqual(list(rows["t"]), [380, 380, 390, 390])
+        self.assertEqual(list(rows["y"]), [-38, -38, -39, -39])
+        self.assertEqual(len(h.since(1000, "x")), 0)
+        self.assertEqual(len(h.since(0, "x")), 32)
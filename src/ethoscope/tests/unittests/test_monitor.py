@@ -0,0 +1,151 @@
+__author__ = 'quentin'
+
+import os
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.core.monitor import Monitor
+from ethoscope.drawers.drawers import DefaultDrawer
+from ethoscope.hardware.input.cameras import MovieVirtualCamera
+from ethoscope.roi_builders.img_roi_builder import ImgMaskROIBuilder
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
+from ethoscope.trackers.trackers import BaseTracker
+from ethoscope.utils.io import ImgToMySQLHelper
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), "../../../examples/test_data")
+VIDEO = os.path.join(TEST_DATA, "img00004_1028x752.mov")
+MASK = os.path.join(TEST_DATA, "img00004_1028x752_4rectangles.jpg")
+
+
+class _RoiImageCollector(object):
+    # a result writer keeping the written rows, and the image of each ROI, in memory
+    def __init__(self):
+        self.rows = []
+        self.roi_images = []
+        self.frame_shapes = set()
+        self._rois = []
+
+    def write(self, t, roi, data_rows):
+        self.rows.append((t, roi.idx, [dp.as_tuple() for dp in data_rows]))
+        self._rois.append(roi)
+
+    def flush(self, t, frame):
+        self.frame_shapes.add(frame.shape)
+        for roi in self._rois:
+            img, mask = roi.apply(frame)
+            self.roi_images.append((img.copy(), mask.copy()))
+        self._rois = []
+
+
+class _SnapshotCollector(_RoiImageCollector):
+    # also keeps the snapshots that a MySQL result writer would save
+    def __init__(self):
+        super(_SnapshotCollector, self).__init__()
+        self._shot_saver = ImgToMySQLHelper(period=1.0)
+        self.snapshots = []
+
+    def flush(self, t, frame):
+        super(_SnapshotCollector, self).flush(t, frame)
+        c_args = self._shot_saver.flush(t, frame)
+        if c_args is not None:
+            img = c_args[1][2]
+            self.snapshots.append(cv2.imdecode(np.frombuffer(img, np.uint8), cv2.IMREAD_UNCHANGED))
+
+
+class _NoDetectionTracker(BaseTracker):
+    def _find_position(self, img, mask, t):
+        return []
+
+
+class _ModifyingWriter(object):
+    # keeps the written data points, and modifies them
+    def __init__(self):
+        self.data_points = []
+
+    def write(self, t, roi, data_rows):
+        for dp in data_rows:
+            if any(dp.as_tuple()):
+                raise AssertionError("Not a zero filled data row: %s" % dp)
+            dp["x"] = 42
+        self.data_points.extend(data_rows)
+
+    def flush(self, t, frame):
+        pass
+
+
+class TestMonitor(unittest.TestCase):
+
+    def _run(self, n_frames=None, **kwargs):
+        cam = MovieVirtualCamera(VIDEO, max_duration=n_frames)
+        try:
+            rois = ImgMaskROIBuilder(MASK).build(cam)
+            monitor = Monitor(cam, AdaptiveBGModel, rois, **kwargs)
+            writer = _RoiImageCollector()
+            monitor.run(writer)
+            return writer, rois, cam
+        finally:
+            cam._close()
+
+    def _run_drawn(self, greyscale):
+        cam = MovieVirtualCamera(VIDEO, greyscale=greyscale)
+        try:
+            rois = ImgMaskROIBuilder(MASK).build(cam)
+            monitor = Monitor(cam, AdaptiveBGModel, rois)
+            drawer = DefaultDrawer()
+            writer = _SnapshotCollector()
+            monitor.run(writer, drawer)
+            return writer, drawer
+        finally:
+            cam._close()
+
+    def test_crop_to_rois(self):
+        ref, _, _ = self._run(30)
+        cropped, rois, cam = self._run(30, crop_to_rois=True)
+        self.assertEqual(ref.frame_shapes, set([(752, 1028, 3)]))
+        self.assertEqual(len(cropped.frame_shapes), 1)
+        self.assertLess(np.prod(list(cropped.frame_shapes)[0]), 752 * 1028 * 3)
+        self.assertEqual(cropped.rows, ref.rows)
+        self.assertEqual(len(cropped.roi_images), len(ref.roi_images))
+        for (img, mask), (ref_img, ref_mask) in zip(cropped.roi_images, ref.roi_images):
+            np.testing.assert_array_equal(img, ref_img)
+            np.testing.assert_array_equal(mask, ref_mask)
+        # the ROIs, and the camera, work on full frames again once the monitor stops
+        self.assertEqual([r.frame_offset for r in rois], [(0, 0)] * len(rois))
+        self.assertIsNone(cam.crop)
+
+    def test_greyscale(self):
+        # greyscale frames, from the camera to the saved snapshots, give the same results as BGR frames
+        ref, _ = self._run_drawn(False)
+        grey, drawer = self._run_drawn(True)
+        self.assertEqual(len(grey.rows), 94 * 4)
+        self.assertEqual(grey.rows, ref.rows)
+        self.assertEqual(grey.frame_shapes, set([(752, 1028)]))
+        for (img, mask), (ref_img, _) in zip(grey.roi_images, ref.roi_images):
+            self.assertEqual(img.ndim, 2)
+            np.testing.assert_array_equal(img, cv2.cvtColor(ref_img, cv2.COLOR_BGR2GRAY))
+        # annotations are drawn in colour
+        self.assertEqual(drawer.last_drawn_frame.shape, (752, 1028, 3))
+        self.assertGreater(len(grey.snapshots), 0)
+        self.assertEqual(len(grey.snapshots), len(ref.snapshots))
+        for img in grey.snapshots:
+            self.assertEqual(img.shape, (752, 1028))
+
+    def test_null_data_rows(self):
+        # ROIs without detection get a zero filled row, which is not shared with other ROIs, frames or monitors
+        writers = []
+        for _ in range(2):
+            cam = MovieVirtualCamera(VIDEO, max_duration=5)
+            try:
+                rois = ImgMaskROIBuilder(MASK).build(cam)
+                writer = _ModifyingWriter()
+                Monitor(cam, _NoDetectionTracker, rois).run(writer)
+                writers.append(writer)
+            finally:
+                cam._close()
+        data_points = writers[0].data_points + writers[1].data_points
+        self.assertGreater(len(writers[0].data_points), len(rois))
+        self.assertEqual(len(set(id(dp) for dp in data_points)), len(data_points))
+        self.assertEqual(data_points[0].keys(), ["x", "y", "w", "h", "phi", "xy_dist_log10x1000", "is_inferred",
+                                                 "has_interacted"])
@@ -0,0 +1,86 @@
+__author__ = 'quentin'
+
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.trackers.adaptive_bg_tracker import ObjectModel
+
+
+class _FeatureModel(ObjectModel):
+    # a model updated with features rather than contours
+    def compute_features(self, img, features):
+        return features
+
+
+def _mad_distance(data, features):
+    # the former distance, with the mean absolute deviation of each feature as its spread
+    means = np.mean(data, 0)
+    mads = np.mean(np.abs(data - means), 0)
+    likelihoods = np.exp(- (features - means) ** 2 / (2 * mads ** 2)) / (mads * np.sqrt(2 * np.pi))
+    return -np.sum(np.log10(likelihoods)) / len(features)
+
+
+class TestObjectModel(unittest.TestCase):
+
+    def _contour(self, img, i):
+        img.fill(255)
+        cv2.ellipse(img, ((50, 50), (10 + i % 7, 4 + i % 3), i % 180), (i % 50, i % 50, i % 50), -1)
+        mask = cv2.inRange(img, (0, 0, 0), (100, 100, 100))
+        contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+        return contours[0]
+
+    def test_running_statistics(self):
+        model = ObjectModel(history_duration=5000, max_history_length=500)
+        img = np.zeros((100, 100, 3), np.uint8)
+        for i in range(300):
+            model.update(img, self._contour(img, i), i * 100 + (i // 100) * 3000)
+            data = model._ring_buff[model._rows()].astype(np.float64)
+            np.testing.assert_allclose(model._sums, data.sum(0), rtol=1e-9)
+            np.testing.assert_allclose(model._sums_sq, (data ** 2).sum(0), rtol=1e-9)
+        self.assertTrue(model.is_ready)
+
+    def test_time_window(self):
+        model = ObjectModel(history_duration=1000, max_history_length=100)
+        img = np.zeros((100, 100, 3), np.uint8)
+        for i in range(11):
+            model.update(img, self._contour(img, i), i * 100)
+        self.assertEqual(len(model), 11)
+        self.assertFalse(model.is_ready)
+        model.update(img, self._contour(img, 11), 1100)
+        self.assertEqual(len(model), 11)
+        self.assertTrue(model.is_ready)
+
+        # at a high frame rate, memory is bounded by the maximal length
+        for i in range(1000):
+            model.update(img, self._contour(img, i), 1100 + i)
+        self.assertEqual(len(model), 100)
+        self.assertEqual(len(model._ring_buff), 100)
+
+    def test_vectorised_distances(self):
+        model = ObjectModel(history_duration=5000)
+        img = np.zeros((100, 100, 3), np.uint8)
+        for i in range(60):
+            model.update(img, self._contour(img, i), i * 100)
+        candidates = [model.compute_features(img, self._contour(img, i)) for i in range(5)]
+        candidates.append(np.array([1e3, 1e3, 1e3]))
+        out = model.distances(candidates, 6000)
+        self.assertEqual(out.shape, (6,))
+        for c, d in zip(candidates, out):
+            self.assertAlmostEqual(model.distance(c, 6000), d)
+        # too unlikely to be computed
+        self.assertEqual(out[-1], 0)
+
+    def test_mean_absolute_deviation(self):
+        rng = np.random.RandomState(1)
+        means, stds = np.array([200., 30., 80.]), np.array([20., 3., 10.])
+        data = rng.normal(means, stds, (1000, 3)).astype(np.float32)
+        model = _FeatureModel(history_duration=10 ** 6, max_history_length=1000)
+        for i, f in enumerate(data):
+            model.update(None, f, i)
+        # normally distributed features: distances are close to the ones computed with the mean absolute deviation
+        for i in range(20):
+            candidate = means + rng.uniform(-3, 3, 3) * stds
+            expected = _mad_distance(data.astype(np.float64), candidate)
+            self.assertAlmostEqual(model.distance(candidate, 1000), expected, delta=.02 * expected)
@@ -0,0 +1,100 @@
+__author__ = 'quentin'
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import numpy as np
+
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
+from ethoscope.utils.offline import split_video, merge_results, analyse_videos
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), "../../../examples/test_data")
+VIDEO = os.path.join(TEST_DATA, "img00004_1028x752.mov")
+MASK = os.path.join(TEST_DATA, "img00004_1028x752_4rectangles.jpg")
+
+
+class TestSplitVideo(unittest.TestCase):
+
+    def test_split(self):
+        times = np.array([0, 0, 100, 200, 300, 400, 500, 600], dtype=np.float64)
+        windows = split_video(times, 3)
+        self.assertEqual(windows, [(None, 50), (50, 350), (350, None)])
+        for t in times:
+            n = sum(1 for start, end in windows if (start is None or t >= start) and (end is None or t < end))
+            self.assertEqual(n, 1)
+
+    def test_same_time_stamps(self):
+        windows = split_video(np.array([0, 0, 0, 100], dtype=np.float64), 2)
+        self.assertEqual(windows, [(None, 50), (50, None)])
+
+
+class TestMergeResults(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _make_db(self, name, rows):
+        path = os.path.join(self._tmp_dir, name)
+        db = sqlite3.connect(path)
+        db.execute("CREATE TABLE ROI_MAP (roi_idx SMALLINT, roi_value SMALLINT, x SMALLINT,y SMALLINT,w SMALLINT,h SMALLINT)")
+        db.execute("CREATE TABLE ROI_1 (id INTEGER PRIMARY KEY AUTOINCREMENT, t INT, x SMALLINT, y SMALLINT, xy_dist_log10x1000 SMALLINT)")
+        db.executemany("INSERT INTO ROI_1 VALUES (NULL, ?, ?, ?, ?)", rows)
+        db.commit()
+        db.close()
+        return path
+
+    def test_merge(self):
+        a = self._make_db("a.db", [(0, 10, 10, 0), (100, 13, 14, 5)])
+        # the first distance of a chunk is relative to its warm up
+        b = self._make_db("b.db", [(200, 16, 18, 9), (300, 16, 18, 0)])
+        out = os.path.join(self._tmp_dir, "out.db")
+        merge_results([a, b], out)
+
+        db = sqlite3.connect(out)
+        rows = db.execute("SELECT id, t, x, y, xy_dist_log10x1000 FROM ROI_1 ORDER BY id").fetchall()
+        db.close()
+        self.assertEqual([r[0] for r in rows], [1, 2, 3, 4])
+        self.assertEqual([r[1] for r in rows], [0, 100, 200, 300])
+        self.assertEqual([r[4] for r in rows], [0, 5, 5, 0])
+
+
+class TestAnalyseVideos(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _tables(self, path):
+        db = sqlite3.connect(path)
+        try:
+            tables = [r[0] for r in db.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'ROI\\_%' "
+                                               "ESCAPE '\\' AND name != 'ROI_MAP' ORDER BY name")]
+            return dict((t, db.execute("SELECT COUNT(*) FROM %s" % t).fetchone()[0]) for t in tables)
+        finally:
+            db.close()
+
+    def test_two_jobs(self):
+        jobs = [{"video": VIDEO, "roi_mask": MASK, "output": os.path.join(self._tmp_dir, "full.db")},
+                {"video": VIDEO, "roi_mask": MASK, "output": os.path.join(self._tmp_dir, "first_frames.db"),
+                 "camera_kwargs": {"max_duration": 30}}]
+        stats = analyse_videos(jobs, AdaptiveBGModel, n_processes=2)
+
+        self.assertEqual([s["output"] for s in stats], [j["output"] for j in jobs])
+        n_frames = [s["n_frames"] for s in stats]
+        self.assertEqual(n_frames[0], 94)
+        self.assertLess(n_frames[1], 94)
+        # one SQLite file per job, and no partial results left behind
+        self.assertEqual(sorted(os.listdir(self._tmp_dir)), ["first_frames.db", "full.db"])
+        for job, n in zip(jobs, n_frames):
+            self.assertEqual(self._tables(job["output"]), dict(("ROI_%i" % i, n) for i in range(1, 5)))
+
+        # existing outputs are not analysed again
+        self.assertEqual(analyse_videos(jobs, AdaptiveBGModel, n_processes=2), [])
@@ -0,0 +1,107 @@
+__author__ = 'quentin'
+
+import os
+import unittest
+
+import numpy as np
+
+from ethoscope.core.monitor import Monitor
+from ethoscope.core.parallel_monitor import ParallelMonitor
+from ethoscope.core.roi import ROI
+from ethoscope.hardware.input.cameras import BaseCamera, MovieVirtualCamera
+from ethoscope.roi_builders.img_roi_builder import ImgMaskROIBuilder
+from ethoscope.stimulators.stimulators import DefaultStimulator
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
+from ethoscope.utils.debug import EthoscopeException
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), "../../../examples/test_data")
+VIDEO = os.path.join(TEST_DATA, "img00004_1028x752.mov")
+MASK = os.path.join(TEST_DATA, "img00004_1028x752_4rectangles.jpg")
+
+
+class _BlankCamera(BaseCamera):
+    # a few blank frames, 100 ms apart
+
+    def __init__(self, n_frames, *args, **kwargs):
+        self._n_frames = n_frames
+        self._resolution = (80, 60)
+        super(_BlankCamera, self).__init__(*args, **kwargs)
+
+    def is_opened(self):
+        return True
+
+    def is_last_frame(self):
+        return self._frame_idx >= self._n_frames
+
+    def _time_stamp(self):
+        return self._frame_idx * .1
+
+    def _next_image(self):
+        return np.zeros((60, 80, 3), np.uint8)
+
+
+class _FailingTracker(AdaptiveBGModel):
+    # fails on the third frame
+    def track(self, t, img):
+        if t >= 200:
+            raise ValueError("Cannot track")
+        return super(_FailingTracker, self).track(t, img)
+
+
+class _RowCollector(object):
+    # a result writer keeping the written rows in memory
+    def __init__(self):
+        self.rows = []
+
+    def write(self, t, roi, data_rows):
+        self.rows.append((t, roi.idx, [dp.as_tuple() for dp in data_rows]))
+
+    def flush(self, t, frame):
+        pass
+
+
+def _rois():
+    return [ROI(np.array([[x, 10], [x + 30, 10], [x + 30, 50], [x, 50]]), i + 1) for i, x in enumerate((5, 40))]
+
+
+class TestParallelMonitor(unittest.TestCase):
+
+    def _run(self, monitor_class, **kwargs):
+        cam = MovieVirtualCamera(VIDEO)
+        try:
+            rois = ImgMaskROIBuilder(MASK).build(cam)
+            monitor = monitor_class(cam, AdaptiveBGModel, rois, **kwargs)
+            writer = _RowCollector()
+            monitor.run(writer)
+        finally:
+            cam._close()
+        return writer.rows
+
+    def test_same_rows_as_monitor(self):
+        ref = self._run(Monitor)
+        self.assertEqual(len(ref), 94 * 4)
+        for n_workers in (2, 3):
+            self.assertEqual(self._run(ParallelMonitor, n_workers=n_workers), ref)
+
+    def test_hardware_stimulators(self):
+        stimulators = [DefaultStimulator(object()) for _ in range(2)]
+        self.assertRaises(NotImplementedError, ParallelMonitor, _BlankCamera(5), AdaptiveBGModel, _rois(), stimulators)
+
+    def test_worker_error(self):
+        monitor = ParallelMonitor(_BlankCamera(10), _FailingTracker, _rois(), n_workers=2)
+        workers = []
+        start_workers = monitor._start_workers
+
+        def keep_workers(frame):
+            start_workers(frame)
+            workers.extend(monitor._workers)
+        monitor._start_workers = keep_workers
+
+        with self.assertRaises(EthoscopeException) as cm:
+            monitor.run(_RowCollector())
+        self.assertIn("Cannot track", str(cm.exception))
+        # the workers are stopped, rather than left waiting for jobs
+        self.assertEqual(len(workers), 2)
+        self.assertEqual(monitor._workers, [])
+        for w in workers:
+            self.assertFalse(w.is_alive())
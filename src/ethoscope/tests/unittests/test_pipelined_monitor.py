@@ -0,0 +1,88 @@
+__author__ = 'quentin'
+
+import sys
+import threading
+import traceback
+import unittest
+
+import numpy as np
+
+from ethoscope.core.pipelined_monitor import PipelinedMonitor, StageQueue
+from ethoscope.core.roi import ROI
+from ethoscope.hardware.input.cameras import BaseCamera
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
+
+
+class _BlankCamera(BaseCamera):
+    # a few blank frames, 100 ms apart
+
+    def __init__(self, n_frames, *args, **kwargs):
+        self._n_frames = n_frames
+        self._resolution = (80, 60)
+        super(_BlankCamera, self).__init__(*args, **kwargs)
+
+    def is_opened(self):
+        return True
+
+    def is_last_frame(self):
+        return self._frame_idx >= self._n_frames
+
+    def _time_stamp(self):
+        return self._frame_idx * .1
+
+    def _next_image(self):
+        return np.zeros((60, 80, 3), np.uint8)
+
+
+class _FailingResultWriter(object):
+    def write(self, t, roi, data_rows):
+        raise ValueError("Cannot write results")
+
+    def flush(self, t, frame):
+        pass
+
+
+class TestStageQueue(unittest.TestCase):
+
+    def _items(self, q):
+        out = []
+        while not q.empty():
+            out.append(q.get())
+        return out
+
+    def test_drop_policies(self):
+        q = StageQueue(2, "drop_oldest")
+        for i in range(3):
+            self.assertTrue(q.push(i))
+        self.assertEqual(self._items(q), [1, 2])
+
+        q = StageQueue(2, "drop_newest")
+        self.assertEqual([q.push(i) for i in range(3)], [True, True, False])
+        self.assertEqual(self._items(q), [0, 1])
+        self.assertEqual(q.stats()["dropped"], 1)
+
+    def test_block(self):
+        q = StageQueue(1)
+        stop = threading.Event()
+        stop.set()
+        self.assertTrue(q.push(0, stop))
+        # the queue stays full, so the item is not queued once the pipeline stops
+        self.assertFalse(q.push(1, stop))
+        self.assertEqual(q.stats()["blocked"], 1)
+        self.assertEqual(q.stats()["dropped"], 0)
+
+
+class TestPipelinedMonitor(unittest.TestCase):
+
+    def test_stage_error(self):
+        roi = ROI(np.array([[10, 10], [70, 10], [70, 50], [10, 50]]), 1)
+        monitor = PipelinedMonitor(_BlankCamera(10), AdaptiveBGModel, [roi])
+        try:
+            monitor.run(_FailingResultWriter())
+        except ValueError:
+            # the exception is raised with the traceback of the writer stage
+            functions = [f[2] for f in traceback.extract_tb(sys.exc_info()[2])]
+        else:
+            self.fail("The error of the writer stage was not raised")
+        self.assertIn("_write", functions)
+        self.assertIn("write", functions)
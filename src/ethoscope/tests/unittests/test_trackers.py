@@ -0,0 +1,135 @@
+__author__ = 'quentin'
+
+import os
+import unittest
+
+import numpy as np
+
+from ethoscope.core.data_point import DataPoint
+from ethoscope.core.roi import ROI
+from ethoscope.core.variables import XPosVariable, YPosVariable, XYDistance
+from ethoscope.hardware.input.cameras import MovieVirtualCamera
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
+from ethoscope.trackers.trackers import BaseTracker, ScratchPool
+
+VIDEO = os.path.join(os.path.dirname(__file__), "../../../examples/test_data/img00004_1028x752.mov")
+
+
+class _DarkestPixelTracker(BaseTracker):
+    # the animal is the darkest pixel. Counts the frames that are fully processed
+
+    def __init__(self, roi, *args, **kwargs):
+        self.n_processed = 0
+        super(_DarkestPixelTracker, self).__init__(roi, *args, **kwargs)
+
+    def _find_position(self, img, mask, t):
+        self.n_processed += 1
+        y, x = np.unravel_index(np.argmin(img), img.shape)
+        return [DataPoint([XPosVariable(x), YPosVariable(y), XYDistance(5)])]
+
+
+def _frame(x, y, noise=0):
+    frame = np.full((50, 50), 200, np.uint8)
+    if noise > 0:
+        frame += np.random.RandomState(x + y).randint(0, noise + 1, frame.shape).astype(np.uint8)
+    frame[y: y + 4, x: x + 4] = 20
+    return frame
+
+
+class TestMotionGate(unittest.TestCase):
+
+    def _tracker(self, **kwargs):
+        roi = ROI(np.array([[0, 0], [40, 0], [40, 40], [0, 40]]), 1)
+        return _DarkestPixelTracker(roi, motion_threshold=10, **kwargs)
+
+    def test_static(self):
+        tracker = self._tracker()
+        first = tracker.track(0, _frame(10, 10))
+        self.assertEqual((first[0]["x"], first[0]["y"], first[0]["xy_dist_log10x1000"]), (10, 10, 5))
+        for i in range(1, 5):
+            # noise below the threshold is not motion
+            points = tracker.track(i * 100, _frame(10, 10, noise=5))
+            self.assertEqual(len(points), 1)
+            self.assertEqual((points[0]["x"], points[0]["y"]), (10, 10))
+            self.assertEqual(points[0]["xy_dist_log10x1000"], 0)
+            self.assertEqual(points[0]["is_inferred"], 0)
+        self.assertEqual(tracker.n_processed, 1)
+        self.assertEqual(list(tracker.times), [0, 100, 200, 300, 400])
+        # the first data points are not modified
+        self.assertEqual(first[0]["xy_dist_log10x1000"], 5)
+
+    def test_motion(self):
+        tracker = self._tracker()
+        tracker.track(0, _frame(10, 10))
+        tracker.track(100, _frame(10, 10))
+        points = tracker.track(200, _frame(20, 14))
+        self.assertEqual(tracker.n_processed, 2)
+        self.assertEqual((points[0]["x"], points[0]["y"], points[0]["xy_dist_log10x1000"]), (20, 14, 5))
+        # the reference is now the last fully processed frame
+        tracker.track(300, _frame(20, 14))
+        self.assertEqual(tracker.n_processed, 2)
+
+    def test_refresh_interval(self):
+        tracker = self._tracker(motion_refresh_interval=1000)
+        for i in range(25):
+            tracker.track(i * 100, _frame(10, 10))
+        # frames are fully processed at 0, 1000 and 2000 ms
+        self.assertEqual(tracker.n_processed, 3)
+
+
+class TestScratchPool(unittest.TestCase):
+
+    def test_grow(self):
+        pool = ScratchPool()
+        small = pool.borrow("fg", (4, 5))
+        self.assertIs(pool.borrow("fg", (4, 5)), small)
+        large = pool.borrow("fg", (10, 10))
+        self.assertEqual(large.shape, (10, 10))
+        self.assertFalse(np.shares_memory(small, large))
+        # views of the former buffer are not handed out anymore, as they would not be shared
+        again = pool.borrow("fg", (4, 5))
+        self.assertIsNot(again, small)
+        self.assertTrue(np.shares_memory(again, large))
+        self.assertTrue(again.flags["C_CONTIGUOUS"])
+        # smaller shapes are views of the largest buffer
+        self.assertTrue(np.shares_memory(pool.borrow("fg", (3, 3)), large))
+        self.assertEqual(pool.nbytes, 100)
+
+    def test_dtypes(self):
+        pool = ScratchPool()
+        a = pool.borrow("labels", (4, 5))
+        b = pool.borrow("labels", (4, 5), np.int32)
+        self.assertEqual((a.dtype, b.dtype), (np.uint8, np.int32))
+        self.assertFalse(np.shares_memory(a, b))
+        self.assertIs(pool.borrow("labels", (4, 5)), a)
+        self.assertEqual(pool.nbytes, 20 + 80)
+
+    def test_no_aliasing(self):
+        pool = ScratchPool()
+        a = pool.borrow("grey", (6, 6))
+        b = pool.borrow("fg", (6, 6))
+        c = pool.borrow("fg", (2, 6, 3))
+        self.assertFalse(np.shares_memory(a, b))
+        self.assertFalse(np.shares_memory(a, c))
+
+    def _positions(self, rois, pools):
+        trackers = [AdaptiveBGModel(r, scratch_pool=p) for r, p in zip(rois, pools)]
+        out = []
+        cam = MovieVirtualCamera(VIDEO, max_duration=30)
+        try:
+            for t, frame in cam:
+                for tracker in trackers:
+                    out.append([p.as_tuple() for p in tracker.track(t, frame)])
+        finally:
+            cam._close()
+        return out
+
+    def test_shared_by_trackers(self):
+        # the smaller ROI is tracked first, so the buffers grow after it borrowed them
+        rois = [ROI(np.array([[100, 100], [200, 100], [200, 160], [100, 160]]), 1),
+                ROI(np.array([[80, 300], [980, 300], [980, 420], [80, 420]]), 2)]
+        pool = ScratchPool()
+        shared = self._positions(rois, [pool, pool])
+        own = self._positions(rois, [ScratchPool(), ScratchPool()])
+        self.assertEqual(shared, own)
+        self.assertGreater(sum(len(p) for p in own), 0)
@@ -1,6 +1,6 @@
 __author__ = 'quentin'
 
-__all__ = ["trackers", "multi_fly_tracker", "single_roi_tracker", "adaptive_bg_tracker"]
+__all__ = ["trackers", "history", "multi_fly_tracker", "single_roi_tracker", "adaptive_bg_tracker"]
 
 """
 import trackers
@@ -2,7 +2,7 @@
 __author__ = 'quentin'
 
 from collections import deque
-from math import log10, sqrt, pi
+from math import log10, sqrt, pi, log, exp
 import cv2
 
 try:
@@ -12,23 +12,48 @@ except:
 
 
 import numpy as np
-from scipy import ndimage
 from ethoscope.core.variables \
    import XPosVariable, YPosVariable, XYDistance, \
           WidthVariable, HeightVariable, PhiVariable, Label
-from ethoscope.core.data_point import DataPoint
-from ethoscope.trackers.trackers import BaseTracker, NoPositionError
+from ethoscope.core.data_point import DataPoint, DataPointSchema
+from ethoscope.trackers.trackers import BaseTracker, NoPositionError, ScratchPool
+from ethoscope.utils.img_proc import grey_image
 
 import logging
 
 
+def _connected_components(img, labels):
+    # with statistics, the block-based algorithm of Grana et al. is several times faster than the default one
+    if hasattr(cv2, "connectedComponentsWithStatsWithAlgorithm"):
+        return cv2.connectedComponentsWithStatsWithAlgorithm(img, 8, cv2.CV_32S, cv2.CCL_GRANA, labels)
+    return cv2.connectedComponentsWithStats(img, labels, connectivity=8)
+
+
 class ObjectModel(object):
     """
     A class to model, update and predict foreground object (i.e. tracked animal).
+    The model is built from the objects seen during the last ``history_duration`` ms.
+    The mean and the spread of each feature are maintained incrementally, as the history is updated, so computing
+    a distance does not depend on the length of the history.
+
+    The spread of a feature used to be its mean absolute deviation, which cannot be updated incrementally.
+    It is now estimated from the standard deviation, times sqrt(2/pi). This is the expected mean absolute
+    deviation of normally distributed features, and distances stay within about 1% of their former values for those.
+    For other distributions, the spread differs from the mean absolute deviation (e.g. 8% smaller for uniform
+    features, 13% larger for Laplace distributed ones), so distances to outlying objects change accordingly.
     """
     _sqrt_2_pi = sqrt(2.0 * pi)
-    def __init__(self, history_length=1000):
-        #fixme this should be time, not number of points!
+    # for normally distributed values, the mean absolute deviation is the standard deviation times sqrt(2/pi)
+    _mad_per_std = sqrt(2.0 / pi)
+    _initial_buffer_length = 64
+
+    def __init__(self, history_duration=30 * 1000, max_history_length=1000):
+        """
+        :param history_duration: the duration of the history, in ms
+        :type history_duration: int
+        :param max_history_length: the maximal number of objects in the history. It bounds memory at high frame rates.
+        :type max_history_length: int
+        """
         self._features_header = [
             "fg_model_area",
             "fg_model_height",
@@ -36,10 +61,19 @@ class ObjectModel(object):
             "fg_model_mean_grey"
         ]
 
-        self._history_length = history_length
-        self._ring_buff = np.zeros((self._history_length, len(self._features_header)), dtype=np.float32, order="F")
-        self._std_buff = np.zeros((self._history_length, len(self._features_header)), dtype=np.float32, order="F")
-        self._ring_buff_idx=0
+        self._history_duration = history_duration
+        self._max_history_length = max_history_length
+        # the buffer grows, up to the maximal length, as needed for the frame rate
+        buffer_length = min(self._initial_buffer_length, max_history_length)
+        self._ring_buff = np.zeros((buffer_length, len(self._features_header)), dtype=np.float32)
+        self._ring_times = np.zeros(buffer_length, dtype=np.float64)
+        self._head = 0
+        self._n = 0
+        self._n_since_recompute = 0
+        # running sums of the features, and of their squares, over the history
+        self._sums = np.zeros(len(self._features_header), np.float64)
+        self._sums_sq = np.zeros(len(self._features_header), np.float64)
+        self._statistics_cache = None
         self._is_ready = False
         self._roi_img_buff = None
         self._mask_img_buff = None
@@ -58,50 +92,138 @@ class ObjectModel(object):
         return self._features_header
 
 
-    def update(self, img, contour, time):
-        self._last_updated_time = time
-        self._ring_buff[self._ring_buff_idx] = self.compute_features(img,contour)
+    def __len__(self):
+        return self._n
 
-        self._ring_buff_idx += 1
+    def _rows(self):
+        return (np.arange(self._head, self._head + self._n) % len(self._ring_buff))
 
-        if self._ring_buff_idx == self._history_length:
-            self._is_ready = True
-            self._ring_buff_idx = 0
+    def _pop(self):
+        old = self._ring_buff[self._head].astype(np.float64)
+        self._sums -= old
+        self._sums_sq -= old ** 2
+        self._head = (self._head + 1) % len(self._ring_buff)
+        self._n -= 1
 
+    def _grow(self):
+        rows = self._rows()
+        length = min(2 * len(self._ring_buff), self._max_history_length)
+        ring_buff = np.zeros((length, self._ring_buff.shape[1]), dtype=self._ring_buff.dtype)
+        ring_times = np.zeros(length, dtype=self._ring_times.dtype)
+        ring_buff[:self._n] = self._ring_buff[rows]
+        ring_times[:self._n] = self._ring_times[rows]
+        self._ring_buff, self._ring_times = ring_buff, ring_times
+        self._head = 0
 
-        return self._ring_buff[self._ring_buff_idx]
+    def update(self, img, contour, time):
+        self._last_updated_time = time
 
-    def distance(self, features, time):
+        # the history is full when it covers its whole duration (or maximal length)
+        while self._n > 0 and time - self._ring_times[self._head] > self._history_duration:
+            self._pop()
+            self._is_ready = True
+        if self._n == len(self._ring_buff):
+            if self._n < self._max_history_length:
+                self._grow()
+            else:
+                self._pop()
+                self._is_ready = True
+
+        idx = (self._head + self._n) % len(self._ring_buff)
+        row = self._ring_buff[idx]
+        row[:] = self.compute_features(img,contour)
+        self._ring_times[idx] = time
+        self._n += 1
+
+        new = row.astype(np.float64)
+        self._sums += new
+        self._sums_sq += new ** 2
+        self._statistics_cache = None
+
+        self._n_since_recompute += 1
+        if self._n_since_recompute >= len(self._ring_buff):
+            # recompute the sums from scratch once in a while, so rounding errors do not accumulate
+            data = self._ring_buff[self._rows()].astype(np.float64)
+            self._sums = np.sum(data, 0)
+            self._sums_sq = np.sum(data ** 2, 0)
+            self._n_since_recompute = 0
+
+        return row
+
+    def _statistics(self):
+        # the means, the normalisation factors and the inverse of twice the squared spread of each feature
+        if self._statistics_cache is not None:
+            return self._statistics_cache
+
+        n = self._n
+        out = ()
+        if n > 0:
+            means = self._sums / n
+            variances = self._sums_sq / n - means ** 2
+            # variances within rounding error of zero mean all values are identical
+            if not np.any(variances <= 1e-9 * (means ** 2 + 1)):
+                stds = np.sqrt(variances) * self._mad_per_std
+                out = (means, 1 / (stds * self._sqrt_2_pi), 1 / (2 * stds ** 2))
+        self._statistics_cache = out
+        return out
+
+    def _check_updated(self, time):
         if time - self._last_updated_time > self._max_unupdated_duration:
             logging.warning("FG model not updated for too long. Resetting.")
-            self.__init__(self._history_length)
-            return 0
+            self.__init__(self._history_duration, self._max_history_length)
+            return False
+        return True
 
-        if not self._is_ready:
-            last_row = self._ring_buff_idx + 1
-        else:
-            last_row = self._history_length
-
-        means = np.mean(self._ring_buff[:last_row ], 0)
+    def distance(self, features, time):
+        """
+        :param features: the features of an object, as returned by :meth:`compute_features`
+        :param time: the current time, in ms
+        :return: the mean negative log likelihood of the features, given the model
+        :rtype: float
+        """
+        if not self._check_updated(time):
+            return 0
+        stats = self._statistics()
+        if len(stats) == 0:
+            return 0
 
-        np.subtract(self._ring_buff[:last_row], means, self._std_buff[:last_row])
-        np.abs(self._std_buff[:last_row], self._std_buff[:last_row])
+        # a few scalars: plain python is much faster than numpy here
+        logls = 0.0
+        for f, m, a, k in zip(features, *stats):
+            likelihood = a * exp(- (f - m) ** 2 * k)
+            if likelihood == 0:
+                return 0
+            logls += log10(likelihood)
+        return -1.0 * logls / len(stats[0])
 
-        stds = np.mean(self._std_buff[:last_row], 0)
-        if (stds == 0).any():
-            return 0
+    def distances(self, features, time):
+        """
+        Vectorised :meth:`distance` for several candidate objects.
 
-        a = 1 / (stds* self._sqrt_2_pi)
+        :param features: the features of each candidate object, as returned by :meth:`compute_features`
+        :type features: list(:class:`~numpy.ndarray`)
+        :param time: the current time, in ms
+        :return: the mean negative log likelihood of the features of each candidate, given the model
+        :rtype: :class:`~numpy.ndarray`
+        """
+        features = np.array(features, np.float64, ndmin=2)
+        out = np.zeros(features.shape[0])
 
-        b = np.exp(- (features - means) ** 2  / (2 * stds ** 2))
+        if not self._check_updated(time):
+            return out
+        stats = self._statistics()
+        if len(stats) == 0:
+            return out
+        means, a, k = stats
 
-        likelihoods =  a * b
+        likelihoods =  a * np.exp(- (features - means) ** 2 * k)
 
-        if np.any(likelihoods == 0):
-            return 0
-        #print features, means
-        logls = np.sum(np.log10(likelihoods)) / len(likelihoods)
-        return -1.0 * logls
+        # as before, candidates with a null likelihood get a null distance
+        positive = likelihoods > 0
+        logls = np.log10(likelihoods, where=positive, out=np.zeros_like(likelihoods))
+        out = np.sum(logls, 1) * (-1.0 / features.shape[1])
+        out[~np.all(positive, 1)] = 0
+        return out
 
 
     def compute_features(self, img, contour):
@@ -117,9 +239,11 @@ class ObjectModel(object):
 
         sub_mask = self._mask_img_buff[0 : h, 0 : w]
 
-        sub_grey = self._roi_img_buff[ 0 : h, 0: w]
-
-        cv2.cvtColor(img[y : y + h, x : x + w, :],cv2.COLOR_BGR2GRAY,sub_grey)
+        sub_img = img[y : y + h, x : x + w]
+        if sub_img.ndim == 2:
+            sub_grey = sub_img
+        else:
+            sub_grey = cv2.cvtColor(sub_img, cv2.COLOR_BGR2GRAY, self._roi_img_buff[0 : h, 0 : w])
         sub_mask.fill(0)
 
         cv2.drawContours(sub_mask,[contour],-1, 255,-1,offset=(-x,-y))
@@ -175,6 +299,7 @@ class BackgroundModel(object):
 
         self._buff_alpha_matrix = None
         self._buff_invert_alpha_mat = None
+        self._buff_bg_uint8 = None
         # the time stamp of the frame last used to update
         self.last_t = 0
 
@@ -182,20 +307,44 @@ class BackgroundModel(object):
     def bg_img(self):
         return self._bg_mean
 
+    @property
+    def bg_img_uint8(self):
+        """
+        :return: The background as an 8 bit image, in a buffer that is reused for each frame. `None` before the first update.
+        :rtype: :class:`~numpy.ndarray`
+        """
+        bg = self.bg_img
+        if bg is None:
+            return None
+        if self._buff_bg_uint8 is None or self._buff_bg_uint8.shape != bg.shape:
+            self._buff_bg_uint8 = np.empty(bg.shape, np.uint8)
+        np.copyto(self._buff_bg_uint8, bg, casting="unsafe")
+        return self._buff_bg_uint8
+
     def increase_learning_rate(self):
         self._current_half_life  /=  self._increment
 
     def decrease_learning_rate(self):
         self._current_half_life  *=  self._increment
 
-    def update(self, img_t, t, fg_mask=None):
+    def _learning_rate(self, t):
         dt = float(t - self.last_t)
         if dt < 0:
             # raise EthoscopeException("Negative time interval between two consecutive frames")
             raise NoPositionError("Negative time interval between two consecutive frames")
 
-        # clip the half life to possible value:
-        self._current_half_life = np.clip(self._current_half_life, self._min_half_life, self._max_half_life)
+        # clip the half life to possible value (scalar operations are much faster than numpy's here)
+        self._current_half_life = min(max(self._current_half_life, self._min_half_life), self._max_half_life)
+
+        # the learning rate, alpha, is an exponential function of half life
+        # it correspond to how much the present frame should account for the background
+
+        lam =  log(2) / self._current_half_life
+        # how much the current frame should be accounted for
+        return 1 - exp(-lam * dt)
+
+    def update(self, img_t, t, fg_mask=None):
+        alpha = self._learning_rate(t)
 
         # ensure preallocated buffers exist. otherwise, initialise them
         if self._bg_mean is None:
@@ -206,13 +355,6 @@ class BackgroundModel(object):
         if self._buff_alpha_matrix is None:
             self._buff_alpha_matrix = np.ones_like(img_t, dtype = np.float32)
 
-        # the learning rate, alpha, is an exponential function of half life
-        # it correspond to how much the present frame should account for the background
-
-        lam =  np.log(2) / self._current_half_life
-        # how much the current frame should be accounted for
-        alpha = 1 - np.exp(-lam * dt)
-
         # set-p a matrix of learning rate. it is 0 where foreground map is true
         self._buff_alpha_matrix.fill(alpha)
         if fg_mask is not None:
@@ -231,11 +373,204 @@ class BackgroundModel(object):
         self.last_t = t
 
 
+class BatchedBackgroundModel(object):
+    """
+    A frame-level background engine shared by the trackers of all ROIs.
+    It keeps a single background for the bounding box of the union of ROIs, and each tracker uses a
+    :class:`~ethoscope.trackers.adaptive_bg_tracker.BatchedBackgroundModelView` on its own region instead of a private
+    :class:`~ethoscope.trackers.adaptive_bg_tracker.BackgroundModel`.
+    Trackers only stage their updates. When a frame is fully tracked, the monitor calls :meth:`flush`, which blends all
+    the staged regions into the background at once, each with its own learning rate.
+    The result is the same as with one background model per ROI (up to rounding), but with a few vectorised operations per frame
+    instead of about ten per ROI.
+
+    >>> bg_model = BatchedBackgroundModel()
+    >>> monitor = Monitor(cam, AdaptiveBGModel, rois, batched_bg_model=bg_model)
+
+    This is opt-in: the blend covers the bounding box of all ROIs, gaps included, so it only pays off when the
+    overhead of each call dominates, i.e. with many small ROIs. On a desktop x86 CPU (one core), updating the background
+    took 2.5 ms per frame instead of 3.6 ms for 200 ROIs of 20 x 20 pixels, and 2.4 ms instead of 2.6 ms for 96 ROIs
+    of 40 x 40 pixels. With fewer, larger ROIs (e.g. 20 ROIs of 200 x 200 pixels, or the usual layouts of tubes),
+    it was 10 to 30% slower than one model per ROI. It has not been measured on other targets.
+    Pixels shared by several ROI polygons are attributed to the last of them.
+    """
+    def __init__(self):
+        self._views = []
+        self._rectangle = None
+        self._labels = None
+        self._bg_mean = None
+        self._staged_grey = None
+        self._staged_fg = None
+        self._alpha_map = None
+        self._buff_diff = None
+        self._alphas = None
+        self._is_initialised = None
+        self._staged = set()
+
+    def view(self, roi, *args, **kwargs):
+        """
+        Register a ROI and get the background model its tracker should use.
+
+        :param roi: The region of interest
+        :type roi: :class:`~ethoscope.core.roi.ROI`
+        :param args: additional arguments passed to the :class:`~ethoscope.trackers.adaptive_bg_tracker.BackgroundModel` constructor
+        :param kwargs: additional keyword arguments passed to the :class:`~ethoscope.trackers.adaptive_bg_tracker.BackgroundModel` constructor
+        :return: a background model on the region of the ROI
+        :rtype: :class:`~ethoscope.trackers.adaptive_bg_tracker.BatchedBackgroundModelView`
+        """
+        if self._bg_mean is not None:
+            raise ValueError("Cannot add a ROI to a batched background model that is already in use")
+        out = BatchedBackgroundModelView(self, len(self._views), roi, *args, **kwargs)
+        self._views.append(out)
+        return out
+
+    def _allocate(self):
+        rects = [v.roi.rectangle for v in self._views]
+        x0 = min(r[0] for r in rects)
+        y0 = min(r[1] for r in rects)
+        x1 = max(r[0] + r[2] for r in rects)
+        y1 = max(r[1] + r[3] for r in rects)
+        self._rectangle = x0, y0, x1 - x0, y1 - y0
+        shape = (y1 - y0, x1 - x0)
+
+        # the index of the ROI each pixel belongs to. The last index (i.e. a null learning rate) for none
+        if len(self._views) < 255:
+            self._labels = np.empty(shape, np.uint8)
+            self._alphas = np.zeros(256, np.float32)
+        else:
+            self._labels = np.empty(shape, np.intp)
+            self._alphas = np.zeros(len(self._views) + 1, np.float32)
+        self._labels.fill(len(self._alphas) - 1)
+
+        for v in self._views:
+            self._labels[v.slices][v.mask] = v.slot
+            # ROIs with no other ROI in their bounding rectangle can be copied without mask
+            v.is_exclusive = not any(self._overlap(v.roi.rectangle, o.roi.rectangle) for o in self._views if o is not v)
+
+        self._bg_mean = np.zeros(shape, np.float32)
+        self._staged_grey = np.zeros(shape, np.float32)
+        self._staged_fg = np.zeros(shape, np.uint8)
+        self._alpha_map = np.zeros(shape, np.float32)
+        self._buff_diff = np.zeros(shape, np.float32)
+        self._is_initialised = np.zeros(len(self._views), np.bool_)
+
+    @staticmethod
+    def _overlap(a, b):
+        return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+    def _copy(self, view, dst, src):
+        if view.is_exclusive:
+            dst[:] = src
+        else:
+            np.copyto(dst, src, where=view.mask)
+
+    @property
+    def rectangle(self):
+        """
+        :return: The bounding rectangle of all ROIs (x, y, w, h). `None` before the first update.
+        :rtype: (int,int,int,int)
+        """
+        return self._rectangle
+
+    def _bg_img(self, view):
+        if view.slot in self._staged:
+            # a ROI of the previous frame is tracked again, so the previous frame is over
+            self.flush()
+        if self._bg_mean is None or not self._is_initialised[view.slot]:
+            return None
+        return self._bg_mean[view.slices]
+
+    def _stage(self, view, img_t, alpha, fg_mask):
+        if self._bg_mean is None:
+            self._allocate()
+        if view.slot in self._staged:
+            self.flush()
+
+        if not self._is_initialised[view.slot]:
+            self._copy(view, self._bg_mean[view.slices], img_t)
+            self._is_initialised[view.slot] = True
+
+        self._copy(view, self._staged_grey[view.slices], img_t)
+        if fg_mask is not None:
+            self._copy(view, self._staged_fg[view.slices], fg_mask)
+        self._alphas[view.slot] = alpha
+        self._staged.add(view.slot)
+
+    def flush(self):
+        """
+        Blend all the staged regions into the background. Monitors call this once all ROIs of a frame are tracked.
+        Otherwise (e.g. for trackers used without a monitor), it is called when a ROI is tracked again.
+        """
+        if len(self._staged) == 0:
+            return
+        # expand the learning rate of each ROI to a matrix. it is 0 where foreground map is true and for unstaged ROIs
+        if self._labels.dtype == np.uint8:
+            cv2.LUT(self._labels, self._alphas, self._alpha_map)
+        else:
+            np.take(self._alphas, self._labels, out=self._alpha_map)
+        cv2.subtract(self._alpha_map, self._alpha_map, self._alpha_map, mask=self._staged_fg)
+
+        # bg = alpha * img + (1 - alpha) * bg, in two passes
+        cv2.subtract(self._staged_grey, self._bg_mean, self._buff_diff)
+        cv2.accumulateProduct(self._buff_diff, self._alpha_map, self._bg_mean)
+
+        self._alphas.fill(0)
+        self._staged_fg.fill(0)
+        self._staged.clear()
+
+
+class BatchedBackgroundModelView(BackgroundModel):
+    def __init__(self, batched_model, slot, roi, *args, **kwargs):
+        """
+        The background model of a single ROI within a :class:`~ethoscope.trackers.adaptive_bg_tracker.BatchedBackgroundModel`.
+        It keeps its own learning rate, but its background is a view of the shared one and its updates are only staged.
+
+        :param batched_model: the shared background model
+        :type batched_model: :class:`~ethoscope.trackers.adaptive_bg_tracker.BatchedBackgroundModel`
+        :param slot: the index of this view in the shared model
+        :type slot: int
+        :param roi: The region of interest
+        :type roi: :class:`~ethoscope.core.roi.ROI`
+        """
+        super(BatchedBackgroundModelView, self).__init__(*args, **kwargs)
+        self._batched_model = batched_model
+        self.slot = slot
+        self.roi = roi
+        self.mask = roi.mask() > 0
+        self.is_exclusive = False
+        self._slices = None
+
+    @property
+    def slices(self):
+        if self._slices is None:
+            bx, by, _, _ = self._batched_model.rectangle
+            x, y, w, h = self.roi.rectangle
+            self._slices = (slice(y - by, y - by + h), slice(x - bx, x - bx + w))
+        return self._slices
+
+    @property
+    def bg_img(self):
+        return self._batched_model._bg_img(self)
+
+    def update(self, img_t, t, fg_mask=None):
+        alpha = self._learning_rate(t)
+        if fg_mask is not None:
+            cv2.dilate(fg_mask, None, fg_mask)
+        self._batched_model._stage(self, img_t, alpha, fg_mask)
+        self.last_t = t
+
+
 class AdaptiveBGModel(BaseTracker):
     _description = {"overview": "The default tracker for fruit flies. One animal per ROI.",
                     "arguments": []}
 
-    fg_model = ObjectModel()
+    _fg_model_history_duration = 30 * 1000 # ms
+    _uses_scratch_pool = True
+    _data_point_schema = DataPointSchema.get([XPosVariable, YPosVariable, WidthVariable, HeightVariable,
+                                              PhiVariable, XYDistance])
+    # blobs of up to three pixels fit in 3 x 3 pixels, and approxPolyDP reduces them to fewer than three vertices,
+    # so they cannot be the animal. Larger blobs are kept, and filtered by their number of vertices, as contours were
+    _min_blob_area = 4
 
     # L.Zi.: propagate *args, **kwargs, don't know what 'data' is for.
     #def __init__(self, roi, data=None):
@@ -246,9 +581,21 @@ class AdaptiveBGModel(BaseTracker):
         TODO more description here
         :param roi:
         :param data:
+        :param search_window: Enables the predictive search window. The next position is predicted from the last two,
+            and the animal is first searched within this many animal lengths (plus the predicted motion) of it.
+            The whole ROI is searched when the animal is not found alone within the window. `None` (default)
+            always searches the whole ROI.
+        :type search_window: float
+        :param search_window_timeout: With a search window, the maximal time between two searches of the whole ROI, in ms
+        :type search_window_timeout: int
+        :param scale_factor: Enables multi-resolution tracking. Detection and background modelling run on the ROI
+            downscaled by this factor, and the position, size and angle of the animal are then refined at full resolution,
+            around the detection. `1` (default) tracks at full resolution. It cannot be used with a ``batched_bg_model``.
+        :type scale_factor: float
         :return:
         """
         data = None
+        self.fg_model = ObjectModel(self._fg_model_history_duration)
         self._previous_shape = None
         self._object_expected_size = 0.035 # proportion of the roi main axis
         self._max_area = (5 * self._object_expected_size) ** 2
@@ -257,17 +604,38 @@ class AdaptiveBGModel(BaseTracker):
         self._smooth_mode_tstamp = deque()
         self._smooth_mode_window_dt = 30 * 1000 #miliseconds
 
-
-        self._bg_model = BackgroundModel()
+        self._search_window = kwargs.get("search_window")
+        self._search_window_timeout = kwargs.get("search_window_timeout", 10 * 1000)
+        # the time, position and length of the animal, for the last detections
+        self._last_detections = deque(maxlen=2)
+        self._last_full_search_t = 0
+        self._n_window_hits = 0
+        self._n_window_misses = 0
+
+        self._scale_factor = float(kwargs.get("scale_factor", 1.0))
+        if not 0 < self._scale_factor <= 1:
+            raise ValueError("The scale factor must be between 0 and 1")
+        if self._scale_factor < 1 and kwargs.get("batched_bg_model") is not None:
+            raise ValueError("A batched background model works at full resolution, so it cannot be used with a scale factor")
+        self._small_mask = None
+        self._intensity_scale = 1.0
+        self._old_full_pos = 0.0 + 0.0j
+
+        if kwargs.get("batched_bg_model") is None:
+            self._bg_model = BackgroundModel()
+        else:
+            self._bg_model = kwargs["batched_bg_model"].view(roi)
         self._max_m_log_lik = 6.
+        # scratch buffers are borrowed from a pool shared with the trackers of other ROIs
+        if kwargs.get("scratch_pool") is None:
+            self._scratch_pool = ScratchPool()
+        else:
+            self._scratch_pool = kwargs["scratch_pool"]
         self._buff_grey = None
-        self._buff_object = None
-        self._buff_object_old = None
         self._buff_grey_blurred = None
         self._buff_fg = None
         self._buff_convolved_mask = None
-        self._buff_fg_backup = None
-        self._buff_fg_diff = None
+        self._buff_labels = None
         self._old_sum_fg = 0
 
         # L. Zi.: video writer to produce optional single roi processing debug video
@@ -285,11 +653,23 @@ class AdaptiveBGModel(BaseTracker):
              if a == "dbg_roi_video_filename":
                self._dbg_single_roi_video_filename = kwargs["dbg_roi_video_filename"]
 
-        super(AdaptiveBGModel, self).__init__(roi, data)
+        super(AdaptiveBGModel, self).__init__(roi, data, **kwargs)
+
+    @property
+    def search_window_hit_rate(self):
+        """
+        :return: The proportion of searches within a predictive window that found the animal. `None` if there was none.
+        :rtype: float
+        """
+        n = self._n_window_hits + self._n_window_misses
+        if n == 0:
+            return None
+        return self._n_window_hits / float(n)
 
     def __del__(self):
         # L. Zi.: for closing video output file when doing single roi processing debug video
-        if self._dbg_roi_video_writer is not None:
+        # (the writer is not set if the constructor raised before)
+        if getattr(self, "_dbg_roi_video_writer", None) is not None:
             self._dbg_roi_video_writer.release()
         pass
 
@@ -308,22 +688,24 @@ class AdaptiveBGModel(BaseTracker):
         if blur_rad % 2 == 0:
             blur_rad += 1
 
-        if self._buff_grey is None:
-            self._buff_grey = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            if mask is None:
-                mask = np.ones_like(self._buff_grey) * 255
+        self._buff_grey = self._scratch_pool.borrow("grey", img.shape[0:2])
+        if mask is None:
+            mask = np.ones_like(self._buff_grey) * 255
 
-        cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, self._buff_grey)
-        
-        cv2.GaussianBlur(self._buff_grey, (blur_rad, blur_rad), 1.2, self._buff_grey)
+        # greyscale frames are blurred straight into the buffer, without a copy
+        grey = grey_image(img, None if img.ndim == 2 else self._buff_grey)
+
+        cv2.GaussianBlur(grey, (blur_rad, blur_rad), 1.2, self._buff_grey)
         if darker_fg:
             cv2.subtract(255, self._buff_grey, self._buff_grey)
 
         mean = cv2.mean(self._buff_grey, mask)
 
         scale = 128. / mean[0]
+        # kept to normalise the full resolution neighbourhood of the animal in the same way
+        self._intensity_scale = scale
 
-        logging.debug("_pre_process_input_minimal: cv2.multiply(%s, %s)" % (self._buff_grey, scale))
+        logging.debug("_pre_process_input_minimal: cv2.multiply(%s, %s)", self._buff_grey, scale)
         cv2.multiply(self._buff_grey, scale, dst = self._buff_grey)
 
 
@@ -339,7 +721,7 @@ class AdaptiveBGModel(BaseTracker):
 
 
         if self._buff_grey is None:
-            self._buff_grey = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
+            self._buff_grey = grey_image(img).copy()
             self._buff_grey_blurred = np.empty_like(self._buff_grey)
             # self._buff_grey_blurred = np.empty_like(self._buff_grey)
             if mask is None:
@@ -350,7 +732,7 @@ class AdaptiveBGModel(BaseTracker):
             self._buff_convolved_mask  = (1 / 255.0 *  mask_conv.astype(np.float32))
 
 
-        cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, self._buff_grey)
+        grey_image(img, self._buff_grey)
 
         hist = cv2.calcHist([self._buff_grey], [0], None, [256], [0,255]).ravel()
         hist = np.convolve(hist, [1] * 3)
@@ -387,6 +769,8 @@ class AdaptiveBGModel(BaseTracker):
 
 
     def _find_position(self, img, mask, t):
+        if self._scale_factor < 1:
+            return self._find_position_multi_resolution(img, mask, t)
 
         grey = self._pre_process_input_minimal(img, mask, t)
         # grey = self._pre_process_input(img, mask, t)
@@ -403,84 +787,264 @@ class AdaptiveBGModel(BaseTracker):
             raise NoPositionError
 
 
-    def _track(self, img, grey, mask, t):
-
-        if self._bg_model.bg_img is None:
-            self._buff_fg = np.empty_like(grey)
-            self._buff_object= np.empty_like(grey)
-            self._buff_fg_backup = np.empty_like(grey)
-  #          self._buff_fg_diff = np.empty_like(grey)
-            self._old_pos = 0.0 + 0.0j
-   #         self._old_sum_fg = 0
+    def _downscale(self, img, mask):
+        size = (max(1, int(round(img.shape[1] * self._scale_factor))),
+                max(1, int(round(img.shape[0] * self._scale_factor))))
+        small = self._scratch_pool.borrow("small", (size[1], size[0]) + img.shape[2:])
+        cv2.resize(img, size, small, interpolation=cv2.INTER_AREA)
+        if mask is None:
+            return small, None
+        # masks do not change, so they are downscaled once
+        if self._small_mask is None or self._small_mask.shape != small.shape[0:2]:
+            self._small_mask = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
+        return small, self._small_mask
+
+    def _find_position_multi_resolution(self, img, mask, t):
+        small_img, small_mask = self._downscale(img, mask)
+        grey = self._pre_process_input_minimal(small_img, small_mask, t)
+        try:
+            points = self._track(small_img, grey, small_mask, t)
+        except NoPositionError:
+            self._bg_model.update(grey, t)
             raise NoPositionError
+        return [self._refine_position(img, mask, p) for p in points]
 
-        bg = self._bg_model.bg_img.astype(np.uint8)
+    def _refine_position(self, img, mask, point):
+        """
+        Refine, at full resolution, a position found on the downscaled ROI. The neighbourhood of the animal is
+        preprocessed as in :meth:`_pre_process_input_minimal`, and subtracted from the upsampled background.
+        The coarse position is kept (in full resolution units) when the animal cannot be found again.
+        """
+        s = self._scale_factor
+        x = (point["x"] + .5) / s - .5
+        y = (point["y"] + .5) / s - .5
+        w, h, angle = point["w"] / s, point["h"] / s, point["phi"]
 
-        cv2.subtract(grey, bg, self._buff_fg)
+        blur_rad = int(self._object_expected_size * np.max(img.shape) / 2.0)
+        if blur_rad % 2 == 0:
+            blur_rad += 1
+        # the neighbourhood spans one body length around the animal, plus a margin for the blur
+        r = w + 1.0 / s + blur_rad
+        x0, y0 = max(0, int(x - r)), max(0, int(y - r))
+        x1, y1 = min(img.shape[1], int(x + r) + 2), min(img.shape[0], int(y + r) + 2)
+        size = (y1 - y0, x1 - x0)
+
+        grey = self._scratch_pool.borrow("refine_grey", size)
+        bg = self._scratch_pool.borrow("refine_bg", size)
+        sub_img = img[y0: y1, x0: x1]
+        src = grey_image(sub_img, None if sub_img.ndim == 2 else grey)
+        cv2.GaussianBlur(src, (blur_rad, blur_rad), 1.2, grey)
+        cv2.subtract(255, grey, grey)
+        cv2.multiply(grey, self._intensity_scale, dst=grey)
+        if mask is not None:
+            cv2.bitwise_and(grey, mask[y0: y1, x0: x1], grey)
 
-        cv2.threshold(self._buff_fg, 20, 255, cv2.THRESH_TOZERO, dst=self._buff_fg)
+        # maps the pixels of the neighbourhood to the downscaled background
+        m = np.array([[s, 0, (x0 + .5) * s - .5], [0, s, (y0 + .5) * s - .5]], np.float32)
+        cv2.warpAffine(self._bg_model.bg_img_uint8, m, (size[1], size[0]), bg,
+                       cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, cv2.BORDER_REPLICATE)
+        cv2.subtract(grey, bg, grey)
+        cv2.threshold(grey, 20, 255, cv2.THRESH_TOZERO, dst=grey)
 
-        # L.Zi. make a copy of extracted foreground to illustrate detection for debugging
-        fg_cpy = np.copy(self._buff_fg)
+        # older versions of opencv modify their input
+        fg = grey if CV_VERSION > 3 else grey.copy()
+        if CV_VERSION == 3:
+            _, contours, _ = cv2.findContours(fg, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        else:
+            contours, _ = cv2.findContours(fg, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours = [c for c in contours if c.shape[0] >= 3]
+
+        # the animal may be split in several blobs at full resolution, so all the blobs within
+        # half a body length of the coarse position are merged
+        radius = w / 2.0 + 1.0 / s
+        contours = [c for c in contours if cv2.pointPolygonTest(c, (x - x0, y - y0), True) >= -radius]
+
+        if len(contours) > 0:
+            hull = np.concatenate(contours)
+            bx, by, bw, bh = cv2.boundingRect(hull)
+            moments = cv2.moments(grey[by: by + bh, bx: bx + bw])
+            if moments["m00"] > 0:
+                (_, _), (w, h), angle = cv2.minAreaRect(hull)
+                if w < h:
+                    angle -= 90
+                    w, h = h, w
+                angle = angle % 180
+                x = x0 + bx + moments["m10"] / moments["m00"]
+                y = y0 + by + moments["m01"] / moments["m00"]
 
-        # cv2.bitwise_and(self._buff_fg_backup,self._buff_fg,dst=self._buff_fg_diff)
-        # sum_fg = cv2.countNonZero(self._buff_fg)
+        pos = x + 1.0j * y
+        xy_dist = round(abs(pos - self._old_full_pos))
+        self._old_full_pos = pos
+
+        return DataPoint.from_schema(self._data_point_schema,
+                                     [int(round(x)), int(round(y)), int(round(w)), int(round(h)),
+                                      int(round(angle)), int(xy_dist)])
+
+    def _predict_search_window(self, shape, t):
+        if self._search_window is None or len(self._last_detections) == 0:
+            return None
+        if t - self._last_full_search_t > self._search_window_timeout:
+            return None
+        t1, p1, length = self._last_detections[-1]
+        if t - t1 > self._search_window_timeout:
+            return None
+
+        velocity = 0
+        if len(self._last_detections) > 1:
+            t0, p0, _ = self._last_detections[0]
+            if t1 > t0:
+                velocity = (p1 - p0) / float(t1 - t0)
+        motion = velocity * (t - t1)
+        pos = p1 + motion
+        half_size = self._search_window * length + abs(motion)
+
+        x0 = max(0, int(pos.real - half_size))
+        y0 = max(0, int(pos.imag - half_size))
+        x1 = min(shape[1], int(pos.real + half_size) + 2)
+        y1 = min(shape[0], int(pos.imag + half_size) + 2)
+        # a window nearly as large as the ROI is not worth it
+        if x1 <= x0 or y1 <= y0 or (x1 - x0) * (y1 - y0) > shape[0] * shape[1] / 2:
+            return None
+        return x0, y0, x1 - x0, y1 - y0
+
+    def _segment(self, grey, bg, window):
+        x, y, w, h = window
+        fg = self._buff_fg[y: y + h, x: x + w]
+        cv2.subtract(grey[y: y + h, x: x + w], bg[y: y + h, x: x + w], fg)
+        cv2.threshold(fg, 20, 255, cv2.THRESH_TOZERO, dst=fg)
+
+        n_fg_pix = np.count_nonzero(fg)
+        return n_fg_pix / (1.0 * grey.shape[0] * grey.shape[1])
+
+    def _find_blobs(self, window):
+        """
+        Label the foreground of a window in a single pass, which gives the area and bounding box of all blobs at once.
+        Blobs too small to have three vertices are dropped before their outline is computed.
 
-        self._buff_fg_backup = np.copy(self._buff_fg)
+        :return: the outline and the bounding box (in the ROI) of each blob of at least ``_min_blob_area`` pixels,
+            and the number of blobs, of any size
+        :rtype: (list(tuple), int)
+        """
+        x, y, w, h = window
+        fg = self._buff_fg[y: y + h, x: x + w]
+        # the foreground is sparse, so only its bounding box is labelled
+        fx, fy, fw, fh = cv2.boundingRect(fg)
+        if fw == 0 or fh == 0:
+            return [], 0
+        x, y = x + fx, y + fy
+        fg = fg[fy: fy + fh, fx: fx + fw]
+        self._buff_labels = self._scratch_pool.borrow("labels", fg.shape, np.int32)
+        n_labels, _, stats, _ = _connected_components(fg, self._buff_labels)
+
+        blobs = []
+        # label 0 is the background
+        for label in np.flatnonzero(stats[1:, cv2.CC_STAT_AREA] >= self._min_blob_area) + 1:
+            bx, by, bw, bh = [int(v) for v in stats[label, 0:4]]
+            blob_mask = cv2.compare(self._buff_labels[by: by + bh, bx: bx + bw], int(label), cv2.CMP_EQ)
+            # a blob is connected, so it has a single outer contour
+            if CV_VERSION == 3:
+                _, contours, _ = cv2.findContours(blob_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                                  offset=(x + bx, y + by))
+            else:
+                contours, _ = cv2.findContours(blob_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                               offset=(x + bx, y + by))
+            blobs.append((cv2.approxPolyDP(contours[0], 1.2, True), (x + bx, y + by, bw, bh)))
+        return blobs, n_labels - 1
+
+    def _is_window_hit(self, blobs, n_blobs, window, shape):
+        # the animal must be alone in the window, and away from its edges (unless they are edges of the ROI)
+        if n_blobs != 1 or len(blobs) != 1 or blobs[0][0].shape[0] < 3:
+            return False
+        x, y, w, h = window
+        cx, cy, cw, ch = blobs[0][1]
+        if (cx <= x and x > 0) or (cy <= y and y > 0):
+            return False
+        if (cx + cw >= x + w and x + w < shape[1]) or (cy + ch >= y + h and y + h < shape[0]):
+            return False
+        return True
 
-        n_fg_pix = np.count_nonzero(self._buff_fg)
-        prop_fg_pix  = n_fg_pix / (1.0 * grey.shape[0] * grey.shape[1])
-        is_ambiguous = False
+    def _track(self, img, grey, mask, t):
 
-        if  prop_fg_pix > self._max_area:
-            # if non-black pixel count in foreground is bigger than the allowed maximum
-            # (five times the expected animal size)
-            self._bg_model.increase_learning_rate()
+        bg = self._bg_model.bg_img_uint8
+        if bg is None:
+            self._old_pos = 0.0 + 0.0j
+   #         self._old_sum_fg = 0
             raise NoPositionError
 
-        if  prop_fg_pix == 0:
-            # if no non-black pixel in foreground is found
-            self._bg_model.increase_learning_rate()
-            raise NoPositionError
+        self._buff_fg = self._scratch_pool.borrow("fg", grey.shape)
+        is_ambiguous = False
 
-        if CV_VERSION == 3:
-            _, contours, hierarchy = cv2.findContours(self._buff_fg, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        else:
-            contours, hierarchy = cv2.findContours(self._buff_fg, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # the animal is first searched around its predicted position
+        window = self._predict_search_window(grey.shape, t)
+        if window is not None:
+            # nothing is foreground outside of the window
+            self._buff_fg.fill(0)
+            prop_fg_pix = self._segment(grey, bg, window)
+            blobs, n_blobs = [], 0
+            if 0 < prop_fg_pix <= self._max_area:
+                blobs, n_blobs = self._find_blobs(window)
+            if self._is_window_hit(blobs, n_blobs, window, grey.shape):
+                self._n_window_hits += 1
+            else:
+                self._n_window_misses += 1
+                window = None
+
+        if window is None:
+            window = (0, 0, grey.shape[1], grey.shape[0])
+            self._last_full_search_t = t
+            prop_fg_pix = self._segment(grey, bg, window)
+
+            if  prop_fg_pix > self._max_area:
+                # if non-black pixel count in foreground is bigger than the allowed maximum
+                # (five times the expected animal size)
+                self._bg_model.increase_learning_rate()
+                raise NoPositionError
 
-        contours = [cv2.approxPolyDP(c, 1.2, True) for c in contours]
+            if  prop_fg_pix == 0:
+                # if no non-black pixel in foreground is found
+                self._bg_model.increase_learning_rate()
+                raise NoPositionError
+
+            blobs, n_blobs = self._find_blobs(window)
+
+        wx, wy, ww, wh = window
+        window_slices = (slice(wy, wy + wh), slice(wx, wx + ww))
 
-        if len(contours) == 0:
-            # if no contour around the non-black foreground pixels may be detected
+        # L.Zi. make a copy of extracted foreground to illustrate detection for debugging
+        if self._dbg_single_roi_do_rec:
+            fg_cpy = np.zeros_like(self._buff_fg)
+            fg_cpy[window_slices] = self._buff_fg[window_slices]
+
+        if n_blobs == 0:
+            # if no blob of non-black foreground pixels may be detected
             self._bg_model.increase_learning_rate()
             raise NoPositionError
 
-        elif len(contours) > 1:
-            # if more than a single contour is found
+        elif n_blobs > 1:
+            # if more than a single blob is found
             if not self.fg_model.is_ready:
                 raise NoPositionError
             # hulls = [cv2.convexHull( c) for c in contours]
-            hulls = contours
             #hulls = merge_blobs(hulls)
 
-            hulls = [h for h in hulls if h.shape[0] >= 3]
+            blobs = [b for b in blobs if b[0].shape[0] >= 3]
 
-            if len(hulls) < 1:
+            if len(blobs) < 1:
                 raise NoPositionError
 
-            elif len(hulls) > 1:
+            elif len(blobs) > 1:
                 is_ambiguous = True
-            cluster_features = [self.fg_model.compute_features(img, h) for h in hulls]
-            all_distances = [self.fg_model.distance(cf,t) for cf in cluster_features]
+            cluster_features = [self.fg_model.compute_features(img, b[0]) for b in blobs]
+            all_distances = self.fg_model.distances(cluster_features, t)
             good_clust = np.argmin(all_distances)
 
-            hull = hulls[good_clust]
+            hull = blobs[good_clust][0]
             distance = all_distances[good_clust]
         else:
-            hull = contours[0]
-            if hull.shape[0] < 3:
+            if len(blobs) == 0 or blobs[0][0].shape[0] < 3:
                 self._bg_model.increase_learning_rate()
                 raise NoPositionError
+            hull = blobs[0][0]
 
             features = self.fg_model.compute_features(img, hull)
             distance = self.fg_model.distance(features, t)
@@ -504,9 +1068,10 @@ class AdaptiveBGModel(BaseTracker):
             raise NoPositionError
 
         #todo center mass just on the ellipse area
-        cv2.bitwise_and(self._buff_fg_backup, self._buff_fg, self._buff_fg_backup)
-
-        y,x = ndimage.measurements.center_of_mass(self._buff_fg_backup)
+        # the animal may be split in several blobs, so the centre of mass is that of the whole foreground
+        moments = cv2.moments(self._buff_fg[window_slices])
+        x = wx + moments["m10"] / moments["m00"]
+        y = wy + moments["m01"] / moments["m00"]
 
         pos = x + 1.0j * y
 
@@ -526,7 +1091,8 @@ class AdaptiveBGModel(BaseTracker):
 
 
         if mask is not None:
-            cv2.bitwise_and(self._buff_fg, mask, self._buff_fg)
+            fg = self._buff_fg[window_slices]
+            cv2.bitwise_and(fg, mask[window_slices], fg)
 
         if is_ambiguous:
             self._bg_model.increase_learning_rate()
@@ -536,14 +1102,15 @@ class AdaptiveBGModel(BaseTracker):
             self._bg_model.update(grey, t, self._buff_fg)
 
         self.fg_model.update(img, hull, t)
+        self._last_detections.append((t, pos, w))
 
-        x_var = XPosVariable(int(round(x)))
-        y_var = YPosVariable(int(round(y)))
-        distance = XYDistance(int(xy_dist))
+        x_var = int(round(x))
+        y_var = int(round(y))
+        distance = int(xy_dist)
         #xor_dist = XorDistance(int(xor_dist))
-        w_var = WidthVariable(int(round(w)))
-        h_var = HeightVariable(int(round(h)))
-        phi_var = PhiVariable(int(round(angle)))
+        w_var = int(round(w))
+        h_var = int(round(h))
+        phi_var = int(round(angle))
         # mlogl =   mLogLik(int(distance*1000))
 
         # L. Zi.: produce and show adaptive background processing results
@@ -551,7 +1118,7 @@ class AdaptiveBGModel(BaseTracker):
           if self._roi._value == self._dbg_single_roi_value:
             animal_colour = (255, 255, 255)
             cv2.ellipse(fg_cpy, ((x, y), (int(w * 1.5), int(h * 1.5)), angle), animal_colour, 1, cv2.LINE_AA)
-            grey_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            grey_img = grey_image(img)
             h = round(self._roi.rectangle[3])
             w = round(self._roi.rectangle[2])
             # draw roi value
@@ -581,7 +1148,8 @@ class AdaptiveBGModel(BaseTracker):
             self._dbg_roi_video_writer.write(vis)
 
 
-        out = DataPoint([x_var, y_var, w_var, h_var,
+        out = DataPoint.from_schema(self._data_point_schema,
+                        [x_var, y_var, w_var, h_var,
                          phi_var,
                          #mlogl,
                          distance,
@@ -0,0 +1,317 @@
+__author__ = 'quentin'
+
+import logging
+
+import numpy as np
+
+from ethoscope.core.data_point import DataPoint
+
+
+class PositionHistory(object):
+
+    # the number of frames and data points the buffers are first allocated for
+    _initial_capacity = 1024
+
+    def __init__(self, max_duration=250 * 1000, max_frames=None, max_rows=None):
+        """
+        A time-indexed ring buffer of the data points found by a tracker.
+        Each data point is stored as a row of a structured array, with a ``t`` column and one column per variable, and
+        each frame as a time stamp and a range of rows. Appending a frame is amortised O(1), and window queries
+        (e.g. all ``x`` since ``t - 10000``) return numpy arrays.
+        The buffers are doubled whenever they are full of frames younger than ``max_duration``, so the history always
+        spans ``max_duration``, whatever the frame rate, unless ``max_frames`` or ``max_rows`` are given.
+        Then, the memory used is bounded, and a warning is logged the first time frames are dropped before ``max_duration``.
+
+        The data points of the last frame are kept as they are, since they may still be completed
+        (e.g. by a stimulator), and are copied into the buffer when the next frame is appended.
+
+        :param max_duration: the maximal time span of the history, in ms
+        :type max_duration: int
+        :param max_frames: the maximal number of frames in the history, at least 2. `None` for no limit
+        :type max_frames: int
+        :param max_rows: the maximal number of data points stored in the buffer (i.e. not counting the last frame).
+            Defaults to ``max_frames``.
+        :type max_rows: int
+        """
+        if max_frames is not None and max_frames < 2:
+            raise ValueError("A history must hold at least two frames")
+        if max_rows is None:
+            max_rows = max_frames
+        self._max_duration = max_duration
+        self._max_frames = max_frames
+        self._max_rows = max_rows
+        self._frame_capacity = self._initial_capacity if max_frames is None else min(self._initial_capacity, max_frames)
+        self._row_capacity = self._initial_capacity if max_rows is None else min(self._initial_capacity, max_rows)
+        self._warned_full = False
+
+        self._frame_t = np.zeros(self._frame_capacity, np.int64)
+        self._frame_start = np.zeros(self._frame_capacity, np.int64)
+        self._frame_n = np.zeros(self._frame_capacity, np.int64)
+        self._frame_schema = [None] * self._frame_capacity
+        self._rows = None
+
+        # absolute indices (i.e. not modulo capacity) of the oldest and next frame/row
+        self._head = 0
+        self._tail = 0
+        self._row_head = 0
+        self._row_tail = 0
+
+        self._last_t = None
+        self._last_points = None
+
+        self.positions = _PositionsView(self)
+        self.times = _TimesView(self)
+
+    def __len__(self):
+        return self._tail - self._head + (0 if self._last_points is None else 1)
+
+    @property
+    def capacity(self):
+        """
+        :return: The number of frames and data points the history can currently hold.
+        :rtype: (int, int)
+        """
+        return self._frame_capacity, self._row_capacity
+
+    def append(self, t, points):
+        """
+        Add the data points found in a frame.
+
+        :param t: the time of the frame, in ms. Times must be increasing
+        :type t: int
+        :param points: the data points found in this frame
+        :type points: list(:class:`~ethoscope.core.data_point.DataPoint`)
+        """
+        if self._last_points is not None:
+            self._commit(self._last_t, self._last_points)
+        self._last_t = t
+        self._last_points = points
+
+        while self._tail - self._head > 0 and len(self) > 2 and t - self._frame_t[self._head % self._frame_capacity] > self._max_duration:
+            self._drop_oldest()
+
+    def _drop_oldest(self):
+        k = self._head % self._frame_capacity
+        self._row_head += self._frame_n[k]
+        self._frame_schema[k] = None
+        self._head += 1
+
+    def _make_room(self, t, n):
+        # one frame is kept for the last data points
+        while self._tail - self._head >= self._frame_capacity - 1:
+            if self._max_frames is None or self._frame_capacity < self._max_frames:
+                self._grow_frames()
+            else:
+                self._drop_young(t, "frames")
+        while self._row_tail - self._row_head + n > self._row_capacity:
+            if self._max_rows is None or self._row_capacity < self._max_rows:
+                self._grow_rows(n)
+            else:
+                self._drop_young(t, "rows")
+
+    def _drop_young(self, t, limit):
+        if not self._warned_full and t - self._frame_t[self._head % self._frame_capacity] <= self._max_duration:
+            logging.warning("The position history is limited to %s %s: frames younger than %i ms are dropped" %
+                            (self._max_frames if limit == "frames" else self._max_rows, limit, self._max_duration))
+            self._warned_full = True
+        self._drop_oldest()
+
+    def _grow_frames(self):
+        capacity = 2 * self._frame_capacity
+        if self._max_frames is not None:
+            capacity = min(capacity, self._max_frames)
+        old = np.arange(self._head, self._tail)
+        new = old % capacity
+        old %= self._frame_capacity
+        for name in ("_frame_t", "_frame_start", "_frame_n"):
+            buff = getattr(self, name)
+            grown = np.zeros(capacity, buff.dtype)
+            grown[new] = buff[old]
+            setattr(self, name, grown)
+        schema = [None] * capacity
+        for i, j in zip(old, new):
+            schema[j] = self._frame_schema[i]
+        self._frame_schema = schema
+        self._frame_capacity = capacity
+
+    def _grow_rows(self, n):
+        capacity = 2 * self._row_capacity
+        while capacity < self._row_tail - self._row_head + n:
+            capacity *= 2
+        if self._max_rows is not None:
+            capacity = min(capacity, self._max_rows)
+        if self._rows is not None:
+            old = np.arange(self._row_head, self._row_tail)
+            grown = np.zeros(capacity, self._rows.dtype)
+            grown[old % capacity] = self._rows[old % self._row_capacity]
+            self._rows = grown
+        self._row_capacity = capacity
+
+    def _ensure_fields(self, schema):
+        names = schema.header_names
+        if self._rows is not None and all(n in self._rows.dtype.fields for n in names):
+            return
+        fields = [("t", np.int64)]
+        if self._rows is not None:
+            fields = [(n, self._rows.dtype[n]) for n in self._rows.dtype.names]
+        known = set(f[0] for f in fields)
+        fields += [(n, np.int32) for n in names if n not in known]
+
+        new_rows = np.zeros(self._row_capacity, dtype=fields)
+        if self._rows is not None:
+            for n in self._rows.dtype.names:
+                new_rows[n] = self._rows[n]
+        self._rows = new_rows
+
+    def _commit(self, t, points):
+        n = len(points)
+        if self._max_rows is not None and n > self._max_rows:
+            raise ValueError("Cannot store %i data points in a history of %i rows" % (n, self._max_rows))
+        self._make_room(t, n)
+        for p in points:
+            self._ensure_fields(p.schema)
+
+        k = self._tail % self._frame_capacity
+        self._frame_t[k] = t
+        self._frame_start[k] = self._row_tail
+        self._frame_n[k] = n
+        self._frame_schema[k] = points[0].schema if n > 0 else None
+
+        for p in points:
+            self._set_row(self._rows, self._row_tail % self._row_capacity, t, p)
+            self._row_tail += 1
+        self._tail += 1
+
+    @staticmethod
+    def _set_row(rows, r, t, point):
+        names = point.schema.header_names
+        if rows.dtype.names[1:] == names:
+            rows[r] = (t,) + point.as_tuple()
+        else:
+            row = rows[r]
+            row["t"] = t
+            for name, value in zip(names, point.as_tuple()):
+                row[name] = value
+
+    def _absolute_frame(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if i < 0 or i >= n:
+            raise IndexError("history index out of range")
+        return self._head + i
+
+    def frame(self, i):
+        """
+        :param i: the index of a frame. Negative indices count from the last frame
+        :type i: int
+        :return: the data points of a frame. The ones of the last frame are the original objects, the others are copies.
+        :rtype: list(:class:`~ethoscope.core.data_point.DataPoint`)
+        """
+        i = self._absolute_frame(i)
+        if i == self._tail:
+            return self._last_points
+        k = i % self._frame_capacity
+        schema = self._frame_schema[k]
+        start, n = self._frame_start[k], self._frame_n[k]
+        out = []
+        for r in range(start, start + n):
+            row = self._rows[r % self._row_capacity]
+            out.append(DataPoint.from_schema(schema, [int(row[h]) for h in schema.header_names]))
+        return out
+
+    def time(self, i):
+        """
+        :param i: the index of a frame. Negative indices count from the last frame
+        :type i: int
+        :return: the time of a frame, in ms
+        :rtype: int
+        """
+        i = self._absolute_frame(i)
+        if i == self._tail:
+            return self._last_t
+        return int(self._frame_t[i % self._frame_capacity])
+
+    def value(self, i, field, j=0):
+        """
+        Get a single value without building data points.
+
+        :param i: the index of a frame. Negative indices count from the last frame
+        :type i: int
+        :param field: the header name of a variable (e.g. ``"x"``)
+        :type field: str
+        :param j: the index of the data point, within the frame
+        :type j: int
+        :return: the value of a variable
+        :rtype: int
+        """
+        i = self._absolute_frame(i)
+        if i == self._tail:
+            return self._last_points[j][field]
+        k = i % self._frame_capacity
+        if j >= self._frame_n[k]:
+            raise IndexError("data point index out of range")
+        return int(self._rows[field][(self._frame_start[k] + j) % self._row_capacity])
+
+    def since(self, t, field=None):
+        """
+        Window query over the history.
+
+        :param t: the time from which data points are returned, in ms (inclusive)
+        :type t: int
+        :param field: the header name of a variable (e.g. ``"x"``), or ``"t"``. `None` for all the variables
+        :type field: str
+        :return: the data points, in order, as a structured array or, when ``field`` is given, a single column
+        :rtype: :class:`~numpy.ndarray`
+        """
+        parts = []
+        if self._tail > self._head:
+            frames = np.arange(self._head, self._tail) % self._frame_capacity
+            first = np.searchsorted(self._frame_t[frames], t)
+            if first < len(frames):
+                rows = np.arange(self._frame_start[frames[first]], self._row_tail) % self._row_capacity
+                parts.append(self._rows[rows] if field is None else self._rows[field][rows])
+
+        if self._last_points is not None and self._last_t >= t and len(self._last_points) > 0:
+            for p in self._last_points:
+                self._ensure_fields(p.schema)
+            last = np.zeros(len(self._last_points), dtype=self._rows.dtype)
+            for r, p in enumerate(self._last_points):
+                self._set_row(last, r, self._last_t, p)
+            parts.append(last if field is None else last[field])
+
+        if len(parts) == 0:
+            if self._rows is None:
+                return np.zeros(0, np.int64)
+            return np.zeros(0, self._rows.dtype if field is None else self._rows.dtype[field])
+        return np.concatenate(parts)
+
+
+class _PositionsView(object):
+    def __init__(self, history):
+        self._history = history
+
+    def __len__(self):
+        return len(self._history)
+
+    def __getitem__(self, i):
+        return self._history.frame(i)
+
+    def __iter__(self):
+        for i in range(len(self._history)):
+            yield self._history.frame(i)
+
+
+class _TimesView(object):
+    def __init__(self, history):
+        self._history = history
+
+    def __len__(self):
+        return len(self._history)
+
+    def __getitem__(self, i):
+        return self._history.time(i)
+
+    def __iter__(self):
+        for i in range(len(self._history)):
+            yield self._history.time(i)
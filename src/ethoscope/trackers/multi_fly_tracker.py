@@ -6,11 +6,11 @@ import cv2
 CV_VERSION = int(cv2.__version__.split(".")[0])
 
 import numpy as np
-from scipy import ndimage
 from ethoscope.core.variables import XPosVariable, YPosVariable, XYDistance, WidthVariable, HeightVariable, PhiVariable, Label
 from ethoscope.core.data_point import DataPoint
 from ethoscope.trackers.trackers import BaseTracker, NoPositionError
 from ethoscope.utils.debug import EthoscopeException
+from ethoscope.utils.img_proc import grey_image
 import logging
 
 
@@ -65,11 +65,11 @@ class MultiFlyTracker(BaseTracker):
             blur_rad += 1
 
         if self._buff_grey is None:
-            self._buff_grey = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
+            self._buff_grey = grey_image(img).copy()
             if mask is None:
                 mask = np.ones_like(self._buff_grey) * 255
 
-        cv2.cvtColor(img,cv2.COLOR_BGR2GRAY, self._buff_grey)
+        grey_image(img, self._buff_grey)
         # cv2.imshow("dbg",self._buff_grey)
         cv2.GaussianBlur(self._buff_grey,(blur_rad,blur_rad),1.2, self._buff_grey)
         if darker_fg:
@@ -101,7 +101,8 @@ class MultiFlyTracker(BaseTracker):
 
     def _track(self, img,  grey, mask,t):
 
-        if self._bg_model.bg_img is None:
+        bg = self._bg_model.bg_img_uint8
+        if bg is None:
             self._buff_fg = np.empty_like(grey)
             self._buff_object= np.empty_like(grey)
             self._buff_fg_backup = np.empty_like(grey)
@@ -110,7 +111,6 @@ class MultiFlyTracker(BaseTracker):
    #         self._old_sum_fg = 0
             raise NoPositionError
 
-        bg = self._bg_model.bg_img.astype(np.uint8)
         cv2.subtract(grey, bg, self._buff_fg)
 
         cv2.threshold(self._buff_fg,20,255,cv2.THRESH_TOZERO, dst=self._buff_fg)
@@ -14,7 +14,7 @@ from ethoscope.core.variables import XPosVariable, YPosVariable, WidthVariable,
 from ethoscope.core.data_point import DataPoint
 from ethoscope.trackers.adaptive_bg_tracker import BackgroundModel
 from ethoscope.trackers.trackers import BaseTracker, NoPositionError
-from ethoscope.utils.img_proc import merge_blobs
+from ethoscope.utils.img_proc import merge_blobs, grey_image
 
 
 class AdaptiveBGModelOneObject(BaseTracker):
@@ -40,11 +40,11 @@ class AdaptiveBGModelOneObject(BaseTracker):
 
     def _pre_process_input_minimal(self, img, mask, t, darker_fg=True):
         if self._buff_grey is None:
-            self._buff_grey = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
+            self._buff_grey = grey_image(img).copy()
             if mask is None:
                 mask = np.ones_like(self._buff_grey) * 255
 
-        cv2.cvtColor(img,cv2.COLOR_BGR2GRAY, self._buff_grey)
+        grey_image(img, self._buff_grey)
 
         cv2.erode(self._buff_grey, self._erode_kern, dst=self._buff_grey)
 
@@ -83,11 +83,11 @@ class AdaptiveBGModelOneObject(BaseTracker):
 
     def _track(self, img,  grey, mask,t):
 
-        if self._bg_model.bg_img is None:
+        bg = self._bg_model.bg_img_uint8
+        if bg is None:
             self._buff_fg = np.empty_like(grey)
             raise NoPositionError
 
-        bg = self._bg_model.bg_img.astype(np.uint8)
         cv2.subtract(grey, bg, self._buff_fg)
 
         #fixme magic number
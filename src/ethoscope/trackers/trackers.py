@@ -1,9 +1,11 @@
 __author__ = 'quentin'
 
-from collections import deque
+import cv2
+import numpy as np
 
 from ethoscope.utils.description  import DescribedObject
 from ethoscope.core.variables import *
+from ethoscope.trackers.history import PositionHistory
 
 
 class NoPositionError(Exception):
@@ -12,8 +14,133 @@ class NoPositionError(Exception):
     """
     pass
 
+class ScratchPool(object):
+    def __init__(self):
+        """
+        A pool of scratch buffers that trackers borrow instead of allocating their own.
+        As ROIs are tracked one after the other, the trackers of all ROIs can share the same buffers:
+        there is one buffer per name and type, as large as the largest shape requested, and each borrowed buffer is a
+        contiguous view of it. A borrowed buffer must therefore only be used within the processing of one ROI,
+        and never hold state between frames.
+        A :class:`~ethoscope.core.monitor.Monitor` owns one pool, passed to its trackers as the ``scratch_pool`` keyword argument.
+        """
+        self._buffers = {}
+        self._views = {}
+
+    def borrow(self, name, shape, dtype=np.uint8):
+        """
+        :param name: what the buffer is used for, so that a tracker can borrow several buffers at once
+        :type name: str
+        :param shape: the shape of the buffer
+        :type shape: tuple(int)
+        :param dtype: the type of the buffer
+        :type dtype: :class:`~numpy.dtype`
+        :return: an uninitialised buffer
+        :rtype: :class:`~numpy.ndarray`
+        """
+        key = (name, np.dtype(dtype).str)
+        view_key = key + (tuple(shape),)
+        try:
+            return self._views[view_key]
+        except KeyError:
+            pass
+
+        size = int(np.prod(shape))
+        buff = self._buffers.get(key)
+        if buff is None or buff.size < size:
+            buff = np.empty(size, dtype)
+            self._buffers[key] = buff
+            # views of the former buffer would not be shared anymore
+            self._views = dict((k, v) for k, v in self._views.items() if k[0:2] != key)
+        out = buff[0:size].reshape(shape)
+        self._views[view_key] = out
+        return out
+
+    @property
+    def nbytes(self):
+        """
+        :return: The memory used by all the buffers of the pool, in bytes.
+        :rtype: int
+        """
+        return sum(b.nbytes for b in self._buffers.values())
+
+
+class MotionGate(object):
+    def __init__(self, threshold, refresh_interval=10 * 1000, downsample=4):
+        """
+        A cheap test of whether anything moved in a ROI since it was last fully processed.
+        ROI crops are shrunk, converted to grey levels and compared to the crop of the last fully processed frame.
+        The ROI is static when no pixel (within the ROI mask) changed by more than ``threshold``.
+        Designed to be used within :class:`~ethoscope.trackers.trackers.BaseTracker`.
+
+        :param threshold: the largest difference of grey level, after shrinking, that is not considered motion
+        :type threshold: int
+        :param refresh_interval: the maximal time between two fully processed frames, in ms
+        :type refresh_interval: int
+        :param downsample: the factor by which crops are shrunk
+        :type downsample: int
+        """
+        self._threshold = threshold
+        self._refresh_interval = refresh_interval
+        self._downsample = downsample
+        self._small_mask = None
+        self._reference = None
+        self._reference_t = None
+        self._buff_diff = None
+
+    def shrink(self, img, mask):
+        """
+        :param img: a ROI crop, grey or BGR
+        :type img: :class:`~numpy.ndarray`
+        :param mask: the mask of the ROI
+        :type mask: :class:`~numpy.ndarray`
+        :return: a small grey version of the crop
+        :rtype: :class:`~numpy.ndarray`
+        """
+        size = (max(1, img.shape[1] // self._downsample), max(1, img.shape[0] // self._downsample))
+        out = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+        if out.ndim == 3:
+            out = cv2.cvtColor(out, cv2.COLOR_BGR2GRAY)
+        if self._small_mask is None or self._small_mask.shape != out.shape:
+            self._small_mask = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
+            self._buff_diff = np.empty_like(out)
+        return out
+
+    def is_static(self, small, t):
+        """
+        :param small: a crop, as returned by :meth:`shrink`
+        :type small: :class:`~numpy.ndarray`
+        :param t: the time of the frame, in ms
+        :type t: int
+        :return: whether the crop can be considered identical to the reference one
+        :rtype: bool
+        """
+        if self._reference is None or self._reference.shape != small.shape:
+            return False
+        if t - self._reference_t >= self._refresh_interval:
+            return False
+        cv2.absdiff(small, self._reference, self._buff_diff)
+        cv2.bitwise_and(self._buff_diff, self._small_mask, self._buff_diff)
+        _, max_diff, _, _ = cv2.minMaxLoc(self._buff_diff)
+        return max_diff <= self._threshold
+
+    def set_reference(self, small, t):
+        """
+        Use a crop as reference. This is to be called when a frame is fully processed.
+
+        :param small: a crop, as returned by :meth:`shrink`
+        :type small: :class:`~numpy.ndarray`
+        :param t: the time of the frame, in ms
+        :type t: int
+        """
+        self._reference = small
+        self._reference_t = t
+
+
 class BaseTracker(DescribedObject):
     # data_point = None
+    # whether the tracker borrows its scratch buffers from the ``scratch_pool`` keyword argument
+    _uses_scratch_pool = False
 
     # L.Zi.: propagate *args, **kwargs, don't know what 'data' is for.
     #def __init__(self, roi, data=None):
@@ -26,17 +153,34 @@ class BaseTracker(DescribedObject):
         :param roi: The Region Of Interest the the tracker will use to locate the animal.
         :type roi: :class:`~ethoscope.rois.roi_builders.ROI`
         :param data: An optional data set. For instance, it can be used for pre-trained algorithms
+        :param motion_threshold: Enables motion gating (see :class:`~ethoscope.trackers.trackers.MotionGate`).
+            When nothing moved in the ROI since the last fully processed frame, the previous position is
+            repeated with a zero distance, instead of running ``_find_position``. `None` (default) disables it.
+        :type motion_threshold: int
+        :param motion_refresh_interval: With motion gating, the maximal time between two fully processed frames, in ms.
+            This keeps background models up to date.
+        :type motion_refresh_interval: int
+        :param motion_downsample: With motion gating, the factor by which ROI crops are shrunk before being compared
+        :type motion_downsample: int
 
         :return:
         """
         data = None
-        self._positions = deque()
-        self._times = deque()
         self._data = data
         self._roi = roi
         self._last_non_inferred_time = 0
         self._last_time_point = 0
         self._max_history_length = 250 * 1000  # in milliseconds
+        # enough for the last ``_max_history_length`` ms up to 120 fps. Beyond, the memory used per ROI stays bounded
+        self._max_history_frames = 120 * 250
+        self._history = PositionHistory(self._max_history_length, self._max_history_frames)
+
+        if kwargs.get("motion_threshold") is None:
+            self._motion_gate = None
+        else:
+            self._motion_gate = MotionGate(kwargs["motion_threshold"],
+                                           kwargs.get("motion_refresh_interval", 10 * 1000),
+                                           kwargs.get("motion_downsample", 4))
 
         # self._max_history_length = 500   # in milliseconds
         # if self.data_point is None:
@@ -55,7 +199,15 @@ class BaseTracker(DescribedObject):
         """
 
         sub_img, mask = self._roi.apply(img)
+        previous_time_point = self._last_time_point
         self._last_time_point = t
+
+        if self._motion_gate is not None:
+            small = self._motion_gate.shrink(sub_img, mask)
+            if self._motion_gate.is_static(small, t):
+                return self._repeat_position(t, previous_time_point)
+            self._motion_gate.set_reference(small, t)
+
         try:
 
             points = self._find_position(sub_img, mask, t)
@@ -72,7 +224,7 @@ class BaseTracker(DescribedObject):
                 p.append(IsInferredVariable(False))
 
         except NoPositionError:
-            if len(self._positions) == 0:
+            if len(self._history) == 0:
                 return []
             else:
 
@@ -83,35 +235,60 @@ class BaseTracker(DescribedObject):
                 for p in points:
                     p.append(IsInferredVariable(True))
 
-        self._positions.append(points)
-        self._times.append(t)
-
-
-        if len(self._times) > 2 and (self._times[-1] - self._times[0]) > self._max_history_length:
-            self._positions.popleft()
-            self._times.popleft()
+        self._history.append(t, points)
         return points
 
     def _infer_position(self, t, max_time=30 * 1000):
-        if len(self._times) == 0:
+        if len(self._history) == 0:
             return []
         if t - self._last_non_inferred_time  > max_time:
             return []
+        # copies, so that the previous data points (which may not have been saved yet) are not modified
+        return [p.copy() for p in self._history.frame(-1)]
+
+
+    def _repeat_position(self, t, previous_time_point):
+        # nothing moved, so the result of the previous frame stands, with a null distance
+        if len(self._history) == 0 or self._history.time(-1) != previous_time_point:
+            return []
 
-        return self._positions[-1]
+        if previous_time_point == self._last_non_inferred_time:
+            points = [p.copy() for p in self._history.frame(-1)]
+            is_inferred = False
+            self._last_non_inferred_time = t
+        else:
+            points = self._infer_position(t)
+            is_inferred = True
+
+        for p in points:
+            if XYDistance.header_name in p:
+                p[XYDistance.header_name] = 0
+            p.append(IsInferredVariable(is_inferred))
+        if len(points) > 0:
+            self._history.append(t, points)
+        return points
 
+    @property
+    def history(self):
+        """
+        :return: The ring buffer behind :attr:`positions` and :attr:`times`. It supports window queries, such as
+            ``history.since(t - 10000, "x")``.
+        :rtype: :class:`~ethoscope.trackers.history.PositionHistory`
+        """
+        return self._history
 
     @property
     def positions(self):
         """
-        :return: The last few positions found by the tracker.\
-            Positions are kept for a certain duration defined by the ``_max_history_length`` attribute.
-        :rtype: :class:`~collection.deque`
+        :return: The last few positions found by the tracker, as a sequence of lists of data points.\
+            Positions are kept for a certain duration defined by the ``_max_history_length`` attribute,
+            and, unless ``_max_history_frames`` is `None`, at most ``_max_history_frames`` frames.
+        :rtype: sequence
         """
-        return self._positions
+        return self._history.positions
 
     def xy_pos(self, i):
-        return self._positions[i][0]
+        return self._history.frame(i)[0]
 
     @property
     def last_time_point(self):
@@ -126,9 +303,9 @@ class BaseTracker(DescribedObject):
     def times(self):
         """
         :return: The last few time points corresponding to :class:`~ethoscope.trackers.trackers.BaseTracker.positions`.
-        :rtype: :class:`~collection.deque`
+        :rtype: sequence
         """
-        return self._times
+        return self._history.times
 
     def _find_position(self,img, mask,t):
         raise NotImplementedError
@@ -1,11 +1,12 @@
 __author__ = 'quentin'
 
-__all__ = ["io", "img_proc", "debug", "description"]
+__all__ = ["io", "img_proc", "debug", "description", "offline"]
 
 """
 import io
 import img_proc
 import debug
 import description
+import offline
 """
 
@@ -3,6 +3,25 @@ import cv2
 import numpy as np
 import itertools
 
+def grey_image(img, dst=None):
+    """
+    Converts a BGR image to greyscale. Images that already are greyscale (e.g. frames from a camera
+    with ``greyscale=True``, see :class:`~ethoscope.hardware.input.cameras.BaseCamera`) are not converted.
+
+    :param img: a BGR or greyscale image
+    :type img: :class:`~numpy.ndarray`
+    :param dst: an optional greyscale image to write the result in
+    :type dst: :class:`~numpy.ndarray`
+    :return: the greyscale image. If ``img`` is greyscale and no ``dst`` is given, ``img`` itself
+    :rtype: :class:`~numpy.ndarray`
+    """
+    if img.ndim == 2:
+        if dst is None:
+            return img
+        np.copyto(dst, img)
+        return dst
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst)
+
 def merge_blobs(contours, prop = .5):
     """
     Merge together contour according to their position and size.
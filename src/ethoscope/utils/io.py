@@ -331,6 +331,7 @@ class ResultWriter(object):
             self._metadata  = {}
 
         self._var_map_initialised = False
+        self._frame_rate_table_created = False
         if erase_old_db:
             self._create_all_tables()
         else:
@@ -419,6 +420,25 @@ class ResultWriter(object):
 
         return False
 
+    def write_frame_rate(self, t, fps, processing_time):
+        """
+        Record a new sampling rate in the 'FRAME_RATE' table.
+
+        :param t: the time stamp from which the rate applies (in ms)
+        :type t: int
+        :param fps: the sampling rate, in frames per second
+        :type fps: float
+        :param processing_time: the time needed to process a frame, in s
+        :type processing_time: float
+        """
+        if not self._frame_rate_table_created:
+            logging.info("Creating 'FRAME_RATE' table")
+            self._create_table("FRAME_RATE", "id INT  NOT NULL AUTO_INCREMENT PRIMARY KEY, t INT, fps FLOAT, processing_time INT")
+            self._frame_rate_table_created = True
+        command = "INSERT INTO FRAME_RATE VALUES %s" % str((self._null, int(round(t)), round(fps, 3),
+                                                            int(round(processing_time * 1000))))
+        self._write_async_command(command)
+
 
 
     def _add(self, t, roi, data_rows):
@@ -426,7 +446,7 @@ class ResultWriter(object):
         roi_id = roi.idx
 
         for dr in data_rows:
-            tp = (0, t) + tuple(dr.values())
+            tp = (0, t) + dr.as_tuple()
 
             if roi_id not in self._insert_dict  or self._insert_dict[roi_id] == "":
                 command = 'INSERT INTO ROI_%i VALUES %s' % (roi_id, str(tp))
@@ -439,7 +459,7 @@ class ResultWriter(object):
         # we recreate var map so we do not have duplicate entries
         self._write_async_command("DELETE FROM VAR_MAP")
 
-        for dt in data_row.values():
+        for dt in data_row.schema.variables:
             command = "INSERT INTO VAR_MAP VALUES %s"% str((dt.header_name, dt.sql_data_type, dt.functional_type))
             self._write_async_command(command)
         self._var_map_initialised = True
@@ -451,7 +471,7 @@ class ResultWriter(object):
         #fields = ["id INT  NOT NULL AUTO_INCREMENT PRIMARY KEY" ,"t INT"]
         # L. Zi.: for the specifics of SQLite, use this arrangement
         fields = ["id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL" ,"t INT"]
-        for dt in data_row.values():
+        for dt in data_row.schema.variables:
             fields.append("%s %s" % (dt.header_name, dt.sql_data_type))
         fields = ", ".join(fields)
         table_name = "ROI_%i" % roi.idx
@@ -625,7 +645,7 @@ class SQLiteResultWriter(ResultWriter):
 
         for dr in data_rows:
             # here we use NULL because SQLite does not support '0' for auto index
-            tp = (self._null, t) + tuple(dr.values())
+            tp = (self._null, t) + dr.as_tuple()
 
             if roi_id not in self._insert_dict  or self._insert_dict[roi_id] == "":
                 command = 'INSERT INTO ROI_%i VALUES %s' % (roi_id, str(tp))
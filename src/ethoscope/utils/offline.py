@@ -0,0 +1,334 @@
+__author__ = 'quentin'
+
+import logging
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from math import hypot
+
+import numpy as np
+
+from ethoscope.core.monitor import Monitor
+from ethoscope.core.variables import XPosVariable, YPosVariable, XYDistance
+from ethoscope.hardware.input.cameras import MovieVirtualCamera
+from ethoscope.roi_builders.img_roi_builder import ImgMaskROIBuilder
+from ethoscope.utils.debug import EthoscopeException
+from ethoscope.utils.io import SQLiteResultWriter
+
+
+class ChunkResultWriter(SQLiteResultWriter):
+
+    def __init__(self, db_credentials, rois, start=None, end=None, *args, **kwargs):
+        """
+        A :class:`~ethoscope.utils.io.SQLiteResultWriter` that only saves the results of a time window.
+        The frames before the window are still tracked, so the trackers can warm up.
+
+        :param db_credentials: the path of the SQLite file
+        :type db_credentials: str
+        :param rois: the regions of interest
+        :type rois: list(:class:`~ethoscope.core.roi.ROI`)
+        :param start: the time from which results are saved, in ms (inclusive). `None` for no lower limit
+        :type start: int
+        :param end: the time from which results are not saved any more, in ms (exclusive). `None` for no upper limit
+        :type end: int
+        :param args: additional arguments passed to :class:`~ethoscope.utils.io.SQLiteResultWriter`
+        :param kwargs: additional keyword arguments passed to :class:`~ethoscope.utils.io.SQLiteResultWriter`
+        """
+        self._window = (start, end)
+        super(ChunkResultWriter, self).__init__(db_credentials, rois, *args, **kwargs)
+
+    def write(self, t, roi, data_rows):
+        start, end = self._window
+        if (start is not None and t < start) or (end is not None and t >= end):
+            return
+        super(ChunkResultWriter, self).write(t, roi, data_rows)
+
+
+def split_video(frame_times, n_chunks):
+    """
+    Split a video in time windows with about the same number of frames.
+    Window limits fall between two frames, so each frame is in exactly one window.
+
+    :param frame_times: the time stamps of all frames, in ms (see :attr:`~ethoscope.hardware.input.cameras.MovieVirtualCamera.frame_times`)
+    :type frame_times: :class:`~numpy.ndarray`
+    :param n_chunks: the number of windows
+    :type n_chunks: int
+    :return: the ``(start, end)`` of each window, in ms. The start of the first window and the end of the last one are `None`.
+    :rtype: list((int, int))
+    """
+    limits = []
+    for i in np.linspace(0, len(frame_times), n_chunks + 1)[1:-1].astype(int):
+        # frames with the same time stamp stay together
+        while 0 < i < len(frame_times) and frame_times[i] <= frame_times[i - 1]:
+            i += 1
+        if i <= 0 or i >= len(frame_times):
+            continue
+        limit = int(round((frame_times[i - 1] + frame_times[i]) / 2.0))
+        if len(limits) == 0 or limit > limits[-1]:
+            limits.append(limit)
+    return list(zip([None] + limits, limits + [None]))
+
+
+def run_processes(processes, n_processes=None, poll_interval=.1):
+    """
+    Run processes, with at most ``n_processes`` at the same time.
+
+    :param processes: processes that are not started yet
+    :type processes: list(:class:`~multiprocessing.Process`)
+    :param n_processes: the maximal number of concurrent processes. `None` means one per CPU core.
+    :type n_processes: int
+    :param poll_interval: how often finished processes are checked for, in s
+    :type poll_interval: float
+    :return: the exit code of each process
+    :rtype: list(int)
+    """
+    if n_processes is None:
+        n_processes = multiprocessing.cpu_count()
+    pending = list(processes)
+    running = []
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) < n_processes:
+            p = pending.pop(0)
+            p.start()
+            running.append(p)
+        running[0].join(poll_interval)
+        running = [p for p in running if p.is_alive()]
+    return [p.exitcode for p in processes]
+
+
+def analyse_video(path, output, rois, tracker_class, start=None, end=None, warm_up=0,
+                  monitor_class=Monitor, camera_kwargs=None, tracker_kwargs=None, metadata=None):
+    """
+    Track a video file, or a time window of it, and save the results in a SQLite file.
+
+    :param path: the path of the video
+    :type path: str
+    :param output: the path of the SQLite file
+    :type output: str
+    :param rois: the regions of interest
+    :type rois: list(:class:`~ethoscope.core.roi.ROI`)
+    :param tracker_class: the tracking algorithm
+    :type tracker_class: class
+    :param start: the time, in the video, from which results are saved, in ms. `None` from the first frame
+    :type start: int
+    :param end: the time, in the video, from which results are not saved, in ms. `None` to the last frame
+    :type end: int
+    :param warm_up: how long the video is tracked before ``start``, without saving results, in s
+    :type warm_up: float
+    :param monitor_class: the class of monitor to use
+    :type monitor_class: class
+    :param camera_kwargs: additional keyword arguments for :class:`~ethoscope.hardware.input.cameras.MovieVirtualCamera`
+    :type camera_kwargs: dict
+    :param tracker_kwargs: additional keyword arguments for the monitor and the tracking algorithm
+    :type tracker_kwargs: dict
+    :param metadata: the metadata saved with the results
+    :type metadata: dict
+    :return: the number of frames read
+    :rtype: int
+    """
+    camera_kwargs = dict(camera_kwargs or {})
+    if start is not None:
+        camera_kwargs["start_time"] = max(0.0, start / 1e3 - warm_up)
+    if end is not None:
+        camera_kwargs["end_time"] = end / 1e3
+
+    camera = MovieVirtualCamera(path, **camera_kwargs)
+    try:
+        monitor = monitor_class(camera, tracker_class, rois, **(tracker_kwargs or {}))
+        with ChunkResultWriter(output, rois, start, end, metadata=metadata) as result_writer:
+            monitor.run(result_writer)
+        return monitor.last_frame_idx + 1
+    finally:
+        camera._close()
+
+
+def merge_results(chunk_outputs, output):
+    """
+    Merge the SQLite files of consecutive time windows of a video into one.
+    Tables are those of the first file, and rows of ``ROI_*`` tables are appended in order.
+
+    Each window is tracked independently, so the distance moved at the first row of a window (i.e. at a seam)
+    is computed again from the last position of the previous window.
+    Rows with no distance (e.g. inferred positions) are left as they are.
+
+    :param chunk_outputs: the paths of the SQLite files, in time order
+    :type chunk_outputs: list(str)
+    :param output: the path of the merged SQLite file
+    :type output: str
+    """
+    shutil.copy(chunk_outputs[0], output)
+    db = sqlite3.connect(output)
+    try:
+        for path in chunk_outputs[1:]:
+            db.execute("ATTACH DATABASE ? AS chunk", (path,))
+            tables = db.execute("SELECT name, sql FROM chunk.sqlite_master "
+                                "WHERE type='table' AND name LIKE 'ROI\\_%' ESCAPE '\\' AND name != 'ROI_MAP'").fetchall()
+            for table, sql in tables:
+                db.execute(sql.replace("CREATE TABLE ", "CREATE TABLE IF NOT EXISTS ", 1))
+                columns = [c[1] for c in db.execute("PRAGMA chunk.table_info(%s)" % table)]
+                previous_id = db.execute("SELECT MAX(id) FROM %s" % table).fetchone()[0]
+                fields = ", ".join(c for c in columns if c != "id")
+                db.execute("INSERT INTO %s (%s) SELECT %s FROM chunk.%s ORDER BY id" % (table, fields, fields, table))
+                if previous_id is not None:
+                    _update_seam_distance(db, table, columns, previous_id)
+            db.commit()
+            db.execute("DETACH DATABASE chunk")
+    finally:
+        db.close()
+
+
+def _update_seam_distance(db, table, columns, previous_id):
+    x, y, dist = XPosVariable.header_name, YPosVariable.header_name, XYDistance.header_name
+    if x not in columns or y not in columns or dist not in columns:
+        return
+    rows = db.execute("SELECT id, %s, %s, %s FROM %s WHERE id >= ? ORDER BY id LIMIT 2" % (x, y, dist, table),
+                      (previous_id,)).fetchall()
+    if len(rows) < 2 or rows[0][0] != previous_id or rows[1][3] == 0:
+        return
+    (_, x0, y0, _), (seam_id, x1, y1, _) = rows
+    db.execute("UPDATE %s SET %s = ? WHERE id = ?" % (table, dist), (int(round(hypot(x1 - x0, y1 - y0))), seam_id))
+
+
+def analyse_video_in_chunks(path, output, rois, tracker_class, n_chunks=None, warm_up=300, n_processes=None,
+                            monitor_class=Monitor, camera_kwargs=None, tracker_kwargs=None, metadata=None):
+    """
+    Track a long video faster, by splitting it in time windows that are tracked in parallel, by separate processes.
+    Each window is tracked from ``warm_up`` seconds before its start, so the state of the trackers (e.g. the
+    background model) has converged when results start being saved. Results are then merged in a single SQLite file,
+    as written by :class:`~ethoscope.utils.io.SQLiteResultWriter`. Time stamps are those of the video, so they are
+    continuous from one window to the next.
+
+    :param path: the path of the video
+    :type path: str
+    :param output: the path of the SQLite file
+    :type output: str
+    :param rois: the regions of interest
+    :type rois: list(:class:`~ethoscope.core.roi.ROI`)
+    :param tracker_class: the tracking algorithm
+    :type tracker_class: class
+    :param n_chunks: the number of time windows. `None` means one per process
+    :type n_chunks: int
+    :param warm_up: how long each window is tracked before its start, without saving results, in s
+    :type warm_up: float
+    :param n_processes: the maximal number of concurrent processes. `None` means one per CPU core
+    :type n_processes: int
+    :param monitor_class: the class of monitor to use
+    :type monitor_class: class
+    :param camera_kwargs: additional keyword arguments for :class:`~ethoscope.hardware.input.cameras.MovieVirtualCamera`
+    :type camera_kwargs: dict
+    :param tracker_kwargs: additional keyword arguments for the monitor and the tracking algorithm
+    :type tracker_kwargs: dict
+    :param metadata: the metadata saved with the results
+    :type metadata: dict
+    """
+    if n_processes is None:
+        n_processes = multiprocessing.cpu_count()
+    if n_chunks is None:
+        n_chunks = n_processes
+
+    camera = MovieVirtualCamera(path)
+    try:
+        windows = split_video(camera.frame_times, n_chunks)
+    finally:
+        camera._close()
+
+    tmp_dir = tempfile.mkdtemp(prefix="ethoscope_chunks_")
+    try:
+        chunk_outputs = [os.path.join(tmp_dir, "chunk_%03d.db" % i) for i in range(len(windows))]
+        processes = [multiprocessing.Process(target=analyse_video, name="chunk_%03d" % i,
+                                             args=(path, out, rois, tracker_class, start, end, warm_up, monitor_class,
+                                                   camera_kwargs, tracker_kwargs, metadata))
+                     for i, ((start, end), out) in enumerate(zip(windows, chunk_outputs))]
+
+        logging.info("Analysing '%s' in %i chunks" % (path, len(windows)))
+        t0 = time.time()
+        exit_codes = run_processes(processes, n_processes)
+        failed = [p.name for p, code in zip(processes, exit_codes) if code != 0]
+        if len(failed) > 0:
+            raise EthoscopeException("Could not analyse chunks %s of '%s'" % (", ".join(failed), path))
+        logging.info("All chunks analysed in %.1fs. Merging results" % (time.time() - t0))
+        merge_results(chunk_outputs, output)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def _analyse_job(job, tracker_class, monitor_class, stats_queue):
+    t0 = time.time()
+    rois = ImgMaskROIBuilder(job["roi_mask"]).build(None)
+    # results are only moved to their final path once complete, so interrupted jobs are run again
+    tmp_output = job["output"] + ".part"
+    metadata = {"video": job["video"], "roi_mask": job["roi_mask"]}
+    n_frames = analyse_video(job["video"], tmp_output, rois, tracker_class, monitor_class=monitor_class,
+                             camera_kwargs=job.get("camera_kwargs"), tracker_kwargs=job.get("tracker_kwargs"),
+                             metadata=metadata)
+    os.rename(tmp_output, job["output"])
+    elapsed = time.time() - t0
+    logging.info("Analysed '%s': %i frames in %.1fs (%.1f fps)" % (job["video"], n_frames, elapsed, n_frames / elapsed))
+    stats_queue.put((job["output"], n_frames, elapsed))
+
+
+def analyse_videos(jobs, tracker_class, n_processes=None, overwrite=False, monitor_class=Monitor):
+    """
+    Track many videos, each by a separate process, with a bounded number of concurrent processes.
+    Each job is a dictionary with the keys:
+
+     * ``"video"``: the path of the video
+     * ``"roi_mask"``: the path of a mask image defining the ROIs (see :class:`~ethoscope.roi_builders.img_roi_builder.ImgMaskROIBuilder`)
+     * ``"output"``: the path of the resulting SQLite file
+     * ``"camera_kwargs"`` (optional): additional keyword arguments for :class:`~ethoscope.hardware.input.cameras.MovieVirtualCamera`
+     * ``"tracker_kwargs"`` (optional): additional keyword arguments for the monitor and the tracking algorithm
+
+    :param jobs: the videos to analyse
+    :type jobs: list(dict)
+    :param tracker_class: the tracking algorithm
+    :type tracker_class: class
+    :param n_processes: the maximal number of concurrent processes. `None` means one per CPU core
+    :type n_processes: int
+    :param overwrite: whether to analyse videos whose output already exists. Otherwise, they are skipped
+    :type overwrite: bool
+    :param monitor_class: the class of monitor to use
+    :type monitor_class: class
+    :return: for each analysed video, its output, the number of frames, the processing time (in s) and the fps.
+        Failed videos have no number of frames.
+    :rtype: list(dict)
+    """
+    todo = []
+    for job in jobs:
+        if not overwrite and os.path.exists(job["output"]):
+            logging.info("Skipping '%s': '%s' already exists" % (job["video"], job["output"]))
+        else:
+            todo.append(job)
+    if len(todo) == 0:
+        return []
+
+    stats_queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_analyse_job, args=(job, tracker_class, monitor_class, stats_queue))
+                 for job in todo]
+    logging.info("Analysing %i videos (%i skipped)" % (len(todo), len(jobs) - len(todo)))
+    t0 = time.time()
+    exit_codes = run_processes(processes, n_processes)
+    elapsed = time.time() - t0
+
+    stats = {}
+    for _ in range(sum(1 for code in exit_codes if code == 0)):
+        output, n_frames, job_time = stats_queue.get()
+        stats[output] = (n_frames, job_time)
+
+    out = []
+    for job, code in zip(todo, exit_codes):
+        n_frames, job_time = stats.get(job["output"], (None, None))
+        if code != 0 or n_frames is None:
+            logging.error("Could not analyse '%s' (exit code %s)" % (job["video"], str(code)))
+        out.append({"video": job["video"],
+                    "output": job["output"],
+                    "n_frames": n_frames,
+                    "time": job_time,
+                    "fps": None if n_frames is None else n_frames / job_time})
+
+    total_frames = sum(o["n_frames"] for o in out if o["n_frames"] is not None)
+    logging.info("Analysed %i/%i videos in %.1fs: %i frames, %.1f fps overall" %
+                 (sum(1 for o in out if o["n_frames"] is not None), len(out), elapsed, total_frames, total_frames / elapsed))
+    return out
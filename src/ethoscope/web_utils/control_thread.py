@@ -10,10 +10,11 @@ from threading import Thread
 import pickle
 
 import trace
-from ethoscope.hardware.input.cameras import OurPiCameraAsync, MovieVirtualCamera, DummyPiCameraAsync, V4L2Camera
+from ethoscope.hardware.input.cameras import OurPiCameraAsync, MovieVirtualCamera, DummyPiCameraAsync, V4L2Camera, V4L2CameraAsync, NetworkCamera
 from ethoscope.roi_builders.target_roi_builder import  OlfactionAssayROIBuilder, SleepMonitorWithTargetROIBuilder, TargetGridROIBuilder
 from ethoscope.roi_builders.roi_builders import  DefaultROIBuilder
 from ethoscope.core.monitor import Monitor
+from ethoscope.core.parallel_monitor import ParallelMonitor
 from ethoscope.drawers.drawers import NullDrawer, DefaultDrawer
 from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
 from ethoscope.hardware.interfaces.interfaces import HardwareConnection
@@ -74,6 +75,10 @@ class ControlThread(Thread):
         "tracker":{
                 "possible_classes":[AdaptiveBGModel],
             },
+        # ParallelMonitor cannot run stimulators that drive hardware (e.g. sleep deprivation)
+        "monitor":{
+                "possible_classes":[Monitor, ParallelMonitor],
+            },
         "interactor":{
                         "possible_classes":[DefaultStimulator, 
                                             SleepDepStimulator,
@@ -92,7 +97,7 @@ class ControlThread(Thread):
                         "possible_classes":[DefaultDrawer, NullDrawer],
                     },
         "camera":{
-                        "possible_classes":[OurPiCameraAsync, MovieVirtualCamera, DummyPiCameraAsync, V4L2Camera],
+                        "possible_classes":[OurPiCameraAsync, MovieVirtualCamera, DummyPiCameraAsync, V4L2Camera, V4L2CameraAsync, NetworkCamera],
                     },
         "result_writer":{
                         "possible_classes":[ResultWriter, SQLiteResultWriter],
@@ -293,16 +298,22 @@ class ControlThread(Thread):
                         hardware_connection, StimulatorClass, stimulator_kwargs):
 
         #Here the stimulator passes args. Hardware connection was previously open as thread.
+        # The default stimulator never interacts, so it does not need the connection (and can then be run in parallel)
+        if StimulatorClass is DefaultStimulator:
+            hardware_connection = None
         stimulators = [StimulatorClass(hardware_connection, **stimulator_kwargs) for _ in rois]
         
         kwargs = self._monit_kwargs.copy()
         kwargs.update(tracker_kwargs)
 
+        MonitorClass = self._option_dict["monitor"]["class"]
+        monitor_kwargs = self._option_dict["monitor"]["kwargs"]
+
         # todo: pickle hardware connection, camera, rois, tracker class, stimulator class,.
         # then rerun stimulators and Monitor(......)
-        self._monit = Monitor(camera, TrackerClass, rois,
+        self._monit = MonitorClass(camera, TrackerClass, rois,
                               stimulators=stimulators,
-                              *self._monit_args)
+                              *self._monit_args, **monitor_kwargs)
         self._info["status"] = "running"
         logging.info("Setting monitor status as running: '%s'" % self._info["status"])
 
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+ This script tracks many recorded videos, using all cores of the machine.
+ Videos are listed either as a directory or as a JSON manifest, and each one is tracked
+ with the ROIs of a mask image (see ImgMaskROIBuilder), into its own SQLite result file.
+ Videos whose result file already exists are skipped, so an interrupted batch can be resumed.
+
+ A manifest is a list of jobs, e.g.:
+   [{"video": "exp1/cam1.mp4", "roi_mask": "exp1/mask.png",
+     "output": "results/cam1.db", "tracker_kwargs": {"motion_threshold": 3}}]
+ Relative paths are relative to the manifest. "output" and the kwargs are optional.
+"""
+
+__author__ = 'quentin'
+
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+VIDEO_EXTENSIONS = (".avi", ".mp4", ".mov", ".h264", ".mkv")
+ROI_MASK_SUFFIXES = ("_mask.png", "_mask.jpg")
+
+
+def jobs_from_directory(input_dir, roi_mask, output_dir):
+    jobs = []
+    for video in sorted(glob.glob(os.path.join(input_dir, "*"))):
+        stem, ext = os.path.splitext(video)
+        if ext.lower() not in VIDEO_EXTENSIONS:
+            continue
+        # a mask named after the video takes precedence over the default one
+        masks = [stem + s for s in ROI_MASK_SUFFIXES if os.path.exists(stem + s)]
+        mask = masks[0] if len(masks) > 0 else roi_mask
+        if mask is None:
+            logging.warning("No ROI mask for '%s'. Skipping it" % video)
+            continue
+        jobs.append({"video": video,
+                     "roi_mask": mask,
+                     "output": os.path.join(output_dir or input_dir, os.path.basename(stem) + ".db")})
+    return jobs
+
+
+def jobs_from_manifest(manifest, output_dir):
+    root = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest) as f:
+        jobs = json.load(f)
+    for job in jobs:
+        for k in ("video", "roi_mask", "output"):
+            if k in job:
+                job[k] = os.path.join(root, job[k])
+        if "output" not in job:
+            stem = os.path.splitext(os.path.basename(job["video"]))[0]
+            job["output"] = os.path.join(output_dir or os.path.dirname(job["video"]), stem + ".db")
+    return jobs
+
+
+def main(argv):
+    parser = ArgumentParser(description="Track all the videos of a directory, or of a JSON manifest, "
+                                        "in parallel, and save each result in a SQLite file.")
+    parser.add_argument("-i", "--input", dest="input", required=True,
+                        help="A directory of videos, or a JSON manifest of jobs.")
+    parser.add_argument("-m", "--roi-mask", dest="roi_mask", default=None,
+                        help="The default ROI mask image, for videos of a directory "
+                             "that have no '<video>_mask.png' next to them.")
+    parser.add_argument("-o", "--output-dir", dest="output_dir", default=None,
+                        help="Where result files are saved. Defaults to the directory of each video.")
+    parser.add_argument("-j", "--jobs", dest="n_processes", type=int, default=None, metavar='<n>',
+                        help="The number of videos tracked at the same time. Defaults to the number of cores.")
+    parser.add_argument("-t", "--tracker-options", dest="tracker_kwargs", default="{}",
+                        help="Keyword arguments of the tracker, as a JSON object (e.g. '{\"motion_threshold\": 3}').")
+    parser.add_argument("-c", "--camera-options", dest="camera_kwargs", default="{}",
+                        help="Keyword arguments of the video camera, as a JSON object (e.g. '{\"drop_each\": 2}').")
+    parser.add_argument("--overwrite", dest="overwrite", action="store_true",
+                        help="Track videos again, even if their result file exists.")
+    parser.add_argument("-D", "--debug", dest="debug", action="store_true",
+                        help="Shows all logging messages.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.debug else logging.WARNING,
+                        format="%(asctime)s %(processName)s %(levelname)s: %(message)s")
+
+    package_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '')
+    sys.path.insert(0, package_path)
+    from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
+    from ethoscope.utils.offline import analyse_videos
+
+    if os.path.isdir(args.input):
+        jobs = jobs_from_directory(args.input, args.roi_mask, args.output_dir)
+    else:
+        jobs = jobs_from_manifest(args.input, args.output_dir)
+
+    tracker_kwargs = json.loads(args.tracker_kwargs)
+    camera_kwargs = json.loads(args.camera_kwargs)
+    for job in jobs:
+        job["tracker_kwargs"] = dict(tracker_kwargs, **job.get("tracker_kwargs", {}))
+        job["camera_kwargs"] = dict(camera_kwargs, **job.get("camera_kwargs", {}))
+
+    if args.output_dir is not None and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    t0 = time.time()
+    stats = analyse_videos(jobs, AdaptiveBGModel, n_processes=args.n_processes, overwrite=args.overwrite)
+    elapsed = time.time() - t0
+    for s in stats:
+        if s["n_frames"] is None:
+            print("FAILED %s" % s["video"])
+        else:
+            print("%s: %i frames in %.1fs (%.1f fps)" % (s["video"], s["n_frames"], s["time"], s["fps"]))
+    n_frames = sum(s["n_frames"] for s in stats if s["n_frames"] is not None)
+    print("%i videos analysed, %i skipped. %i frames in %.1fs (%.1f fps overall)" %
+          (len(stats), len(jobs) - len(stats), n_frames, elapsed, n_frames / elapsed if elapsed > 0 else 0))
+    return 1 if any(s["n_frames"] is None for s in stats) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
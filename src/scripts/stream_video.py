@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+ This script streams a video file over TCP, as a camera would, to a NetworkCamera.
+ It stands in for a device streaming frames, e.g. to test an analysis machine.
+ Clients are served one after the other, each from the start of the video.
+"""
+
+__author__ = 'quentin'
+
+import logging
+import os
+import socket
+import sys
+import time
+from argparse import ArgumentParser
+
+
+def serve(server, path, jpeg_quality=None, real_time=False, loop=False):
+    from ethoscope.hardware.input.cameras import MovieVirtualCamera, NetworkCamera
+    while True:
+        connection, address = server.accept()
+        logging.info("Streaming '%s' to %s" % (path, str(address)))
+        cam = MovieVirtualCamera(path)
+        t0 = time.time()
+        try:
+            for t, frame in cam:
+                if real_time:
+                    to_sleep = t / 1000.0 - (time.time() - t0)
+                    if to_sleep > 0:
+                        time.sleep(to_sleep)
+                NetworkCamera.send_frame(connection, t / 1000.0, frame, jpeg_quality)
+        except socket.error as e:
+            logging.warning("Client %s disconnected: %s" % (str(address), str(e)))
+        finally:
+            cam._close()
+            connection.close()
+        if not loop:
+            break
+
+
+def main(argv):
+    parser = ArgumentParser(description="Stream a video file over TCP, to be read by a NetworkCamera.")
+    parser.add_argument("-i", "--input", dest="input", required=True, help="The video file to stream.")
+    parser.add_argument("-p", "--port", dest="port", type=int, default=9000, help="The port to listen on.")
+    parser.add_argument("-q", "--jpeg-quality", dest="jpeg_quality", type=int, default=None,
+                        help="Send JPEG frames of this quality (0-100), rather than raw pixels.")
+    parser.add_argument("-r", "--real-time", dest="real_time", action="store_true",
+                        help="Send frames at the pace of the video, rather than as fast as possible.")
+    parser.add_argument("-l", "--loop", dest="loop", action="store_true",
+                        help="Keep serving new clients once the first one is done.")
+    parser.add_argument("-D", "--debug", dest="debug", action="store_true", help="Shows all logging messages.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.debug else logging.WARNING)
+    package_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '')
+    sys.path.insert(0, package_path)
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("", args.port))
+    server.listen(1)
+    try:
+        serve(server, args.input, args.jpeg_quality, args.real_time, args.loop)
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
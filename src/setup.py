@@ -32,7 +32,6 @@ setup(
         ],
     install_requires=[
         "numpy>=1.6.1",
-        "scipy >= 0.15.1",
     ],
     tests_require=['nose', 'mock'],
     test_suite='nose.collector'